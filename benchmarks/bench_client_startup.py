@@ -0,0 +1,69 @@
+"""
+Startup benchmark: time to build the ReportingService and CustomerManagementService clients in
+a fresh process, without a WSDL cache, with a cold on-disk cache and with a warm one, plus the
+cost of asking the memoising factory for the same clients again. The import of bingads is
+timed separately and not included in the other cases.
+
+    python benchmarks/bench_client_startup.py --runs 3
+"""
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+SERVICES = ('ReportingService', 'CustomerManagementService')
+
+CHILD = """
+import sys, time
+sys.path.insert(0, {root!r})
+start = time.perf_counter()
+# ms_ads_clients imports bingads lazily, so it is imported here to keep it out of the builds.
+import bingads.service_client, suds.cache
+from ms_ads_clients import ServiceClientFactory
+imported = time.perf_counter() - start
+start = time.perf_counter()
+factory = ServiceClientFactory(None, cache_location={cache_location!r})
+for service in {services!r}:
+    factory.get_service_client(service)
+built = time.perf_counter() - start
+start = time.perf_counter()
+for service in {services!r}:
+    factory.get_service_client(service)
+print(imported, built, time.perf_counter() - start)
+"""
+
+
+def run_child(cache_location):
+    code = CHILD.format(root=ROOT, cache_location=cache_location, services=SERVICES)
+    output = subprocess.check_output([sys.executable, '-c', code])
+    return [float(value) for value in output.split()]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Service client startup benchmark")
+    parser.add_argument("-r", "--runs", type=int, metavar="", default=3, help="Number of processes per case")
+    args = parser.parse_args()
+
+    cache_location = tempfile.mkdtemp(prefix='ms_ads_wsdl_cache_')
+    try:
+        results = {'import': [], 'no cache': [], 'cold cache': [], 'warm cache': [], 'memoised': []}
+        for _ in range(args.runs):
+            imported, built, _memoised = run_child(None)
+            results['import'].append(imported)
+            results['no cache'].append(built)
+            shutil.rmtree(cache_location)
+            results['cold cache'].append(run_child(cache_location)[1])
+            imported, built, memoised = run_child(cache_location)
+            results['warm cache'].append(built)
+            results['memoised'].append(memoised)
+    finally:
+        shutil.rmtree(cache_location, ignore_errors=True)
+
+    print("services: {0}".format(', '.join(SERVICES)))
+    for case in ('import', 'no cache', 'cold cache', 'warm cache', 'memoised'):
+        print("{0:<11} {1:.3f}s (best of {2})".format(case + ':', min(results[case]), args.runs))
@@ -0,0 +1,90 @@
+"""
+CSV parsing benchmark: converting a synthetic keyword performance report into typed Parquet,
+row by row (csv.reader + BQ_TYPE_CONVERTERS, the current path) versus pyarrow's vectorized
+csv reader (DataUploader(vectorized=True)). The file has the columns of the keyword table,
+with '--' placeholders, thousands separators and percentages, and the two outputs are
+compared.
+
+    python benchmarks/bench_csv_parsing.py --rows 5000000
+"""
+import argparse
+import collections
+import csv
+import io
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import ms_ads_arrow
+from ms_ads_reports import REPORT_DEFINITIONS
+from ms_ads_transform import CSV_ENCODING, read_csv_rows
+
+# The arrow helpers only read name and field_type from bigquery.SchemaField.
+SchemaField = collections.namedtuple('SchemaField', ['name', 'field_type'])
+
+
+def get_value(name, field_type, row_number):
+    if row_number % 50 == 0 and name not in ('TimePeriod', '_insert_time'):
+        return '--'
+    if field_type == 'INT64':
+        value = random.randint(0, 20000)
+        return '{0:,}'.format(value) if name == 'Impressions' else str(value)
+    if field_type == 'FLOAT64':
+        value = round(random.uniform(0, 500), 2)
+        return '{0}%'.format(value) if name.endswith('Rate') else str(value)
+    if field_type == 'DATE':
+        return '2026-09-{0:02d}'.format(row_number % 28 + 1)
+    if field_type == 'TIMESTAMP':
+        return '2026-10-01 06:00:00'
+    return '{0} {1}'.format(name, row_number % 1000)
+
+
+def write_keyword_report(file_path, bq_schema, row_count):
+    with open(file_path, 'w', encoding=CSV_ENCODING, newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow([field.name for field in bq_schema])
+        # Distinct rows are cycled, generating 5M random rows would take longer than parsing them.
+        rows = [[get_value(field.name, field.field_type, row_number) for field in bq_schema]
+                for row_number in range(min(row_count, 10000))]
+        for row_number in range(row_count):
+            writer.writerow(rows[row_number % len(rows)])
+
+
+def timed(convert):
+    start = time.perf_counter()
+    buffer = io.BytesIO()
+    row_count = convert(buffer)
+    return time.perf_counter() - start, row_count, buffer
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="CSV parsing benchmark")
+    parser.add_argument("-r", "--rows", type=int, default=5000000, help="Number of rows of the report")
+    args = parser.parse_args()
+
+    definition = REPORT_DEFINITIONS['keyword_performance_report']
+    schema = [SchemaField(name, field_type) for name, field_type in definition.get_table_columns()]
+    directory = tempfile.mkdtemp()
+    csv_path = os.path.join(directory, 'keyword_performance_report_output.csv')
+    write_keyword_report(csv_path, schema, args.rows)
+    print("{0} rows, {1:.0f}MB".format(args.rows, os.path.getsize(csv_path) / 1024.0 ** 2))
+
+    row_seconds, row_count, row_buffer = timed(
+        lambda buffer: ms_ads_arrow.write_parquet(read_csv_rows(csv_path), schema, buffer))
+    print("row by row: {0:.2f}s ({1:,.0f} rows/s)".format(row_seconds, row_count / row_seconds))
+    vectorized_seconds, row_count, vectorized_buffer = timed(
+        lambda buffer: ms_ads_arrow.write_parquet_batches(ms_ads_arrow.read_csv_record_batches(csv_path, schema),
+                                                          schema, buffer))
+    print("vectorized: {0:.2f}s ({1:,.0f} rows/s), {2:.1f}x".format(vectorized_seconds, row_count / vectorized_seconds,
+                                                                   row_seconds / vectorized_seconds))
+
+    row_buffer.seek(0)
+    vectorized_buffer.seek(0)
+    same = ms_ads_arrow.pq.read_table(row_buffer).equals(ms_ads_arrow.pq.read_table(vectorized_buffer))
+    print("same output: {0}".format(same))
+    os.remove(csv_path)
+    os.rmdir(directory)
@@ -0,0 +1,53 @@
+"""
+Import-time benchmark: wall time of importing each module of the extractor, and of running
+`ms_ads_extractor.py --help`, in fresh processes. Same measure as the cumulative column of
+`python -X importtime`, which can be printed with --importtime for a full breakdown.
+
+    python benchmarks/bench_import_time.py --runs 5
+"""
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MODULES = ('ms_ads', 'ms_ads_uploads', 'ms_ads_pipeline', 'ms_ads_arrow', 'ms_ads_state')
+
+CHILD = """
+import sys, time
+sys.path.insert(0, {root!r})
+start = time.perf_counter()
+import {module}
+print(time.perf_counter() - start)
+"""
+
+
+def time_import(module):
+    output = subprocess.check_output([sys.executable, '-c', CHILD.format(root=ROOT, module=module)])
+    return float(output)
+
+
+def time_help():
+    start = time.perf_counter()
+    subprocess.check_call([sys.executable, os.path.join(ROOT, 'ms_ads_extractor.py'), '--help'],
+                          stdout=subprocess.DEVNULL)
+    return time.perf_counter() - start
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Import time benchmark")
+    parser.add_argument("-r", "--runs", type=int, default=5, help="Number of processes per case")
+    parser.add_argument("--importtime", action="store_true", help="Also print python -X importtime for ms_ads")
+    args = parser.parse_args()
+
+    for module in MODULES:
+        seconds = min(time_import(module) for _ in range(args.runs))
+        print("import {0:<16} {1:.1f}ms (best of {2})".format(module + ':', seconds * 1000, args.runs))
+    seconds = min(time_help() for _ in range(args.runs))
+    print("extractor --help:       {0:.1f}ms (best of {1}, includes interpreter startup)".format(seconds * 1000,
+                                                                                            args.runs))
+
+    if args.importtime:
+        subprocess.check_call([sys.executable, '-X', 'importtime', '-c', 'import ms_ads'], cwd=ROOT)
@@ -0,0 +1,43 @@
+"""
+Micro-benchmark: cost of building the report requests of every account, rebuilding all suds
+objects per account versus reusing the templates of ReportRequestCache.
+
+    python benchmarks/bench_request_templates.py --accounts 200
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import ms_ads
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Report request build benchmark")
+    parser.add_argument("-a", "--accounts", type=int, metavar="", default=200, help="Number of accounts")
+    args = parser.parse_args()
+
+    reporting_service = ms_ads.ServiceClient(
+        service='ReportingService',
+        version=13,
+        authorization_data=None,
+        environment='production',
+    )
+    extractor = ms_ads.MicrosoftAdsAPI('client_id', 'developer_token', 'production', '', 'client_state')
+    date_from, date_to = extractor.get_custom_dates(29, 0)
+    account_ids = range(1, args.accounts + 1)
+
+    start = time.perf_counter()
+    for account_id in account_ids:
+        extractor.build_report_request(account_id, reporting_service, date_from, date_to)
+    uncached = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for account_id in account_ids:
+        extractor.get_report_request(account_id, reporting_service, date_from, date_to)
+    cached = time.perf_counter() - start
+
+    print("accounts: {0}".format(args.accounts))
+    print("rebuilt per account: {0:.3f}s ({1:.2f}ms per account)".format(uncached, uncached * 1000 / args.accounts))
+    print("template cache:      {0:.3f}s ({1:.2f}ms per account)".format(cached, cached * 1000 / args.accounts))
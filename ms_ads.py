@@ -1,10 +1,20 @@
-import webbrowser
-from bingads.service_client import ServiceClient
-from bingads.authorization import AuthorizationData, OAuthDesktopMobileAuthCodeGrant
-from bingads.v13.reporting import *
-from suds import WebFault
-import time
+import importlib
+import os
+import shutil
+import sys
+import threading
 import datetime as dt
+from collections import OrderedDict
+from ms_ads_auth import OAuthTokenManager
+from ms_ads_clients import ServiceClientFactory
+from ms_ads_download import HttpConnectionPool, extract_zip_chunks, iter_url_chunks
+from ms_ads_retry import WEBFAULT_ERROR_ATTRIBUTE_SETS, ReportRunError, RetryBudget, RetryPolicy, call_with_retry
+from ms_ads_reports import REPORT_DEFINITIONS, ReportRequestCache, build_report_request, get_profile_column_names, \
+    get_profile_suffix, get_request_fingerprint, shard_date_range
+from ms_ads_transform import chunked, concat_csv_rows, read_csv_rows, split_csv_by_column, write_csv_rows
+from ms_ads_state import DOWNLOADED, READY, SUBMITTED, UPLOADED
+from ms_ads_scheduler import ConcurrentReportRunner, ReportJob, ReportPollingScheduler, ReadyTimeStats, chain_future, \
+    fetch_pages
 
 REFERENCE = """
     Bing Ads API Client Libraries
@@ -32,6 +42,27 @@ REFERENCE = """
 
 """
 
+# bingads takes most of the import time of this module (it builds a suds client at import), so
+# its names are imported on first use. They are still available as ms_ads.<name>.
+LAZY_IMPORTS = {
+    'AuthorizationData': 'bingads.authorization',
+    'OAuthDesktopMobileAuthCodeGrant': 'bingads.authorization',
+    'OAuthTokenRequestException': 'bingads.exceptions',
+    'ServiceClient': 'bingads.service_client',
+    'ReportingServiceManager': 'bingads.v13.reporting',
+    'ReportingDownloadParameters': 'bingads.v13.reporting',
+    'WebFault': 'suds',
+}
+
+
+def __getattr__(name):
+    if name not in LAZY_IMPORTS:
+        raise AttributeError("module {0!r} has no attribute {1!r}".format(__name__, name))
+    value = getattr(importlib.import_module(LAZY_IMPORTS[name]), name)
+    globals()[name] = value
+    return value
+
+
 class MicrosoftAdsAPI(object):
     def __init__(self, client_id, developer_token, environment, refresh_token, client_state):
         self.CLIENT_ID = client_id
@@ -45,22 +76,90 @@ class MicrosoftAdsAPI(object):
         else:
             self.FILE_DIRECTORY = r''
         self.TIMEOUT_IN_MILLISECONDS = 3600000
+        self.REPORT_READY_TIMES_FILE = r'./ms_ads/state/report_ready_times.json'
+        self.report_request_cache = ReportRequestCache()
+        self.WATERMARK_FILE = r'./ms_ads/state/watermarks.json'
+        # The ads dictionary always covers its own 1000 day window, so it is never narrowed.
+        self.WATERMARK_EXCLUDED_REPORTS = ('ads_dictionary_report',)
+        self.ADS_DICTIONARY_DAYS_BACK = 1000
+        # Once an account is in the ads dictionary cache, only this many recent days are requested.
+        self.ADS_DICTIONARY_REFRESH_DAYS = 7
+        self.ADS_DICTIONARY_CACHE_FILE = r'./ms_ads/state/ads_dictionary.csv'
+        # Reports requested in date shards of at most this many days, which run in parallel and are
+        # stitched back together, e.g. {'search_query_performance_report': 7}. Every shard is a
+        # report request of its own, so no report is sharded unless it is listed here.
+        # With row count stats the size adapts to SHARD_TARGET_ROWS per shard.
+        self.SHARD_DAYS = {}
+        self.SHARD_TARGET_ROWS = 500000
+        self.SHARD_RETRIES = 2
+        self.ROW_COUNT_STATS_FILE = r'./ms_ads/state/row_counts.json'
+        self.ACCOUNTS_CACHE_FILE = r'./ms_ads/state/accounts.json'
+        self.account_refresh_thread = None
+        # The access token is refreshed this many seconds before it expires.
+        self.TOKEN_REFRESH_MARGIN_SECONDS = 300
+        self.token_manager = None
+        # Parsed WSDLs are cached here by suds across runs.
+        self.WSDL_CACHE_DIRECTORY = r'./ms_ads/state/wsdl_cache'
+        self.service_client_factory = None
+        self.connection_pool = None
+        # Every report is retried on its own on throttling and transient faults, within a retry
+        # budget shared by the whole run.
+        self.retry_policy = RetryPolicy()
+        self.RETRY_BUDGET = 100
+        # Downloaded report results, kept across runs; see ReportResultCache.
+        self.RESULT_CACHE_DIRECTORY = r'./ms_ads/cache/results'
+        # Task states of the current run, so that an interrupted run can be resumed; see RunJournal.
+        self.RUN_JOURNAL_FILE = r'./ms_ads/state/run_journal.jsonl'
+        # Column profile per report name: a COLUMN_PROFILES name or a list of columns; reports that
+        # are not listed request every column. Set before requesting reports.
+        self.COLUMN_PROFILES = {}
+
+    def authenticate(self, authorization_data, account_cache=None, background_refresh=False, page_wave_size=1):
+        """
+        Signs in and returns the ids of the advertiser accounts the user can access. With an
+        account_cache, a fresh cached list is returned without calling the CustomerManagementService.
+        With background_refresh, an expired list is returned as well and refreshed on a background
+        thread (self.account_refresh_thread) while the reports are requested.
 
-    def authenticate(self, authorization_data):
-        customer_service = ServiceClient(
-            service='CustomerManagementService',
-            version=13,
-            authorization_data=authorization_data,
-            environment=self.ENVIRONMENT,
-        )
-
+        page_wave_size is the number of SearchAccounts pages requested in parallel.
+        """
         # You should authenticate for Bing Ads API service operations with a Microsoft Account.
         self.authenticate_with_oauth(authorization_data)
 
+        if account_cache is not None:
+            if account_cache.is_fresh() or (background_refresh and account_cache.accounts is not None):
+                if not account_cache.is_fresh():
+                    self.account_refresh_thread = threading.Thread(target=self.refresh_account_cache,
+                                                                   args=(authorization_data, account_cache,
+                                                                         page_wave_size))
+                    self.account_refresh_thread.start()
+                self.output_status_message("Using {0} cached accounts".format(len(account_cache.accounts)))
+                return account_cache.get_account_ids()
+
+        accounts = self.get_advertiser_accounts(authorization_data, page_wave_size)
+        if account_cache is not None:
+            account_cache.update(accounts)
+            account_cache.save()
+        return [account['Id'] for account in accounts]
+
+    def get_service_client_factory(self, authorization_data):
+        if self.service_client_factory is None or self.service_client_factory.authorization_data is not authorization_data:
+            self.service_client_factory = ServiceClientFactory(authorization_data, self.ENVIRONMENT,
+                                                               self.WSDL_CACHE_DIRECTORY)
+        return self.service_client_factory
+
+    def get_advertiser_accounts(self, authorization_data, page_wave_size=1):
+        service_client_factory = self.get_service_client_factory(authorization_data)
+
+        def customer_service_factory():
+            return service_client_factory.create_service_client('CustomerManagementService')
+
+        customer_service = service_client_factory.get_service_client('CustomerManagementService')
+
         # Set to an empty user identifier to get the current authenticated Microsoft Advertising user,
         # and then search for all accounts the user can access.
         user = get_user_response = customer_service.GetUser(UserId=None).User
-        accounts = self.search_accounts_by_user_id(customer_service, user.Id)
+        accounts = self.search_accounts_by_user_id(customer_service, user.Id, customer_service_factory, page_wave_size)
 
         # Custom Added Code
         account_ids = [{k.Id: k.Name} for k in accounts['AdvertiserAccount']]
@@ -69,9 +168,30 @@ class MicrosoftAdsAPI(object):
         # For this example we'll use the first account.
         # authorization_data.account_id = accounts['AdvertiserAccount'][0].Id
         # authorization_data.customer_id = accounts['AdvertiserAccount'][0].ParentCustomerId
-        return [k.Id for k in accounts['AdvertiserAccount']]
+        return [{'Id': k.Id, 'Name': k.Name, 'ParentCustomerId': k.ParentCustomerId}
+                for k in accounts['AdvertiserAccount']]
+
+    def refresh_account_cache(self, authorization_data, account_cache, page_wave_size=1):
+        try:
+            account_cache.update(self.get_advertiser_accounts(authorization_data, page_wave_size))
+            account_cache.save()
+        except Exception as ex:
+            # The cached list stays in place and is refreshed again on the next run.
+            self.output_status_message("Refreshing the account list failed: {0}".format(ex))
 
     def authenticate_with_oauth(self, authorization_data):
+        """
+        Signs in once per process: later calls reuse the authentication of the token manager,
+        whose access token is kept valid in the background, instead of exchanging the refresh
+        token again.
+        """
+        from bingads.authorization import OAuthDesktopMobileAuthCodeGrant
+        from bingads.exceptions import OAuthTokenRequestException
+
+        if self.token_manager is not None and self.token_manager.has_valid_token():
+            authorization_data.authentication = self.token_manager.authentication
+            return
+
         authentication = OAuthDesktopMobileAuthCodeGrant(
             client_id=self.CLIENT_ID,
             env=self.ENVIRONMENT
@@ -101,7 +221,14 @@ class MicrosoftAdsAPI(object):
             # The user must first sign in and if needed grant the client application access to the requested scope.
             self.request_user_consent(authorization_data)
 
+        if self.token_manager is not None:
+            self.token_manager.stop()
+        self.token_manager = OAuthTokenManager(authorization_data.authentication, self.TOKEN_REFRESH_MARGIN_SECONDS)
+        self.token_manager.start_background_refresh()
+
     def request_user_consent(self, authorization_data):
+        import webbrowser
+
         webbrowser.open(authorization_data.authentication.get_authorization_endpoint(), new=1)
         # For Python 3.x use 'input' instead of 'raw_input'
         if sys.version_info.major >= 3:
@@ -149,7 +276,7 @@ class MicrosoftAdsAPI(object):
             file.close()
         return None
 
-    def search_accounts_by_user_id(self, customer_service, user_id):
+    def search_accounts_by_user_id(self, customer_service, user_id, customer_service_factory=None, wave_size=1):
         predicates = {
             'Predicate': [
                 {
@@ -160,32 +287,47 @@ class MicrosoftAdsAPI(object):
             ]
         }
 
-        accounts = []
-
-        page_index = 0
-        PAGE_SIZE = 100
-        found_last_page = False
-
-        while not found_last_page:
-            paging = self.set_elements_to_none(customer_service.factory.create('ns5:Paging'))
-            paging.Index = page_index
-            paging.Size = PAGE_SIZE
-            search_accounts_response = customer_service.SearchAccounts(
-                PageInfo=paging,
-                Predicates=predicates
-            )
-
-            if search_accounts_response is not None and hasattr(search_accounts_response, 'AdvertiserAccount'):
-                accounts.extend(search_accounts_response['AdvertiserAccount'])
-                found_last_page = PAGE_SIZE > len(search_accounts_response['AdvertiserAccount'])
-                page_index += 1
-            else:
-                found_last_page = True
+        accounts = self.get_paged_results(customer_service, 'SearchAccounts', 'AdvertiserAccount',
+                                          customer_service_factory=customer_service_factory, wave_size=wave_size,
+                                          Predicates=predicates)
 
         return {
             'AdvertiserAccount': accounts
         }
 
+    def get_paged_results(self, customer_service, operation, item_name, page_size=100, customer_service_factory=None,
+                          wave_size=1, **kwargs):
+        """
+        Calls a paged CustomerManagementService operation until a short page is returned and
+        returns the items of all pages. With wave_size > 1 the pages after the first one are
+        fetched wave_size at a time in parallel; suds clients are not thread-safe, so each
+        worker thread then gets its own client from customer_service_factory, while the calling
+        thread uses customer_service.
+        """
+        local = threading.local()
+        calling_thread = threading.current_thread()
+
+        def get_customer_service():
+            if customer_service_factory is None or wave_size <= 1 or threading.current_thread() is calling_thread:
+                return customer_service
+            if getattr(local, 'customer_service', None) is None:
+                local.customer_service = customer_service_factory()
+            return local.customer_service
+
+        def fetch_page(page_index):
+            _customer_service = get_customer_service()
+            paging = self.set_elements_to_none(_customer_service.factory.create('ns5:Paging'))
+            paging.Index = page_index
+            paging.Size = page_size
+            response = getattr(_customer_service, operation)(PageInfo=paging, **kwargs)
+            if response is not None and hasattr(response, item_name):
+                return response[item_name]
+            return []
+
+        if customer_service_factory is None:
+            wave_size = 1
+        return fetch_pages(fetch_page, page_size, wave_size)
+
     @staticmethod
     def set_elements_to_none(suds_object):
         for (element) in suds_object:
@@ -209,21 +351,33 @@ class MicrosoftAdsAPI(object):
             self.output_status_message("Message: {0}".format(error.Message))
         self.output_status_message('')
 
+    def call_with_retry(self, func, description, budget=None):
+        """
+        Calls func() with the retry policy of the extractor; see ms_ads_retry.call_with_retry.
+        Every attempt first makes sure that the access token is valid, in case its background
+        refresh failed, and auth faults are retried once the token has been refreshed.
+        """
+        def on_retry(ex, category, attempt, delay):
+            self.output_status_message("{0} failed with a {1} error (attempt {2}), retrying in {3:.0f}s: {4}".format(
+                description, category, attempt, delay, ex))
+
+        if self.token_manager is None:
+            return call_with_retry(func, self.retry_policy, budget, on_retry)
+
+        def call():
+            self.token_manager.ensure_valid_token()
+            return func()
+
+        def on_auth_error():
+            self.token_manager.refresh(force=True)
+
+        return call_with_retry(call, self.retry_policy, budget, on_retry, on_auth_error)
+
     def output_webfault_errors(self, ex):
         if not hasattr(ex.fault, "detail"):
             raise Exception("Unknown WebFault")
 
-        error_attribute_sets = (
-            ["ApiFault", "OperationErrors", "OperationError"],
-            ["AdApiFaultDetail", "Errors", "AdApiError"],
-            ["ApiFaultDetail", "BatchErrors", "BatchError"],
-            ["ApiFaultDetail", "OperationErrors", "OperationError"],
-            ["EditorialApiFaultDetail", "BatchErrors", "BatchError"],
-            ["EditorialApiFaultDetail", "EditorialErrors", "EditorialError"],
-            ["EditorialApiFaultDetail", "OperationErrors", "OperationError"],
-        )
-
-        for error_attribute_set in error_attribute_sets:
+        for error_attribute_set in WEBFAULT_ERROR_ATTRIBUTE_SETS:
             if self.output_error_detail(ex.fault.detail, error_attribute_set):
                 return
 
@@ -263,36 +417,20 @@ class MicrosoftAdsAPI(object):
             exclude_report_header,
             report_file_format,
             return_only_complete_data,
-            report_time):
-
-        report_request = _reporting_service.factory.create('BudgetSummaryReportRequest')
-        report_request.ExcludeColumnHeaders = exclude_column_headers
-        report_request.ExcludeReportFooter = exclude_report_footer
-        report_request.ExcludeReportHeader = exclude_report_header
-        report_request.Format = report_file_format
-        report_request.ReturnOnlyCompleteData = return_only_complete_data
-        report_request.Time = report_time
-        report_request.ReportName = "budget_summary_report"
-        scope = _reporting_service.factory.create('AccountThroughCampaignReportScope')
-        scope.AccountIds = {'long': [account_id]}
-        scope.Campaigns = None
-        report_request.Scope = scope
-
-        report_columns = _reporting_service.factory.create('ArrayOfBudgetSummaryReportColumn')
-        report_columns.BudgetSummaryReportColumn.append([
-            'AccountName',
-            'AccountNumber',
-            'AccountId',
-            'CampaignName',
-            'CampaignId',
-            'Date',
-            'CurrencyCode',
-            'MonthlyBudget',
-            'DailySpend',
-            'MonthToDateSpend'
-        ])
-        report_request.Columns = report_columns
-        return report_request
+            report_time,
+            columns=None):
+        return build_report_request(
+            _reporting_service,
+            REPORT_DEFINITIONS['budget_summary_report'],
+            account_id=account_id,
+            aggregation=None,
+            exclude_column_headers=exclude_column_headers,
+            exclude_report_footer=exclude_report_footer,
+            exclude_report_header=exclude_report_header,
+            report_file_format=report_file_format,
+            return_only_complete_data=return_only_complete_data,
+            report_time=report_time,
+            columns=columns)
 
     @staticmethod
     def get_campaign_performance_report_request(
@@ -304,35 +442,20 @@ class MicrosoftAdsAPI(object):
             exclude_report_header,
             report_file_format,
             return_only_complete_data,
-            report_time):
-
-        report_request = _reporting_service.factory.create('CampaignPerformanceReportRequest')
-        report_request.Aggregation = aggregation
-        report_request.ExcludeColumnHeaders = exclude_column_headers
-        report_request.ExcludeReportFooter = exclude_report_footer
-        report_request.ExcludeReportHeader = exclude_report_header
-        report_request.Format = report_file_format
-        report_request.ReturnOnlyCompleteData = return_only_complete_data
-        report_request.Time = report_time
-        report_request.ReportName = "campaign_performance_report"
-        scope = _reporting_service.factory.create('AccountThroughCampaignReportScope')
-        scope.AccountIds = {'long': [account_id]}
-        scope.Campaigns = None
-        report_request.Scope = scope
-
-        report_columns = _reporting_service.factory.create('ArrayOfCampaignPerformanceReportColumn')
-        report_columns.CampaignPerformanceReportColumn.append([
-            'TimePeriod',
-            'CampaignId',
-            'CampaignName',
-            'DeviceType',
-            'Network',
-            'Impressions',
-            'Clicks',
-            'Spend'
-        ])
-        report_request.Columns = report_columns
-        return report_request
+            report_time,
+            columns=None):
+        return build_report_request(
+            _reporting_service,
+            REPORT_DEFINITIONS['campaign_performance_report'],
+            account_id=account_id,
+            aggregation=aggregation,
+            exclude_column_headers=exclude_column_headers,
+            exclude_report_footer=exclude_report_footer,
+            exclude_report_header=exclude_report_header,
+            report_file_format=report_file_format,
+            return_only_complete_data=return_only_complete_data,
+            report_time=report_time,
+            columns=columns)
 
     @staticmethod
     def get_search_query_performance_report_request(
@@ -344,80 +467,24 @@ class MicrosoftAdsAPI(object):
             exclude_report_header,
             report_file_format,
             return_only_complete_data,
-            report_time):
+            report_time,
+            columns=None):
         """
         Reference:  https://docs.microsoft.com/en-us/advertising/reporting-service/searchqueryperformancereportrequest?view=bingads-13
                     https://docs.microsoft.com/en-us/advertising/reporting-service/searchqueryperformancereportcolumn?view=bingads-13
         """
-
-        report_request = _reporting_service.factory.create('SearchQueryPerformanceReportRequest')
-        report_request.Aggregation = aggregation
-        report_request.ExcludeColumnHeaders = exclude_column_headers
-        report_request.ExcludeReportFooter = exclude_report_footer
-        report_request.ExcludeReportHeader = exclude_report_header
-        report_request.Format = report_file_format
-        report_request.ReturnOnlyCompleteData = return_only_complete_data
-        report_request.Time = report_time
-        report_request.ReportName = "search_query_performance_report"
-        scope = _reporting_service.factory.create('AccountThroughAdGroupReportScope')
-        scope.AccountIds = {'long': [account_id]}
-        scope.Campaigns = None
-        scope.AdGroups = None
-        report_request.Scope = scope
-
-        report_columns = _reporting_service.factory.create('ArrayOfSearchQueryPerformanceReportColumn')
-        report_columns.SearchQueryPerformanceReportColumn.append([
-            "AccountName",
-            "AccountNumber",
-            "AccountId",
-            "TimePeriod",
-            "CampaignName",
-            "CampaignId",
-            "AdGroupName",
-            "AdGroupId",
-            "AdId",
-            "AdType",
-            "DestinationUrl",
-            "BidMatchType",
-            "DeliveredMatchType",
-            "CampaignStatus",
-            "AdStatus",
-            "Impressions",
-            "Clicks",
-            "AverageCpc",
-            "Spend",
-            "AveragePosition",
-            "SearchQuery",
-            "Keyword",
-            "AdGroupCriterionId",
-            "Conversions",
-            "CostPerConversion",
-            "Language",
-            "KeywordId",
-            "Network",
-            "TopVsOther",
-            "DeviceType",
-            "DeviceOS",
-            "Assists",
-            "Revenue",
-            "ReturnOnAdSpend",
-            "CostPerAssist",
-            "RevenuePerConversion",
-            "RevenuePerAssist",
-            "AccountStatus",
-            "AdGroupStatus",
-            "KeywordStatus",
-            "CampaignType",
-            "CustomerId",
-            "CustomerName",
-            "AllConversions",
-            "AllRevenue",
-            "AllCostPerConversion",
-            "AllReturnOnAdSpend",
-            "AllRevenuePerConversion"
-        ])
-        report_request.Columns = report_columns
-        return report_request
+        return build_report_request(
+            _reporting_service,
+            REPORT_DEFINITIONS['search_query_performance_report'],
+            account_id=account_id,
+            aggregation=aggregation,
+            exclude_column_headers=exclude_column_headers,
+            exclude_report_footer=exclude_report_footer,
+            exclude_report_header=exclude_report_header,
+            report_file_format=report_file_format,
+            return_only_complete_data=return_only_complete_data,
+            report_time=report_time,
+            columns=columns)
 
     @staticmethod
     def get_keyword_performance_report_request(
@@ -429,96 +496,24 @@ class MicrosoftAdsAPI(object):
             exclude_report_header,
             report_file_format,
             return_only_complete_data,
-            report_time):
+            report_time,
+            columns=None):
         """
         Reference:  https://docs.microsoft.com/en-us/advertising/reporting-service/keywordperformancereportrequest?view=bingads-13
                     https://docs.microsoft.com/en-us/advertising/reporting-service/keywordperformancereportcolumn?view=bingads-13
         """
-        report_request = _reporting_service.factory.create('KeywordPerformanceReportRequest')
-        report_request.Aggregation = aggregation
-        report_request.ExcludeColumnHeaders = exclude_column_headers
-        report_request.ExcludeReportFooter = exclude_report_footer
-        report_request.ExcludeReportHeader = exclude_report_header
-        report_request.Format = report_file_format
-        report_request.ReturnOnlyCompleteData = return_only_complete_data
-        report_request.Time = report_time
-        report_request.ReportName = "keyword_performance_report"
-        scope = _reporting_service.factory.create('AccountThroughAdGroupReportScope')
-        scope.AccountIds = {'long': [account_id]}
-        scope.Campaigns = None
-        scope.AdGroups = None
-        report_request.Scope = scope
-        report_columns = _reporting_service.factory.create('ArrayOfKeywordPerformanceReportColumn')
-        report_columns.KeywordPerformanceReportColumn.append([
-            "AccountName",
-            "AccountNumber",
-            "AccountId",
-            "TimePeriod",
-            "CampaignName",
-            "CampaignId",
-            "AdGroupName",
-            "AdGroupId",
-            "Keyword",
-            "KeywordId",
-            "AdId",
-            "AdType",
-            "DestinationUrl",
-            "CurrentMaxCpc",
-            "CurrencyCode",
-            "DeliveredMatchType",
-            "AdDistribution",
-            "Impressions",
-            "Clicks",
-            "AverageCpc",
-            "Spend",
-            "AveragePosition",
-            "Conversions",
-            "CostPerConversion",
-            "BidMatchType",
-            "DeviceType",
-            "QualityScore",
-            "ExpectedCtr",
-            "AdRelevance",
-            "LandingPageExperience",
-            "Language",
-            "HistoricalQualityScore",
-            "HistoricalExpectedCtr",
-            "HistoricalAdRelevance",
-            "HistoricalLandingPageExperience",
-            "QualityImpact",
-            "CampaignStatus",
-            "AccountStatus",
-            "AdGroupStatus",
-            "KeywordStatus",
-            "Network",
-            "TopVsOther",
-            "DeviceOS",
-            "Assists",
-            "Revenue",
-            "ReturnOnAdSpend",
-            "CostPerAssist",
-            "RevenuePerConversion",
-            "RevenuePerAssist",
-            "TrackingTemplate",
-            "CustomParameters",
-            "FinalUrl",
-            "FinalMobileUrl",
-            "FinalAppUrl",
-            "BidStrategyType",
-            "KeywordLabels",
-            "Mainline1Bid",
-            "MainlineBid",
-            "FirstPageBid",
-            "FinalUrlSuffix",
-            "BaseCampaignId",
-            "AllConversions",
-            "AllRevenue",
-            "AllCostPerConversion",
-            "AllReturnOnAdSpend",
-            "AllRevenuePerConversion"
-        ])
-        report_request.Columns = report_columns
-        return report_request
+        return build_report_request(
+            _reporting_service,
+            REPORT_DEFINITIONS['keyword_performance_report'],
+            account_id=account_id,
+            aggregation=aggregation,
+            exclude_column_headers=exclude_column_headers,
+            exclude_report_footer=exclude_report_footer,
+            exclude_report_header=exclude_report_header,
+            report_file_format=report_file_format,
+            return_only_complete_data=return_only_complete_data,
+            report_time=report_time,
+            columns=columns)
 
     @staticmethod
     def get_user_location_performance_report_request(
@@ -530,81 +525,24 @@ class MicrosoftAdsAPI(object):
             exclude_report_header,
             report_file_format,
             return_only_complete_data,
-            report_time):
+            report_time,
+            columns=None):
         """
         Reference:  https://docs.microsoft.com/en-us/advertising/reporting-service/userlocationperformancereportrequest?view=bingads-13
                     https://docs.microsoft.com/en-us/advertising/reporting-service/userlocationperformancereportcolumn?view=bingads-13
         """
-        report_request = _reporting_service.factory.create('UserLocationPerformanceReportRequest')
-        report_request.Aggregation = aggregation
-        report_request.ExcludeColumnHeaders = exclude_column_headers
-        report_request.ExcludeReportFooter = exclude_report_footer
-        report_request.ExcludeReportHeader = exclude_report_header
-        report_request.Format = report_file_format
-        report_request.ReturnOnlyCompleteData = return_only_complete_data
-        report_request.Time = report_time
-        report_request.ReportName = "user_location_performance_report"
-        scope = _reporting_service.factory.create('AccountThroughAdGroupReportScope')
-        scope.AccountIds = {'long': [account_id]}
-        scope.Campaigns = None
-        scope.AdGroups = None
-        report_request.Scope = scope
-
-        report_columns = _reporting_service.factory.create('ArrayOfUserLocationPerformanceReportColumn')
-        report_columns.UserLocationPerformanceReportColumn.append([
-            "AccountName",
-            "AccountNumber",
-            "AccountId",
-            "TimePeriod",
-            "CampaignName",
-            "CampaignId",
-            "AdGroupName",
-            "AdGroupId",
-            "Country",
-            "State",
-            "MetroArea",
-            "AdDistribution",
-            "Impressions",
-            "Clicks",
-            "AverageCpc",
-            "Spend",
-            "AveragePosition",
-            "ProximityTargetLocation",
-            "Radius",
-            "Language",
-            "City",
-            "QueryIntentCountry",
-            "QueryIntentState",
-            "QueryIntentCity",
-            "QueryIntentDMA",
-            "BidMatchType",
-            "DeliveredMatchType",
-            "Network",
-            "TopVsOther",
-            "DeviceType",
-            "DeviceOS",
-            "Assists",
-            "Conversions",
-            "Revenue",
-            "ReturnOnAdSpend",
-            "CostPerConversion",
-            "CostPerAssist",
-            "RevenuePerConversion",
-            "RevenuePerAssist",
-            "County",
-            "PostalCode",
-            "QueryIntentCounty",
-            "QueryIntentPostalCode",
-            "LocationId",
-            "QueryIntentLocationId",
-            "AllConversions",
-            "AllRevenue",
-            "AllCostPerConversion",
-            "AllReturnOnAdSpend",
-            "AllRevenuePerConversion"
-        ])
-        report_request.Columns = report_columns
-        return report_request
+        return build_report_request(
+            _reporting_service,
+            REPORT_DEFINITIONS['user_location_performance_report'],
+            account_id=account_id,
+            aggregation=aggregation,
+            exclude_column_headers=exclude_column_headers,
+            exclude_report_footer=exclude_report_footer,
+            exclude_report_header=exclude_report_header,
+            report_file_format=report_file_format,
+            return_only_complete_data=return_only_complete_data,
+            report_time=report_time,
+            columns=columns)
 
     @staticmethod
     def get_goals_funnels_report_request(
@@ -616,51 +554,24 @@ class MicrosoftAdsAPI(object):
             exclude_report_header,
             report_file_format,
             return_only_complete_data,
-            report_time):
+            report_time,
+            columns=None):
         """
         Reference:  https://docs.microsoft.com/en-us/advertising/reporting-service/goalsandfunnelsreportrequest?view=bingads-13
                     https://docs.microsoft.com/en-us/advertising/reporting-service/goalsandfunnelsreportcolumn?view=bingads-13
         """
-        report_request = _reporting_service.factory.create('GoalsAndFunnelsReportRequest')
-        report_request.Aggregation = aggregation
-        report_request.ExcludeColumnHeaders = exclude_column_headers
-        report_request.ExcludeReportFooter = exclude_report_footer
-        report_request.ExcludeReportHeader = exclude_report_header
-        report_request.Format = report_file_format
-        report_request.ReturnOnlyCompleteData = return_only_complete_data
-        report_request.ReportName = "goals_funnels_report"
-        report_request.Time = report_time
-        scope = _reporting_service.factory.create('AccountThroughAdGroupReportScope')
-        scope.AccountIds = {'long': [account_id]}
-        scope.Campaigns = None
-        report_request.Scope = scope
-        report_columns = _reporting_service.factory.create('ArrayOfGoalsAndFunnelsReportColumn')
-        report_columns.GoalsAndFunnelsReportColumn.append([
-            "AccountName",
-            "AccountNumber",
-            "AccountId",
-            "TimePeriod",
-            "CampaignName",
-            "CampaignId",
-            "AdGroupName",
-            "AdGroupId",
-            "Keyword",
-            "KeywordId",
-            "Goal",
-            "AllConversions",
-            "Assists",
-            "AllRevenue",
-            "GoalId",
-            "DeviceType",
-            "DeviceOS",
-            "AccountStatus",
-            "CampaignStatus",
-            "AdGroupStatus",
-            "KeywordStatus",
-            "GoalType"
-        ])
-        report_request.Columns = report_columns
-        return report_request
+        return build_report_request(
+            _reporting_service,
+            REPORT_DEFINITIONS['goals_funnels_report'],
+            account_id=account_id,
+            aggregation=aggregation,
+            exclude_column_headers=exclude_column_headers,
+            exclude_report_footer=exclude_report_footer,
+            exclude_report_header=exclude_report_header,
+            report_file_format=report_file_format,
+            return_only_complete_data=return_only_complete_data,
+            report_time=report_time,
+            columns=columns)
 
     @staticmethod
     def get_ad_performance_report_request(
@@ -672,93 +583,24 @@ class MicrosoftAdsAPI(object):
             exclude_report_header,
             report_file_format,
             return_only_complete_data,
-            report_time):
+            report_time,
+            columns=None):
         """
         Reference:  https://docs.microsoft.com/en-us/advertising/reporting-service/adperformancereportrequest?view=bingads-13
                     https://docs.microsoft.com/en-us/advertising/reporting-service/adperformancereportcolumn?view=bingads-13
         """
-        report_request = _reporting_service.factory.create('AdPerformanceReportRequest')
-        report_request.Aggregation = aggregation
-        report_request.ExcludeColumnHeaders = exclude_column_headers
-        report_request.ExcludeReportFooter = exclude_report_footer
-        report_request.ExcludeReportHeader = exclude_report_header
-        report_request.Format = report_file_format
-        report_request.ReturnOnlyCompleteData = return_only_complete_data
-        report_request.ReportName = "ads_performance_report"
-        report_request.Time = report_time
-        scope = _reporting_service.factory.create('AccountThroughAdGroupReportScope')
-        scope.AccountIds = {'long': [account_id]}
-        scope.Campaigns = None
-        report_request.Scope = scope
-        report_columns = _reporting_service.factory.create('ArrayOfAdPerformanceReportColumn')
-        report_columns.AdPerformanceReportColumn.append([
-            "AccountName",
-            "AccountNumber",
-            "AccountId",
-            "TimePeriod",
-            "CampaignName",
-            "CampaignId",
-            "AdGroupName",
-            "AdId",
-            "AdGroupId",
-            "AdTitle",
-            "AdDescription",
-            "AdDescription2",
-            "AdType",
-            "AdDistribution",
-            "Impressions",
-            "Clicks",
-            "AverageCpc",
-            "Spend",
-            "AveragePosition",
-            "Conversions",
-            "CostPerConversion",
-            "DestinationUrl",
-            "DeviceType",
-            "Language",
-            "DisplayUrl",
-            "AdStatus",
-            "Network",
-            "TopVsOther",
-            "BidMatchType",
-            "DeliveredMatchType",
-            "DeviceOS",
-            "Assists",
-            "Revenue",
-            "ReturnOnAdSpend",
-            "CostPerAssist",
-            "RevenuePerConversion",
-            "RevenuePerAssist",
-            "TrackingTemplate",
-            "CustomParameters",
-            "FinalUrl",
-            "FinalMobileUrl",
-            "FinalAppUrl",
-            "AccountStatus",
-            "CampaignStatus",
-            "AdGroupStatus",
-            "TitlePart1",
-            "TitlePart2",
-            "TitlePart3",
-            "Headline",
-            "LongHeadline",
-            "BusinessName",
-            "Path1",
-            "Path2",
-            "AdLabels",
-            "CustomerId",
-            "CustomerName",
-            "CampaignType",
-            "BaseCampaignId",
-            "AllConversions",
-            "AllRevenue",
-            "AllCostPerConversion",
-            "AllReturnOnAdSpend",
-            "AllRevenuePerConversion",
-            "FinalUrlSuffix"
-        ])
-        report_request.Columns = report_columns
-        return report_request
+        return build_report_request(
+            _reporting_service,
+            REPORT_DEFINITIONS['ads_performance_report'],
+            account_id=account_id,
+            aggregation=aggregation,
+            exclude_column_headers=exclude_column_headers,
+            exclude_report_footer=exclude_report_footer,
+            exclude_report_header=exclude_report_header,
+            report_file_format=report_file_format,
+            return_only_complete_data=return_only_complete_data,
+            report_time=report_time,
+            columns=columns)
 
     @staticmethod
     def get_ads_dictionary_report_request(
@@ -768,26 +610,17 @@ class MicrosoftAdsAPI(object):
             exclude_report_footer,
             exclude_report_header,
             report_file_format,
-            return_only_complete_data):
+            return_only_complete_data,
+            days_back=1000,
+            columns=None):
         """
         Reference:  https://docs.microsoft.com/en-us/advertising/reporting-service/adperformancereportrequest?view=bingads-13
                     https://docs.microsoft.com/en-us/advertising/reporting-service/adperformancereportcolumn?view=bingads-13
         """
-        dates = MicrosoftAdsAPI.get_custom_dates(1000, 0)
+        dates = MicrosoftAdsAPI.get_custom_dates(days_back, 0)
         date_from = dates[0]
         date_to = dates[1]
 
-        report_request = _reporting_service.factory.create('AdPerformanceReportRequest')
-        report_request.Aggregation = 'Summary'
-
-        report_request.ExcludeColumnHeaders = exclude_column_headers
-        report_request.ExcludeReportFooter = exclude_report_footer
-        report_request.ExcludeReportHeader = exclude_report_header
-
-        report_request.Format = report_file_format
-        report_request.ReturnOnlyCompleteData = return_only_complete_data
-        report_request.ReportName = "ads_dictionary_report"
-
         report_time = _reporting_service.factory.create('ReportTime')
         custom_date_range_start = _reporting_service.factory.create('Date')
         custom_date_range_start.Day = date_from.day
@@ -800,60 +633,49 @@ class MicrosoftAdsAPI(object):
         report_time.CustomDateRangeStart = custom_date_range_start
         report_time.CustomDateRangeEnd = custom_date_range_end
         report_time.ReportTimeZone = 'PacificTimeUSCanadaTijuana'
-        report_request.Time = report_time
-
-        scope = _reporting_service.factory.create('AccountThroughAdGroupReportScope')
-        scope.AccountIds = {'long': [account_id]}
-        scope.Campaigns = None
-        report_request.Scope = scope
-        report_columns = _reporting_service.factory.create('ArrayOfAdPerformanceReportColumn')
-        report_columns.AdPerformanceReportColumn.append([
-            "AccountName",
-            "AccountNumber",
-            "AccountId",
-            "CampaignName",
-            "CampaignId",
-            "AdGroupName",
-            "AdId",
-            "AdGroupId",
-            "AdTitle",
-            "AdDescription",
-            "AdDescription2",
-            "AdType",
-            "AdDistribution",
-            "Impressions",
-            "DestinationUrl",
-            "DisplayUrl",
-            "AdStatus",
-            "TrackingTemplate",
-            "CustomParameters",
-            "FinalUrl",
-            "FinalMobileUrl",
-            "FinalAppUrl",
-            "AccountStatus",
-            "CampaignStatus",
-            "AdGroupStatus",
-            "TitlePart1",
-            "TitlePart2",
-            "TitlePart3",
-            "Headline",
-            "LongHeadline",
-            "BusinessName",
-            "Path1",
-            "Path2",
-            "CustomerId",
-            "CustomerName",
-            "CampaignType",
-            "BaseCampaignId",
-            "FinalUrlSuffix"
-        ])
-        report_request.Columns = report_columns
-        return report_request
+
+        return build_report_request(
+            _reporting_service,
+            REPORT_DEFINITIONS['ads_dictionary_report'],
+            account_id=account_id,
+            aggregation='Summary',
+            exclude_column_headers=exclude_column_headers,
+            exclude_report_footer=exclude_report_footer,
+            exclude_report_header=exclude_report_header,
+            report_file_format=report_file_format,
+            return_only_complete_data=return_only_complete_data,
+            report_time=report_time,
+            columns=columns)
 
     def get_report_request(self, account_id, _reporting_service, date_from, date_to):
         """
-        Use a sample report request or build your own.
+        Returns the report requests of an account. The requests are built once per date window and
+        reused for every account, with only Scope.AccountIds patched.
+        """
+        return self.get_report_request_for_accounts([account_id], _reporting_service, date_from, date_to)
+
+    def get_report_request_for_accounts(self, account_ids, _reporting_service, date_from, date_to,
+                                        ads_dictionary_days_back=None):
+        """
+        Same as get_report_request, but with every account of account_ids in the report scope.
+        """
+        if ads_dictionary_days_back is None:
+            ads_dictionary_days_back = self.ADS_DICTIONARY_DAYS_BACK
+        return self.report_request_cache.get(
+            (date_from.strftime('%Y-%m-%d'), date_to.strftime('%Y-%m-%d'), ads_dictionary_days_back),
+            account_ids,
+            lambda: self.build_report_request(account_ids[0], _reporting_service, date_from, date_to,
+                                              ads_dictionary_days_back)
+        )
+
+    def build_report_request(self, account_id, _reporting_service, date_from, date_to,
+                             ads_dictionary_days_back=None):
+        """
+        Use a sample report request or build your own. Each report requests the columns of its
+        profile in COLUMN_PROFILES.
         """
+        if ads_dictionary_days_back is None:
+            ads_dictionary_days_back = self.ADS_DICTIONARY_DAYS_BACK
         aggregation = 'Daily'
         exclude_column_headers = False
         exclude_report_footer = True
@@ -908,7 +730,8 @@ class MicrosoftAdsAPI(object):
             exclude_report_header=exclude_report_header,
             report_file_format=self.REPORT_FILE_FORMAT,
             return_only_complete_data=return_only_complete_data,
-            report_time=report_time)
+            report_time=report_time,
+            columns=self.get_report_columns('search_query_performance_report'))
 
         keyword_performance_report_request = self.get_keyword_performance_report_request(
             _reporting_service=_reporting_service,
@@ -919,7 +742,8 @@ class MicrosoftAdsAPI(object):
             exclude_report_header=exclude_report_header,
             report_file_format=self.REPORT_FILE_FORMAT,
             return_only_complete_data=return_only_complete_data,
-            report_time=report_time)
+            report_time=report_time,
+            columns=self.get_report_columns('keyword_performance_report'))
 
         user_location_performance_report_request = self.get_user_location_performance_report_request(
             _reporting_service=_reporting_service,
@@ -930,7 +754,8 @@ class MicrosoftAdsAPI(object):
             exclude_report_header=exclude_report_header,
             report_file_format=self.REPORT_FILE_FORMAT,
             return_only_complete_data=return_only_complete_data,
-            report_time=report_time)
+            report_time=report_time,
+            columns=self.get_report_columns('user_location_performance_report'))
 
         goals_funnels_report_request = self.get_goals_funnels_report_request(
             _reporting_service=_reporting_service,
@@ -941,7 +766,8 @@ class MicrosoftAdsAPI(object):
             exclude_report_header=exclude_report_header,
             report_file_format=self.REPORT_FILE_FORMAT,
             return_only_complete_data=return_only_complete_data,
-            report_time=report_time)
+            report_time=report_time,
+            columns=self.get_report_columns('goals_funnels_report'))
 
         ad_performance_report_request = self.get_ad_performance_report_request(
             _reporting_service=_reporting_service,
@@ -952,7 +778,8 @@ class MicrosoftAdsAPI(object):
             exclude_report_header=exclude_report_header,
             report_file_format=self.REPORT_FILE_FORMAT,
             return_only_complete_data=return_only_complete_data,
-            report_time=report_time)
+            report_time=report_time,
+            columns=self.get_report_columns('ads_performance_report'))
 
         ads_dictionary_report_request = self.get_ads_dictionary_report_request(
             _reporting_service=_reporting_service,
@@ -961,7 +788,9 @@ class MicrosoftAdsAPI(object):
             exclude_report_footer=exclude_report_footer,
             exclude_report_header=exclude_report_header,
             report_file_format=self.REPORT_FILE_FORMAT,
-            return_only_complete_data=return_only_complete_data)
+            return_only_complete_data=return_only_complete_data,
+            days_back=ads_dictionary_days_back,
+            columns=self.get_report_columns('ads_dictionary_report'))
 
         return (
             ads_dictionary_report_request,
@@ -973,54 +802,198 @@ class MicrosoftAdsAPI(object):
         )
         # return (test_dictionary_request)
 
-    def submit_and_download(self, report_request, _result_file_name, _reporting_service_manager):
-        """ Submit the download request and then use the ReportingDownloadOperation result to
-        track status until the report is complete e.g. either using
-        ReportingDownloadOperation.track() or ReportingDownloadOperation.get_status(). """
-
-        # global reporting_service_manager
-        # reporting_download_operation = _reporting_service_manager.submit_download(report_request)
-
-        # You may optionally cancel the track() operation after a specified time interval.
-        # reporting_operation_status = reporting_download_operation.track(
-        #                                                 timeout_in_milliseconds=self.TIMEOUT_IN_MILLISECONDS)
-
-        # You can use ReportingDownloadOperation.track() to poll until complete as shown above,
-        # or use custom polling logic with get_status() as shown below.
-        for _ in range(10):
-            # time.sleep(_reporting_service_manager.poll_interval_in_milliseconds / 1000.0)
-            reporting_download_operation = _reporting_service_manager.submit_download(report_request)
-            time.sleep(20)
-            download_status = reporting_download_operation.get_status()
-            print(download_status.status)
-            print(download_status.report_download_url)
-            if download_status.report_download_url is not None:
-                break
+    def get_report_columns(self, report_name):
+        return get_profile_column_names(REPORT_DEFINITIONS[report_name], self.COLUMN_PROFILES.get(report_name))
 
-        result_file_path = reporting_download_operation.download_result_file(
-            result_file_directory=self.FILE_DIRECTORY,
-            result_file_name=_result_file_name,
-            decompress=True,
-            overwrite=True,  # Set this value true if you want to overwrite the same file.
-            timeout_in_milliseconds=self.TIMEOUT_IN_MILLISECONDS  # You may optionally cancel the download after a
-            # specified time interval.
+    def get_report_state_key(self, report_name):
+        """
+        Name under which the watermarks and row counts of a report are kept: a profiled report is
+        loaded into its own table, so it has its own watermarks.
+        """
+        return report_name + get_profile_suffix(REPORT_DEFINITIONS[report_name], self.COLUMN_PROFILES.get(report_name))
+
+    def get_ads_dictionary_cache_file(self):
+        """
+        ADS_DICTIONARY_CACHE_FILE, with the suffix of the column profile of the ads dictionary
+        report: a profiled dictionary is cached apart, with the columns of its own table.
+        """
+        root, extension = os.path.splitext(self.ADS_DICTIONARY_CACHE_FILE)
+        return root + get_profile_suffix(REPORT_DEFINITIONS['ads_dictionary_report'],
+                                         self.COLUMN_PROFILES.get('ads_dictionary_report')) + extension
+
+    def get_report_polling_scheduler(self, _reporting_service_manager, ready_time_stats=None):
+        return ReportPollingScheduler(
+            _reporting_service_manager,
+            stats=ready_time_stats if ready_time_stats is not None else ReadyTimeStats(self.REPORT_READY_TIMES_FILE),
+            timeout_in_seconds=self.TIMEOUT_IN_MILLISECONDS / 1000.0
         )
 
+    def get_connection_pool(self):
+        if self.connection_pool is None:
+            self.connection_pool = HttpConnectionPool(timeout_in_seconds=self.TIMEOUT_IN_MILLISECONDS / 1000.0)
+        return self.connection_pool
+
+    def download_result_file(self, reporting_download_operation, _result_file_name):
+        """
+        Streams the zipped result file and decompresses it as it arrives straight into
+        FILE_DIRECTORY/_result_file_name; the archive itself is never written to disk.
+        """
+        report_download_url = reporting_download_operation.final_status.report_download_url
+        if not report_download_url:
+            return None
+        result_file_path = extract_zip_chunks(iter_url_chunks(self.get_connection_pool(), report_download_url),
+                                              self.FILE_DIRECTORY, _result_file_name)
         self.output_status_message("Download result file: {0}".format(result_file_path))
+        return result_file_path
+
+    def submit_and_download_all(self, report_requests, _reporting_service_manager, download_engine=None):
+        """ Submit every download request once, then poll the pending ReportingDownloadOperations with
+        ReportingDownloadOperation.get_status() and download each result file as soon as it is ready.
+        report_requests is a list of (result file name, report request) pairs. With a download_engine
+        the result files are downloaded in the background while the other reports are polled. """
+        from suds import WebFault
+
+        scheduler = self.get_report_polling_scheduler(_reporting_service_manager)
+        retry_budget = RetryBudget(self.RETRY_BUDGET)
+        for _result_file_name, report_request in report_requests:
+            try:
+                self.call_with_retry(lambda: scheduler.submit(_result_file_name, report_request),
+                                     _result_file_name, retry_budget)
+            except WebFault as ex:
+                self.output_webfault_errors(ex)
+            except Exception as ex:
+                self.output_status_message(ex)
+
+        result_file_paths = {}
+        downloads = {}
+        for pending in scheduler.run():
+            self.output_status_message("{0}: {1} after {2} polls".format(
+                pending.key, pending.status.status if pending.status else None, pending.polls))
+            if pending.error is not None:
+                self.output_status_message(pending.error)
+            elif pending.status.report_download_url is None:
+                self.output_status_message("There is no report data for {0}.".format(pending.key))
+            elif download_engine is not None:
+                downloads[pending.key] = self.submit_result_file_download(download_engine,
+                                                                          pending.status.report_download_url,
+                                                                          pending.key)
+            else:
+                try:
+                    result_file_paths[pending.key] = self.call_with_retry(
+                        lambda: self.download_result_file(pending.operation, pending.key),
+                        pending.key, retry_budget)
+                except Exception as ex:
+                    self.output_status_message(ex)
+
+        for _result_file_name, download in downloads.items():
+            try:
+                result_file_paths[_result_file_name] = download.result()
+                self.output_status_message("Download result file: {0}".format(result_file_paths[_result_file_name]))
+            except Exception as ex:
+                self.output_status_message(ex)
+        return result_file_paths
+
+    def submit_result_file_download(self, download_engine, report_download_url, _result_file_name):
+        return download_engine.submit(
+            report_download_url,
+            lambda chunks: extract_zip_chunks(chunks, self.FILE_DIRECTORY, _result_file_name)
+        )
+
+    def attach_download_operation(self, request_id, _reporting_service_manager):
+        return self.service_client_factory.create_reporting_download_operation(
+            request_id, _reporting_service_manager.poll_interval_in_milliseconds)
+
+    def wait_until_ready(self, operation, job, _reporting_service_manager, ready_time_stats=None):
+        """
+        Polls operation with get_status() until the report of job is ready, through a
+        ReportPollingScheduler like submit_and_download_all: the first poll comes around the
+        time-to-ready recorded in ready_time_stats for the report type, and the time this one
+        took is recorded there. Returns the final status.
+        """
+        scheduler = self.get_report_polling_scheduler(_reporting_service_manager, ready_time_stats)
+        scheduler.attach(job.result_file_name, job.report_name, operation)
+        pending = list(scheduler.run())[0]
+        if pending.error is not None:
+            raise pending.error
+        return pending.status
+
+    def track_job(self, job, _reporting_service_manager, retry_budget=None, run_journal=None, ready_time_stats=None):
+        """
+        Submits the report request of job and waits until it is ready; see wait_until_ready. With
+        a run_journal, a request submitted by an interrupted run is tracked again instead, by its
+        request id, and is only submitted again if that fails. Returns the
+        ReportingDownloadOperation and its final status.
+        """
+        description = "{0} for account {1}".format(job.report_name, job.account_id)
+        fingerprint = get_request_fingerprint(job.report_request) if run_journal is not None else None
+        task = run_journal.get_task(job.result_file_name, fingerprint) if run_journal is not None else None
+        if task is not None and task.get('request_id'):
+            operation = self.attach_download_operation(task['request_id'], _reporting_service_manager)
+            self.output_status_message("Re-attached {0} to request {1}".format(description, task['request_id']))
+            try:
+                return operation, self.call_with_retry(
+                    lambda: self.wait_until_ready(operation, job, _reporting_service_manager, ready_time_stats),
+                    description, retry_budget)
+            except Exception as ex:
+                self.output_status_message("Submitting {0} again: {1}".format(description, ex))
+
+        operation = self.call_with_retry(lambda: _reporting_service_manager.submit_download(job.report_request),
+                                         description, retry_budget)
+        if run_journal is not None:
+            run_journal.record(job.result_file_name, SUBMITTED, request_id=operation.request_id,
+                               fingerprint=fingerprint, report_name=job.report_name)
+        status = self.call_with_retry(
+            lambda: self.wait_until_ready(operation, job, _reporting_service_manager, ready_time_stats),
+            description, retry_budget)
+        return operation, status
+
+    def download_job_result(self, job, _reporting_service_manager, download_engine=None, retry_budget=None,
+                            run_journal=None, ready_time_stats=None):
+        """
+        Same as download_report, but the result file is decompressed while it is downloaded,
+        and is not parsed again afterwards. Submitting, tracking and downloading are retried
+        separately, so a failed download does not submit the report again. With a
+        download_engine, the download runs in the background and a Future of the result file
+        path is returned instead.
+        """
+        description = "{0} for account {1}".format(job.report_name, job.account_id)
+        operation, status = self.track_job(job, _reporting_service_manager, retry_budget, run_journal,
+                                           ready_time_stats)
+        if run_journal is not None:
+            run_journal.record(job.result_file_name, READY)
+        if status.report_download_url is None:
+            self.output_status_message("There is no report data for the submitted report request parameters.")
+            return None
+        if download_engine is None:
+            return self.call_with_retry(lambda: self.download_result_file(operation, job.result_file_name),
+                                        description, retry_budget)
+        return download_engine.execute(lambda: self.call_with_retry(
+            lambda: extract_zip_chunks(download_engine.iter_chunks(status.report_download_url), self.FILE_DIRECTORY,
+                                       job.result_file_name),
+            description, retry_budget))
+
+    def submit_and_download(self, report_request, _result_file_name, _reporting_service_manager):
+        """ Submit the download request and then use the ReportingDownloadOperation result to
+        track status until the report is complete using ReportingDownloadOperation.get_status(). """
+        return self.submit_and_download_all([(_result_file_name, report_request)],
+                                            _reporting_service_manager).get(_result_file_name)
 
     def get_requested_reports_submit_download(self, account_id, _reporting_service, _reporting_service_manager,
                                               date_from, date_to):
+        from suds import WebFault
+
         try:
             report_request = self.get_report_request(account_id, _reporting_service, date_from, date_to)
-            for report in report_request:
-                _result_file_name = '{0}.'.format(report.ReportName) + self.REPORT_FILE_FORMAT.lower()
-                print(_result_file_name)
-                # Option B - Submit and Download with ReportingServiceManager
-                # ------------------------------------------------------------
-                # Submit the download request and then use the ReportingDownloadOperation result to
-                # track status yourself using ReportingServiceManager.get_status().
-                self.output_status_message("-----\nAwaiting Submit and Download...")
-                self.submit_and_download(report, _result_file_name, _reporting_service_manager)
+            # Option B - Submit and Download with ReportingServiceManager
+            # ------------------------------------------------------------
+            # Submit all download requests and then track their status yourself using
+            # ReportingDownloadOperation.get_status().
+            self.output_status_message("-----\nAwaiting Submit and Download...")
+            self.submit_and_download_all(
+                [('{0}.'.format(report.ReportName) + self.REPORT_FILE_FORMAT.lower(), report)
+                 for report in report_request],
+                _reporting_service_manager
+            )
         except WebFault as ex:
             self.output_webfault_errors(ex)
         except Exception as ex:
@@ -1036,34 +1009,370 @@ class MicrosoftAdsAPI(object):
         if report_container is None:
             self.output_status_message("There is no report data for the submitted report request parameters.")
             # sys.exit(0)
+        else:
             report_container.close()
 
     def get_requested_reports_download_report(self, account_id, _reporting_service, _reporting_service_manager,
                                               date_from, date_to):
+        from bingads.v13.reporting import ReportingDownloadParameters
+        from suds import WebFault
+
         try:
             report_request = self.get_report_request(account_id, _reporting_service, date_from, date_to)
-            for report in report_request:
-                _result_file_name = '{0}_{1}_input.'.format(account_id,
-                                                            report.ReportName) + self.REPORT_FILE_FORMAT.lower()
-                print(_result_file_name)
-                reporting_download_parameters = ReportingDownloadParameters(
-                    report_request=report,
-                    result_file_directory=self.FILE_DIRECTORY,
-                    result_file_name=_result_file_name,
-                    overwrite_result_file=True,  # Set this value true if you want to overwrite the same file.
-                    timeout_in_milliseconds=self.TIMEOUT_IN_MILLISECONDS
-                    # You may optionally cancel the download after a specified time interval.
-                )
-
-                # Option D - Download the report in memory with ReportingServiceManager.download_report
-                # The download_report helper function downloads the report and summarizes results.
-                self.output_status_message("-----\nAwaiting download_report...")
-                self.download_report(reporting_download_parameters, _reporting_service_manager)
-
         except WebFault as ex:
             self.output_webfault_errors(ex)
+            return
         except Exception as ex:
             self.output_status_message(ex)
+            return
+
+        # Each report is retried and reported on its own, so one failure does not drop the
+        # remaining reports of the account.
+        retry_budget = RetryBudget(self.RETRY_BUDGET)
+        for report in report_request:
+            _result_file_name = '{0}_{1}_input.'.format(account_id,
+                                                        report.ReportName) + self.REPORT_FILE_FORMAT.lower()
+            print(_result_file_name)
+            reporting_download_parameters = ReportingDownloadParameters(
+                report_request=report,
+                result_file_directory=self.FILE_DIRECTORY,
+                result_file_name=_result_file_name,
+                overwrite_result_file=True,  # Set this value true if you want to overwrite the same file.
+                timeout_in_milliseconds=self.TIMEOUT_IN_MILLISECONDS
+                # You may optionally cancel the download after a specified time interval.
+            )
+
+            # Option D - Download the report in memory with ReportingServiceManager.download_report
+            # The download_report helper function downloads the report and summarizes results.
+            self.output_status_message("-----\nAwaiting download_report...")
+            try:
+                self.call_with_retry(
+                    lambda: self.download_report(reporting_download_parameters, _reporting_service_manager),
+                    _result_file_name,
+                    retry_budget
+                )
+            except WebFault as ex:
+                self.output_webfault_errors(ex)
+            except Exception as ex:
+                self.output_status_message(ex)
+
+    def get_report_jobs(self, account_ids, _reporting_service, date_from, date_to, account_batch_size=1,
+                        watermark_store=None, ads_dictionary_cache=None, row_count_stats=None):
+        """
+        Builds every (account, report) job up front. The suds factory is not thread-safe,
+        so requests are always built on the calling thread.
+
+        With account_batch_size > 1, accounts are packed into groups and each report is
+        requested once per group, with all the group's accounts in its scope.
+
+        With a watermark_store, each (account, report) only requests the days that are missing
+        or may still be restated; pairs that are up to date get no job.
+
+        With an ads_dictionary_cache, accounts already in the cache only request the last
+        ADS_DICTIONARY_REFRESH_DAYS days of the ads dictionary.
+
+        Reports in SHARD_DAYS are split into date shards, one job per shard; see stitch_shards.
+        """
+        account_ids = list(account_ids)
+        if not account_ids:
+            return []
+        report_names = [report.ReportName for report in
+                        self.get_report_request_for_accounts(account_ids[:1], _reporting_service, date_from, date_to)]
+
+        accounts_by_window = OrderedDict()
+        for account_id in account_ids:
+            for report_name in report_names:
+                window = (date_from, date_to)
+                ads_dictionary_days_back = self.ADS_DICTIONARY_DAYS_BACK
+                if report_name == 'ads_dictionary_report' and ads_dictionary_cache is not None \
+                        and ads_dictionary_cache.has_account(account_id):
+                    ads_dictionary_days_back = self.ADS_DICTIONARY_REFRESH_DAYS
+                if watermark_store is not None and report_name not in self.WATERMARK_EXCLUDED_REPORTS:
+                    window = watermark_store.get_missing_window(account_id, self.get_report_state_key(report_name),
+                                                                date_from, date_to)
+                    if window is None:
+                        continue
+                accounts_by_window.setdefault((window, report_name, ads_dictionary_days_back), []).append(account_id)
+
+        jobs = []
+        for ((window_from, window_to), report_name, ads_dictionary_days_back), window_account_ids \
+                in accounts_by_window.items():
+            for account_group in chunked(window_account_ids, account_batch_size):
+                if len(account_group) == 1:
+                    job_account_id = account_group[0]
+                else:
+                    job_account_id = 'accounts_{0}_{1}'.format(account_group[0], len(account_group))
+                shard_days = self.get_shard_days(account_group, report_name, row_count_stats)
+                if shard_days is None:
+                    shards = [(window_from, window_to)]
+                else:
+                    shards = shard_date_range(window_from, window_to, shard_days)
+                for shard_index, (shard_from, shard_to) in enumerate(shards):
+                    for report in self.get_report_request_for_accounts(account_group, _reporting_service,
+                                                                       shard_from, shard_to, ads_dictionary_days_back):
+                        if report.ReportName != report_name:
+                            continue
+                        if len(shards) > 1:
+                            _result_file_name = '{0}_shard{1:03d}_{2}_input.'.format(job_account_id, shard_index,
+                                                                                     report.ReportName)
+                        else:
+                            _result_file_name = '{0}_{1}_input.'.format(job_account_id, report.ReportName)
+                        jobs.append(ReportJob(job_account_id, report,
+                                              _result_file_name + self.REPORT_FILE_FORMAT.lower(),
+                                              account_ids=account_group, date_from=shard_from, date_to=shard_to,
+                                              shard_index=shard_index if shard_days is not None else None,
+                                              shard_count=len(shards)))
+        return jobs
+
+    def get_shard_days(self, account_ids, report_name, row_count_stats=None):
+        shard_days = self.SHARD_DAYS.get(report_name)
+        if shard_days is None or row_count_stats is None:
+            return shard_days
+        rows_per_day = sum(row_count_stats.get_rows_per_day(account_id, self.get_report_state_key(report_name)) or 0
+                           for account_id in account_ids)
+        if rows_per_day:
+            shard_days = max(1, int(self.SHARD_TARGET_ROWS // rows_per_day))
+        return shard_days
+
+    def stitch_shards(self, jobs, split_by_account=False, watermark_store=None, row_count_stats=None):
+        """
+        Concatenates the shard files of every sharded report, in date order, into the usual
+        <account>_<report>_input file and records its rows per day. A report with a failed shard
+        is dropped as a whole, so that no partial window is loaded or marked as loaded; a report
+        that cannot be stitched gets the error on all of its shards.
+        """
+        shards_by_report = OrderedDict()
+        for job in jobs:
+            if job.shard_index is not None:
+                shards_by_report.setdefault((job.account_id, job.report_name), []).append(job)
+
+        for (job_account_id, report_name), shards in shards_by_report.items():
+            shards.sort(key=lambda shard: shard.shard_index)
+            shard_paths = [os.path.join(self.FILE_DIRECTORY, shard.result_file_name) for shard in shards]
+            shard_paths = [shard_path for shard_path in shard_paths if os.path.exists(shard_path)]
+            result_file_name = '{0}_{1}_input.'.format(job_account_id, report_name) + self.REPORT_FILE_FORMAT.lower()
+            result_file_path = os.path.join(self.FILE_DIRECTORY, result_file_name)
+            failed_shards = [shard for shard in shards if shard.error is not None]
+            if failed_shards:
+                self.output_status_message("Dropping {0} for account {1}: {2} of {3} shards failed".format(
+                    report_name, job_account_id, len(failed_shards), len(shards)))
+                for shard_path in shard_paths:
+                    os.remove(shard_path)
+                continue
+            try:
+                self.stitch_report_shards(shards, shard_paths, result_file_path, split_by_account, watermark_store,
+                                          row_count_stats)
+            except Exception as ex:
+                self.output_status_message("Could not stitch {0} for account {1}: {2}".format(
+                    report_name, job_account_id, ex))
+                if os.path.exists(result_file_path):
+                    os.remove(result_file_path)
+                for shard in shards:
+                    shard.error = ex
+
+    def stitch_report_shards(self, shards, shard_paths, result_file_path, split_by_account=False,
+                             watermark_store=None, row_count_stats=None):
+        """
+        Writes the shards of one report, in date order, to result_file_path.
+        """
+        job_account_id, report_name = shards[0].account_id, shards[0].report_name
+        if shard_paths == [result_file_path]:
+            row_count = sum(1 for _ in read_csv_rows(result_file_path))
+        elif shard_paths:
+            row_count = write_csv_rows(result_file_path, concat_csv_rows(shard_paths))
+            for shard_path in shard_paths:
+                os.remove(shard_path)
+        else:
+            row_count = 0
+
+        stitched_job = ReportJob(job_account_id, shards[0].report_request, os.path.basename(result_file_path),
+                                 account_ids=shards[0].account_ids, date_from=shards[0].date_from,
+                                 date_to=shards[-1].date_to)
+        if row_count_stats is not None:
+            days = (stitched_job.date_to - stitched_job.date_from).days + 1
+            for account_id in stitched_job.account_ids:
+                row_count_stats.record(account_id, self.get_report_state_key(report_name),
+                                       max(row_count - 1, 0) / len(stitched_job.account_ids), days)
+        if split_by_account and len(stitched_job.account_ids) > 1:
+            self.split_result_file_by_account(stitched_job)
+        if watermark_store is not None:
+            self.mark_job_loaded(stitched_job, watermark_store)
+
+    def merge_ads_dictionary_files(self, ads_dictionary_cache, account_ids, run_journal=None):
+        """
+        Upserts every downloaded ads dictionary file into ads_dictionary_cache, removes them, and
+        writes the merged dictionary of account_ids as a single all_accounts_ads_dictionary_report_input
+        file in their place. The merged file of an interrupted run is merged again first, as the
+        cache is only saved once a run is loaded.
+        """
+        suffix = 'ads_dictionary_report_input.' + self.REPORT_FILE_FORMAT.lower()
+        merged_file_name = 'all_accounts_' + suffix
+        merged_file_path = os.path.join(self.FILE_DIRECTORY, merged_file_name)
+        file_names = [file_name for file_name in sorted(os.listdir(self.FILE_DIRECTORY))
+                      if file_name.endswith(suffix) and file_name != merged_file_name]
+        if not file_names:
+            return
+        if os.path.exists(merged_file_path):
+            ads_dictionary_cache.merge_rows(read_csv_rows(merged_file_path))
+        for file_name in file_names:
+            ads_dictionary_cache.merge_rows(read_csv_rows(os.path.join(self.FILE_DIRECTORY, file_name)))
+        write_csv_rows(merged_file_path, ads_dictionary_cache.get_rows(account_ids))
+        if run_journal is not None:
+            run_journal.record_replaced(file_names, merged_file_name)
+        for file_name in file_names:
+            os.remove(os.path.join(self.FILE_DIRECTORY, file_name))
+
+    def split_result_file_by_account(self, job):
+        """
+        Splits the combined result file of a multi-account job into one *_input file per AccountId
+        and removes the combined file. Returns the list of written file names.
+        """
+        result_file_path = os.path.join(self.FILE_DIRECTORY, job.result_file_name)
+        if not os.path.exists(result_file_path):
+            return []
+        output_paths = split_csv_by_column(
+            result_file_path,
+            'AccountId',
+            lambda account_id: os.path.join(
+                self.FILE_DIRECTORY,
+                '{0}_{1}_input.'.format(account_id, job.report_name) + self.REPORT_FILE_FORMAT.lower()
+            )
+        )
+        os.remove(result_file_path)
+        return [os.path.basename(output_path) for output_path in output_paths.values()]
+
+    def get_requested_reports_download_concurrently(self, account_ids, _reporting_service, manager_factory,
+                                                    date_from, date_to, max_workers=8, max_per_account=2,
+                                                    account_batch_size=1, split_by_account=False, watermark_store=None,
+                                                    ads_dictionary_cache=None, row_count_stats=None,
+                                                    download_engine=None, result_cache=None, run_journal=None):
+        """
+        Submits the reports of all accounts at once and collects them as they finish. Each worker
+        thread gets its own ReportingServiceManager from manager_factory. Returns the list of jobs.
+        Result files are decompressed while they are downloaded, through download_engine if given;
+        see download_job_result. With a result_cache, reports whose request was already
+        downloaded are copied from the cache instead of being generated again. With a run_journal,
+        the jobs an interrupted run already downloaded are skipped and its submitted reports are
+        re-attached to.
+
+        Successful jobs are marked as loaded in watermark_store; saving it is left to the caller,
+        once the data has been uploaded. Failed date shards are retried on their own, up to
+        SHARD_RETRIES times, before the shards are stitched back together.
+
+        A failed report does not stop the others: once they are all downloaded, a ReportRunError
+        listing the failed reports is raised; the files of the other reports are left in
+        FILE_DIRECTORY to be loaded.
+        """
+        from suds import WebFault
+
+        jobs = self.get_report_jobs(account_ids, _reporting_service, date_from, date_to, account_batch_size,
+                                    watermark_store, ads_dictionary_cache, row_count_stats)
+        runner = ConcurrentReportRunner(manager_factory, max_workers=max_workers, max_per_account=max_per_account)
+        retry_budget = RetryBudget(self.RETRY_BUDGET)
+        # Shared by the workers, so that every report's time-to-ready is kept.
+        ready_time_stats = ReadyTimeStats(self.REPORT_READY_TIMES_FILE)
+
+        def record_job_files(job):
+            if split_by_account and len(job.account_ids) > 1 and job.shard_index is None:
+                result_file_names = self.split_result_file_by_account(job)
+            else:
+                result_file_names = [job.result_file_name]
+            if run_journal is not None:
+                run_journal.record(job.result_file_name, DOWNLOADED,
+                                   fingerprint=get_request_fingerprint(job.report_request),
+                                   report_name=job.report_name,
+                                   files=[file_name for file_name in result_file_names
+                                          if os.path.exists(os.path.join(self.FILE_DIRECTORY, file_name))])
+            return result_file_names
+
+        def finish_download(job, result_file_path):
+            if result_cache is not None:
+                result_cache.put(get_request_fingerprint(job.report_request), result_file_path, job.date_to)
+            return record_job_files(job)
+
+        def run_job(job, _reporting_service_manager):
+            if run_journal is not None:
+                result_file_names = self.get_journaled_files(job, run_journal)
+                if result_file_names is not None:
+                    return result_file_names
+            if result_cache is not None and self.copy_cached_result(job, result_cache):
+                return record_job_files(job)
+            result_file_path = self.download_job_result(job, _reporting_service_manager, download_engine,
+                                                        retry_budget, run_journal, ready_time_stats)
+            # The worker does not wait for a background download; the job finishes once it is done.
+            if download_engine is not None and result_file_path is not None:
+                return chain_future(result_file_path, lambda path: finish_download(job, path))
+            return finish_download(job, result_file_path)
+
+        pending_jobs = jobs
+        for attempt in range(self.SHARD_RETRIES + 1):
+            failed_shards = []
+            for job in runner.run(pending_jobs, run_job):
+                self.output_status_message("-----\nFinished {0} for account {1}".format(job.report_name,
+                                                                                         job.account_id))
+                if isinstance(job.error, WebFault):
+                    self.output_webfault_errors(job.error)
+                elif job.error is not None:
+                    self.output_status_message(job.error)
+                elif watermark_store is not None and job.shard_index is None:
+                    self.mark_job_loaded(job, watermark_store)
+                if job.error is not None and job.shard_count > 1:
+                    failed_shards.append(job)
+            if not failed_shards or attempt == self.SHARD_RETRIES:
+                break
+            self.output_status_message("Retrying {0} failed shards".format(len(failed_shards)))
+            for job in failed_shards:
+                job.error = None
+            pending_jobs = failed_shards
+
+        self.stitch_shards(jobs, split_by_account, watermark_store, row_count_stats)
+        failures = [(job.result_file_name, job.error) for job in jobs if job.error is not None]
+        if ads_dictionary_cache is not None:
+            try:
+                self.merge_ads_dictionary_files(ads_dictionary_cache, account_ids, run_journal)
+            except Exception as ex:
+                self.output_status_message("Could not merge the ads dictionary: {0}".format(ex))
+                failures.append(('ads_dictionary_report', ex))
+        if failures:
+            raise ReportRunError(failures)
+        return jobs
+
+    def get_journaled_files(self, job, run_journal):
+        """
+        Returns the result file names of a job that an interrupted run already downloaded, or None
+        if it has to be downloaded (again).
+        """
+        fingerprint = get_request_fingerprint(job.report_request)
+        if not run_journal.has_reached(job.result_file_name, fingerprint, DOWNLOADED):
+            return None
+        task = run_journal.get_task(job.result_file_name, fingerprint)
+        # Once uploaded, the files may already have been cleaned up.
+        if task['state'] != UPLOADED and not all(run_journal.is_file_present(self.FILE_DIRECTORY, file_name)
+                                                 for file_name in task['files']):
+            return None
+        self.output_status_message("{0} for account {1} already downloaded".format(job.report_name, job.account_id))
+        return task['files']
+
+    def copy_cached_result(self, job, result_cache):
+        """
+        Copies the cached result of job into FILE_DIRECTORY and returns True, or returns False
+        when it is not cached.
+        """
+        hit, cached_path = result_cache.get(get_request_fingerprint(job.report_request))
+        if not hit:
+            return False
+        if cached_path is not None:
+            shutil.copyfile(cached_path, os.path.join(self.FILE_DIRECTORY, job.result_file_name))
+        self.output_status_message("{0} for account {1} served from the result cache".format(job.report_name,
+                                                                                             job.account_id))
+        return True
+
+    def mark_job_loaded(self, job, watermark_store):
+        if job.report_name in self.WATERMARK_EXCLUDED_REPORTS:
+            return
+        for account_id in job.account_ids:
+            watermark_store.mark_loaded(account_id, self.get_report_state_key(job.report_name), job.date_from,
+                                        job.date_to)
 
     @staticmethod
     def get_custom_dates(lb_window=29, days_skip=0):
@@ -0,0 +1,193 @@
+import io
+import os
+from ms_ads_reports import BQ_TYPE_CONVERTERS, NULL_VALUES
+from ms_ads_transform import chunked, read_csv_rows
+
+# pyarrow is optional and slow to import, it is only loaded by require_pyarrow().
+pa = None
+pq = None
+pacsv = None
+pc = None
+
+PARQUET_COMPRESSION = 'snappy'
+
+
+def require_pyarrow():
+    global pa, pq, pacsv, pc
+    if pa is not None:
+        return
+    try:
+        import pyarrow
+        import pyarrow.compute
+        import pyarrow.csv
+        import pyarrow.parquet
+    except ImportError:
+        raise ImportError("pyarrow is required for Parquet output, install it with 'pip install pyarrow'")
+    pa = pyarrow
+    pq = pyarrow.parquet
+    pacsv = pyarrow.csv
+    pc = pyarrow.compute
+
+
+def get_arrow_type(field_type):
+    require_pyarrow()
+    return {
+        'INT64': pa.int64(),
+        'INTEGER': pa.int64(),
+        'FLOAT64': pa.float64(),
+        'FLOAT': pa.float64(),
+        'DATE': pa.date32(),
+        'TIMESTAMP': pa.timestamp('us', tz='UTC'),
+        'STRING': pa.string(),
+    }[field_type]
+
+
+def get_arrow_schema(bq_schema):
+    """
+    Translates a list of bigquery.SchemaField into the equivalent pyarrow schema.
+    """
+    require_pyarrow()
+    return pa.schema([pa.field(field.name, get_arrow_type(field.field_type)) for field in bq_schema])
+
+
+def rows_to_record_batches(rows, bq_schema, batch_size=50000):
+    """
+    Converts csv rows (header first) into typed pyarrow RecordBatches following bq_schema.
+    Columns are matched by header name, so the column order of the file does not matter.
+    """
+    require_pyarrow()
+    arrow_schema = get_arrow_schema(bq_schema)
+    rows = iter(rows)
+    header = next(rows, None)
+    if header is None:
+        return
+    positions = [header.index(field.name) for field in bq_schema]
+    converters = [BQ_TYPE_CONVERTERS[field.field_type] for field in bq_schema]
+    for chunk in chunked(rows, batch_size):
+        columns = [
+            [convert(row[position]) for row in chunk]
+            for position, convert in zip(positions, converters)
+        ]
+        yield pa.RecordBatch.from_arrays(
+            [pa.array(column, type=field.type) for column, field in zip(columns, arrow_schema)],
+            schema=arrow_schema
+        )
+
+
+def convert_string_column(column, field_type, arrow_type):
+    """
+    Vectorized equivalent of BQ_TYPE_CONVERTERS for a pyarrow string column whose '' and '--'
+    values are already null: numbers lose their thousands separators (and floats a trailing
+    '%'), dates and timestamps are parsed.
+    """
+    if field_type == 'STRING':
+        return column
+    if field_type in ('INT64', 'INTEGER'):
+        return pc.cast(pc.replace_substring(column, ',', ''), arrow_type)
+    if field_type in ('FLOAT64', 'FLOAT'):
+        return pc.cast(pc.utf8_rtrim(pc.replace_substring(column, ',', ''), '%'), arrow_type)
+    if field_type == 'DATE':
+        return pc.cast(pc.strptime(column, '%Y-%m-%d', 'us'), arrow_type)
+    # Report timestamps are UTC, like the naive datetimes of to_timestamp.
+    return pc.cast(pc.strptime(column, '%Y-%m-%d %H:%M:%S', 'us'), arrow_type)
+
+
+def read_csv_record_batches(csv_path, bq_schema, block_size=16 * 1024 ** 2):
+    """
+    Vectorized counterpart of rows_to_record_batches for a csv file: pyarrow's multithreaded
+    csv reader splits the file into blocks of block_size bytes, every column is read as text
+    and converted with pyarrow.compute kernels, without a Python object per value. Yields
+    typed RecordBatches following bq_schema; columns are matched by header name.
+    """
+    require_pyarrow()
+    if os.path.getsize(csv_path) == 0:
+        return
+    arrow_schema = get_arrow_schema(bq_schema)
+    names = [field.name for field in bq_schema]
+    reader = pacsv.open_csv(
+        csv_path,
+        read_options=pacsv.ReadOptions(block_size=block_size),
+        convert_options=pacsv.ConvertOptions(
+            column_types=dict((name, pa.string()) for name in names),
+            null_values=list(NULL_VALUES),
+            strings_can_be_null=True,
+            include_columns=names,
+        )
+    )
+    for batch in reader:
+        yield pa.RecordBatch.from_arrays(
+            [convert_string_column(batch.column(index), field.field_type, arrow_field.type)
+             for index, (field, arrow_field) in enumerate(zip(bq_schema, arrow_schema))],
+            schema=arrow_schema
+        )
+
+
+def write_parquet_batches(batches, bq_schema, where, compression=PARQUET_COMPRESSION):
+    require_pyarrow()
+    row_count = 0
+    with pq.ParquetWriter(where, get_arrow_schema(bq_schema), compression=compression) as writer:
+        for batch in batches:
+            writer.write_batch(batch)
+            row_count += batch.num_rows
+    return row_count
+
+
+def csv_files_to_parquet_buffer(csv_paths, bq_schema):
+    """
+    Converts csv files into one Parquet file in an in-memory buffer rewound to the start,
+    with read_csv_record_batches.
+    """
+    buffer = io.BytesIO()
+    write_parquet_batches((batch for csv_path in csv_paths for batch in read_csv_record_batches(csv_path, bq_schema)),
+                          bq_schema, buffer)
+    buffer.seek(0)
+    return buffer
+
+
+def write_parquet(rows, bq_schema, where, batch_size=50000, compression=PARQUET_COMPRESSION):
+    """
+    Writes csv rows (header first) to a Parquet file path or binary file object and
+    returns the number of rows written.
+    """
+    return write_parquet_batches(rows_to_record_batches(rows, bq_schema, batch_size), bq_schema, where, compression)
+
+
+def csv_to_parquet(csv_path, parquet_path, bq_schema, batch_size=50000):
+    return write_parquet(read_csv_rows(csv_path), bq_schema, parquet_path, batch_size)
+
+
+def rows_to_parquet_buffer(rows, bq_schema, batch_size=50000):
+    """
+    Same as write_parquet, but into an in-memory buffer rewound to the start.
+    """
+    buffer = io.BytesIO()
+    write_parquet(rows, bq_schema, buffer, batch_size)
+    buffer.seek(0)
+    return buffer
+
+
+def compare_round_trip(csv_path, parquet_path, bq_schema):
+    """
+    Reads both files back and returns a list of (row number, column, csv value, parquet value)
+    for every value that did not survive the conversion.
+    """
+    require_pyarrow()
+    table = pq.read_table(parquet_path)
+    rows = read_csv_rows(csv_path)
+    header = next(rows)
+    parquet_rows = table.to_pylist()
+    mismatches = []
+    row_count = 0
+    for row_number, row in enumerate(rows):
+        row_count += 1
+        parquet_row = parquet_rows[row_number] if row_number < len(parquet_rows) else {}
+        for field in bq_schema:
+            expected = BQ_TYPE_CONVERTERS[field.field_type](row[header.index(field.name)])
+            actual = parquet_row.get(field.name)
+            if field.field_type == 'TIMESTAMP' and actual is not None:
+                actual = actual.replace(tzinfo=None)
+            if expected != actual:
+                mismatches.append((row_number, field.name, expected, actual))
+    for row_number in range(row_count, len(parquet_rows)):
+        mismatches.append((row_number, None, None, parquet_rows[row_number]))
+    return mismatches
@@ -0,0 +1,82 @@
+import datetime as dt
+import threading
+
+
+class OAuthTokenManager(object):
+    """
+    Keeps the OAuth access token of one authentication object valid for the whole run. All
+    ServiceClient and ReportingServiceManager instances built from the same AuthorizationData
+    share that authentication, so a single token is requested and refreshed for all of them.
+    The token is refreshed refresh_margin_seconds before it expires, on a background thread,
+    so that no service call has to wait for (or race on) a refresh of an expired token.
+    """
+    def __init__(self, authentication, refresh_margin_seconds=300, utcnow=dt.datetime.utcnow):
+        self.authentication = authentication
+        self.refresh_margin_seconds = refresh_margin_seconds
+        self.utcnow = utcnow
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def get_expires_at(self):
+        oauth_tokens = self.authentication.oauth_tokens
+        if oauth_tokens is None or oauth_tokens.access_token is None:
+            return None
+        if not oauth_tokens.access_token_expires_in_seconds:
+            return dt.datetime.max
+        return oauth_tokens.access_token_received_datetime + dt.timedelta(
+            seconds=oauth_tokens.access_token_expires_in_seconds)
+
+    def get_seconds_left(self):
+        expires_at = self.get_expires_at()
+        if expires_at is None:
+            return 0
+        if expires_at == dt.datetime.max:
+            return float('inf')
+        return (expires_at - self.utcnow()).total_seconds()
+
+    def has_valid_token(self):
+        return self.get_seconds_left() > self.refresh_margin_seconds
+
+    def refresh(self, force=False):
+        """
+        Exchanges the current refresh token for new tokens, unless another thread already did.
+        force refreshes a token that looks valid but was rejected by the service.
+        """
+        with self._lock:
+            if not force and self.has_valid_token():
+                return self.authentication.oauth_tokens
+            return self.authentication.request_oauth_tokens_by_refresh_token(
+                self.authentication.oauth_tokens.refresh_token)
+
+    def ensure_valid_token(self):
+        """
+        Refreshes the token if it expires within the margin, and returns the access token.
+        """
+        if not self.has_valid_token():
+            self.refresh()
+        return self.authentication.oauth_tokens.access_token
+
+    def _refresh_loop(self, retry_seconds):
+        while not self._stopped.is_set():
+            wait_seconds = min(self.get_seconds_left() - self.refresh_margin_seconds, 3600)
+            if self._stopped.wait(max(wait_seconds, 0)):
+                return
+            try:
+                self.refresh()
+            except Exception as ex:
+                # The service clients still refresh an expired token themselves.
+                print("Refreshing the OAuth access token failed: {0}".format(ex))
+                self._stopped.wait(retry_seconds)
+
+    def start_background_refresh(self, retry_seconds=30):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._refresh_loop, args=(retry_seconds,))
+            self._thread.daemon = True
+            self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
@@ -0,0 +1,73 @@
+import threading
+
+
+class ServiceClientFactory(object):
+    """
+    Builds Bing Ads service clients on first use. get_* methods memoise one client per
+    (service, version, environment); create_* methods always build a new one, for worker
+    threads, since suds clients are not thread-safe.
+
+    With a cache_location, the parsed WSDLs are pickled to disk by suds and reused by later
+    runs, which skips most of the client construction time. bingads itself is only imported
+    when the first client is built.
+    """
+    def __init__(self, authorization_data, environment='production', cache_location=None, cache_days=7):
+        self.authorization_data = authorization_data
+        self.environment = environment
+        self.cache_location = cache_location
+        self.cache_days = cache_days
+        self._clients = {}
+        self._lock = threading.Lock()
+
+    def get_suds_options(self):
+        if self.cache_location is None:
+            return {}
+        from suds.cache import ObjectCache
+        # cachingpolicy=1 caches the parsed WSDL objects instead of the raw XML documents.
+        return {'cache': ObjectCache(location=self.cache_location, days=self.cache_days), 'cachingpolicy': 1}
+
+    def create_service_client(self, service, version=13):
+        from bingads.service_client import ServiceClient
+        return ServiceClient(
+            service=service,
+            version=version,
+            authorization_data=self.authorization_data,
+            environment=self.environment,
+            **self.get_suds_options()
+        )
+
+    def get_service_client(self, service, version=13):
+        key = (service, version, self.environment)
+        with self._lock:
+            if key not in self._clients:
+                self._clients[key] = self.create_service_client(service, version)
+            return self._clients[key]
+
+    def create_reporting_service_manager(self, poll_interval_in_milliseconds=5000):
+        from bingads.v13.reporting import ReportingServiceManager
+        return ReportingServiceManager(
+            authorization_data=self.authorization_data,
+            poll_interval_in_milliseconds=poll_interval_in_milliseconds,
+            environment=self.environment,
+            **self.get_suds_options()
+        )
+
+    def get_reporting_service_manager(self, poll_interval_in_milliseconds=5000):
+        key = ('ReportingServiceManager', 13, self.environment)
+        with self._lock:
+            if key not in self._clients:
+                self._clients[key] = self.create_reporting_service_manager(poll_interval_in_milliseconds)
+            return self._clients[key]
+
+    def create_reporting_download_operation(self, request_id, poll_interval_in_milliseconds=5000):
+        """
+        Re-attaches to a report request submitted earlier, e.g. by a run that was interrupted.
+        """
+        from bingads.v13.reporting import ReportingDownloadOperation
+        return ReportingDownloadOperation(
+            request_id=request_id,
+            authorization_data=self.authorization_data,
+            poll_interval_in_milliseconds=poll_interval_in_milliseconds,
+            environment=self.environment,
+            **self.get_suds_options()
+        )
@@ -0,0 +1,120 @@
+import os
+from collections import OrderedDict
+from ms_ads_reports import DIMENSION_DEFINITIONS, NORMALIZED_REPORTS, NULL_VALUES, get_report_dimensions
+from ms_ads_transform import read_csv_rows, write_csv_rows
+
+
+def get_normalized_report_name(file_name, suffix='_input.csv'):
+    for report_name in NORMALIZED_REPORTS:
+        if file_name.endswith(report_name + suffix):
+            return report_name
+    return None
+
+
+class DimensionNormalizer(object):
+    """
+    Normalisation stage of the wide reports (NORMALIZED_REPORTS). The names, urls and tracking
+    settings that they repeat on every row are moved into dimension tables keyed by the ids the
+    rows already include (AccountId, CampaignId, AdGroupId, AdId, KeywordId), and the reports
+    are reduced to slim fact rows that keep the ids; see DIMENSION_DEFINITIONS.
+
+    A dimension collects one row per id across all the reports of the run, with the last values
+    seen, so the dimension tables stay small however many fact rows refer to them.
+    """
+    def __init__(self):
+        self.dimensions = OrderedDict((name, {}) for name in DIMENSION_DEFINITIONS)
+
+    def normalize_rows(self, report_name, rows):
+        """
+        Yields the fact rows of a report, header first, and records its dimension attributes.
+        """
+        rows = iter(rows)
+        header = next(rows, None)
+        if header is None:
+            return
+        plan = []
+        taken = set()
+        for dimension, attribute_names in get_report_dimensions(report_name, header):
+            plan.append((self.dimensions[dimension.name], header.index(dimension.key_column),
+                         tuple(attribute_names), tuple(header.index(name) for name in attribute_names)))
+            taken.update(attribute_names)
+        kept = [position for position, name in enumerate(header) if name not in taken]
+        yield [header[position] for position in kept]
+        for row in rows:
+            for entries, key_position, attribute_names, positions in plan:
+                key = row[key_position]
+                if key in NULL_VALUES:
+                    continue
+                values = tuple(row[position] for position in positions)
+                entry = entries.get(key)
+                if entry is None:
+                    entries[key] = dict(zip(attribute_names, values))
+                elif tuple(entry.get(name) for name in attribute_names) != values:
+                    entry.update(zip(attribute_names, values))
+            yield [row[position] for position in kept]
+
+    def merge_dimension_rows(self, name, rows):
+        """
+        Records the rows of a dimension file written earlier (header first), such as those of an
+        interrupted run. Ids already recorded keep their values.
+        """
+        rows = iter(rows)
+        header = next(rows, None)
+        if header is None:
+            return
+        entries = self.dimensions[name]
+        for row in rows:
+            entries.setdefault(row[0], dict(zip(header[1:], row[1:])))
+
+    def get_dimension_rows(self, name):
+        """
+        Yields the rows of a dimension table, header first.
+        """
+        dimension = DIMENSION_DEFINITIONS[name]
+        yield list(dimension.column_names)
+        for key, entry in self.dimensions[name].items():
+            yield [key] + [entry.get(attribute_name, '') for attribute_name in dimension.attribute_names]
+
+    def get_dimension_names(self):
+        return [name for name, entries in self.dimensions.items() if entries]
+
+    def write_dimension_files(self, directory, suffix='_input.csv'):
+        """
+        Writes every non-empty dimension as <name>_dimension<suffix> and returns the file names.
+        """
+        file_names = []
+        for name in self.get_dimension_names():
+            file_names.append(name + '_dimension' + suffix)
+            write_csv_rows(os.path.join(directory, file_names[-1]), self.get_dimension_rows(name))
+        return file_names
+
+
+def normalize_report_files(directory, normalizer, suffix='_input.csv', run_journal=None):
+    """
+    Replaces every <account>_<report><suffix> file of a normalised report in directory with its
+    <account>_<report>_facts<suffix> fact file, then writes the dimension files next to them.
+
+    The dimension files already in directory, from an interrupted run whose reports were
+    normalised, are merged into the new ones. The report files are only removed once the
+    dimension files are written, and with a run_journal their fact files are recorded in
+    their place.
+    """
+    for name in DIMENSION_DEFINITIONS:
+        dimension_path = os.path.join(directory, name + '_dimension' + suffix)
+        if os.path.exists(dimension_path):
+            normalizer.merge_dimension_rows(name, read_csv_rows(dimension_path))
+    file_names = []
+    for file_name in sorted(os.listdir(directory)):
+        report_name = get_normalized_report_name(file_name, suffix)
+        if report_name is None:
+            continue
+        facts_file_name = file_name[:-len(suffix)] + '_facts' + suffix
+        write_csv_rows(os.path.join(directory, facts_file_name),
+                       normalizer.normalize_rows(report_name, read_csv_rows(os.path.join(directory, file_name))))
+        file_names.append((file_name, facts_file_name))
+    dimension_file_names = normalizer.write_dimension_files(directory, suffix)
+    for file_name, facts_file_name in file_names:
+        if run_journal is not None:
+            run_journal.record_replaced([file_name], facts_file_name)
+        os.remove(os.path.join(directory, file_name))
+    return dimension_file_names
@@ -0,0 +1,315 @@
+import csv
+import http.client
+import io
+import os
+import ssl
+import struct
+import threading
+import time
+import zipfile
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+from ms_ads_retry import RETRY_STATUSES
+from ms_ads_transform import CSV_ENCODING
+
+LOCAL_FILE_HEADER_FORMAT = '<IHHHHHIIIHH'
+LOCAL_FILE_HEADER_SIZE = struct.calcsize(LOCAL_FILE_HEADER_FORMAT)
+LOCAL_FILE_HEADER_SIGNATURE = 0x04034b50
+DATA_DESCRIPTOR_SIGNATURE = 0x08074b50
+
+
+class HttpStatusError(Exception):
+    def __init__(self, url, status, reason):
+        super(HttpStatusError, self).__init__("GET {0} returned {1} {2}".format(url, status, reason))
+        self.status = status
+
+
+def get_ssl_context():
+    """
+    Verifies certificates against the certifi bundle when it is installed (it comes with
+    requests, which bingads depends on), like the bingads downloads do, else the system store.
+    """
+    try:
+        import certifi
+    except ImportError:
+        return ssl.create_default_context()
+    return ssl.create_default_context(cafile=certifi.where())
+
+
+class HttpConnectionPool(object):
+    """
+    Keeps idle keep-alive connections per (scheme, host), so that the result files of many
+    reports, which are all served by the same storage host, reuse a few TLS connections.
+    """
+    def __init__(self, max_idle_per_host=4, timeout_in_seconds=60, ssl_context=None):
+        self.max_idle_per_host = max_idle_per_host
+        self.timeout_in_seconds = timeout_in_seconds
+        self.ssl_context = ssl_context if ssl_context is not None else get_ssl_context()
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    def get_connection(self, scheme, netloc):
+        with self._lock:
+            idle = self._idle.get((scheme, netloc))
+            if idle:
+                return idle.pop()
+        if scheme == 'https':
+            return http.client.HTTPSConnection(netloc, timeout=self.timeout_in_seconds, context=self.ssl_context)
+        return http.client.HTTPConnection(netloc, timeout=self.timeout_in_seconds)
+
+    def release(self, scheme, netloc, connection):
+        with self._lock:
+            idle = self._idle.setdefault((scheme, netloc), [])
+            if len(idle) < self.max_idle_per_host:
+                idle.append(connection)
+                return
+        connection.close()
+
+    def close(self):
+        with self._lock:
+            connections = [connection for idle in self._idle.values() for connection in idle]
+            self._idle = {}
+        for connection in connections:
+            connection.close()
+
+
+def iter_url_chunks(pool, url, chunk_size=65536, max_retries=3, backoff_seconds=1.0, sleep=time.sleep):
+    """
+    Yields the body of url chunk by chunk over a pooled connection. When the connection fails
+    half way, the download continues from the last byte received with a Range request, so the
+    consumer sees one uninterrupted stream. Servers that ignore the Range header are handled by
+    skipping the bytes already yielded.
+    """
+    parts = urlsplit(url)
+    path = parts.path + ('?' + parts.query if parts.query else '')
+    offset = 0
+    attempt = 0
+    while True:
+        connection = pool.get_connection(parts.scheme, parts.netloc)
+        released = False
+        try:
+            headers = {'Range': 'bytes={0}-'.format(offset)} if offset else {}
+            connection.request('GET', path, headers=headers)
+            response = connection.getresponse()
+            if response.status not in (200, 206):
+                response.read()
+                raise HttpStatusError(url, response.status, response.reason)
+            skip = offset if response.status == 200 else 0
+            content_length = response.getheader('Content-Length')
+            received = 0
+            while True:
+                chunk = response.read(chunk_size)
+                if not chunk:
+                    break
+                received += len(chunk)
+                if skip:
+                    skipped = min(skip, len(chunk))
+                    chunk = chunk[skipped:]
+                    skip -= skipped
+                    if not chunk:
+                        continue
+                offset += len(chunk)
+                yield chunk
+            # http.client returns a short body instead of failing when the connection drops.
+            if content_length is not None and received < int(content_length):
+                raise http.client.IncompleteRead(b'', int(content_length) - received)
+            if not response.will_close:
+                pool.release(parts.scheme, parts.netloc, connection)
+                released = True
+            return
+        except (OSError, http.client.HTTPException, HttpStatusError) as ex:
+            if isinstance(ex, HttpStatusError) and ex.status not in RETRY_STATUSES:
+                raise
+            attempt += 1
+            if attempt > max_retries:
+                raise
+            sleep(backoff_seconds * 2 ** (attempt - 1))
+        finally:
+            if not released:
+                connection.close()
+
+
+class ChunkBuffer(object):
+    """
+    Reads exact numbers of bytes from an iterator of byte chunks of any size.
+    """
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.buffer = bytearray()
+
+    def read_some(self):
+        if not self.buffer:
+            return next(self.chunks, b'')
+        data = bytes(self.buffer)
+        del self.buffer[:]
+        return data
+
+    def read_exact(self, size):
+        while len(self.buffer) < size:
+            chunk = next(self.chunks, None)
+            if chunk is None:
+                raise zipfile.BadZipFile("Unexpected end of the zip archive")
+            self.buffer.extend(chunk)
+        data = bytes(self.buffer[:size])
+        del self.buffer[:size]
+        return data
+
+    def unread(self, data):
+        self.buffer[:0] = data
+
+
+def iter_unzipped_chunks(chunks):
+    """
+    Decompresses the first member of a zip archive while the archive is still arriving, from
+    its local file header, and yields the uncompressed bytes. Nothing is buffered beyond the
+    current chunk and the archive never touches the disk. The CRC-32 of the member is checked
+    once it has been read completely.
+    """
+    source = ChunkBuffer(chunks)
+    (signature, _version, flags, method, _time, _date, crc, compressed_size, _size, name_length,
+     extra_length) = struct.unpack(LOCAL_FILE_HEADER_FORMAT, source.read_exact(LOCAL_FILE_HEADER_SIZE))
+    if signature != LOCAL_FILE_HEADER_SIGNATURE:
+        raise zipfile.BadZipFile("Not a zip archive")
+    source.read_exact(name_length + extra_length)
+    has_data_descriptor = flags & 0x08
+
+    running_crc = 0
+    if method == zipfile.ZIP_DEFLATED:
+        decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+        while not decompressor.eof:
+            data = source.read_some()
+            if not data:
+                raise zipfile.BadZipFile("Unexpected end of the zip archive")
+            data = decompressor.decompress(data)
+            if data:
+                running_crc = zlib.crc32(data, running_crc)
+                yield data
+        source.unread(decompressor.unused_data)
+    elif method == zipfile.ZIP_STORED and not has_data_descriptor:
+        remaining = compressed_size
+        while remaining:
+            data = source.read_some()
+            if not data:
+                raise zipfile.BadZipFile("Unexpected end of the zip archive")
+            if len(data) > remaining:
+                source.unread(data[remaining:])
+                data = data[:remaining]
+            remaining -= len(data)
+            running_crc = zlib.crc32(data, running_crc)
+            yield data
+    else:
+        raise zipfile.BadZipFile("Unsupported zip compression method {0}".format(method))
+
+    if has_data_descriptor:
+        # The sizes and CRC follow the data, optionally preceded by a signature.
+        crc = struct.unpack('<I', source.read_exact(4))[0]
+        if crc == DATA_DESCRIPTOR_SIGNATURE:
+            crc = struct.unpack('<I', source.read_exact(4))[0]
+    if running_crc != crc:
+        raise zipfile.BadZipFile("Bad CRC-32 for the zip archive member")
+    # Read the central directory as well, so that the download completes and its connection
+    # can be reused.
+    for _ in source.chunks:
+        pass
+
+
+class ChunkStream(io.RawIOBase):
+    """
+    Read-only binary file object over an iterator of byte chunks.
+    """
+    def __init__(self, chunks):
+        self._chunks = ChunkBuffer(chunks)
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        data = self._chunks.read_some()
+        if len(data) > len(buffer):
+            self._chunks.unread(data[len(buffer):])
+            data = data[:len(buffer)]
+        buffer[:len(data)] = data
+        return len(data)
+
+
+def iter_zip_csv_rows(chunks, encoding=CSV_ENCODING):
+    """
+    Yields the csv rows, header included, of a zipped report while it is being downloaded.
+    """
+    text = io.TextIOWrapper(io.BufferedReader(ChunkStream(iter_unzipped_chunks(chunks))), encoding=encoding,
+                            newline='')
+    for row in csv.reader(text):
+        yield row
+
+
+def extract_zip_chunks(chunks, directory, file_name):
+    """
+    Decompresses a zip archive as it is downloaded straight into directory/file_name, like
+    ReportingDownloadOperation.download_result_file with decompress=True but without writing
+    the archive to disk first. The data goes to a temporary file that only replaces
+    directory/file_name once the CRC-32 has been checked, so a failed download never leaves a
+    partial report behind. Returns the path of the extracted file.
+    """
+    result_file_path = os.path.join(directory, file_name)
+    temp_path = result_file_path + '.tmp'
+    try:
+        with open(temp_path, 'wb') as result_file:
+            for data in iter_unzipped_chunks(chunks):
+                result_file.write(data)
+        os.replace(temp_path, result_file_path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+    return result_file_path
+
+
+class AsyncDownloadEngine(object):
+    """
+    Downloads report result files in the background: a thread pool of max_connections threads
+    runs the downloads over as many pooled keep-alive connections, and submit() returns a
+    concurrent.futures.Future at once, so the threads that poll the reports do not wait for
+    the downloads.
+
+    submit(url, consume) can be called from any thread while reports are still being polled.
+    consume(chunks) is the next stage: it receives the body as an iterator of bytes and its
+    return value is the result of the returned Future. execute(func) runs a download step of
+    its own, such as a download with retries, on the same threads.
+    """
+    def __init__(self, max_connections=4, timeout_in_seconds=60, max_retries=3, chunk_size=65536):
+        self.max_connections = max_connections
+        self.max_retries = max_retries
+        self.chunk_size = chunk_size
+        self.pool = HttpConnectionPool(max_connections, timeout_in_seconds)
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_connections)
+            return self._executor
+
+    def iter_chunks(self, url):
+        return iter_url_chunks(self.pool, url, self.chunk_size, self.max_retries)
+
+    def execute(self, func):
+        return self.start().submit(func)
+
+    def submit(self, url, consume):
+        return self.execute(lambda: consume(self.iter_chunks(url)))
+
+    def close(self):
+        with self._lock:
+            if self._executor is None:
+                return
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        self.pool.close()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -1,7 +1,12 @@
 import ms_ads
-import csv
-import datetime as dt
+import ms_ads_dimensions
+import ms_ads_download
 import os
+import ms_ads_pipeline
+import ms_ads_reports
+import ms_ads_retry
+import ms_ads_state
+import ms_ads_transform
 import ms_ads_uploads
 import argparse
 
@@ -16,7 +21,6 @@ if __name__ == '__main__':
         "-d",
         "--days_back",
         type=int,
-        metavar="",
         required=True,
         help="Look Back Window Start Date"
     )
@@ -25,13 +29,186 @@ if __name__ == '__main__':
         "-s",
         "--days_skip",
         type=int,
-        metavar="",
         required=False,
         default=0,
         help="Look Back Window End Date, if 0 then end date = yesterday"
     )
 
+    parser.add_argument(
+        "-w",
+        "--max_workers",
+        type=int,
+        required=False,
+        default=8,
+        help="Maximum number of reports downloaded at the same time"
+    )
+
+    parser.add_argument(
+        "-p",
+        "--max_per_account",
+        type=int,
+        required=False,
+        default=2,
+        help="Maximum number of reports downloaded at the same time for a single account"
+    )
+
+    parser.add_argument(
+        "-b",
+        "--account_batch_size",
+        type=int,
+        required=False,
+        default=1,
+        help="Number of accounts requested together in a single report"
+    )
+
+    parser.add_argument(
+        "--download_connections",
+        type=int,
+        required=False,
+        default=0,
+        help="Download result files on this many background threads over pooled keep-alive connections, while "
+             "the workers go on polling reports; with 0 each worker streams its own result files"
+    )
+
+    parser.add_argument(
+        "--max_attempts",
+        type=int,
+        required=False,
+        default=4,
+        help="Attempts per report call on throttling and transient errors"
+    )
+
+    parser.add_argument(
+        "--retry_budget",
+        type=int,
+        required=False,
+        default=100,
+        help="Maximum number of retries in the whole run"
+    )
+
+    parser.add_argument(
+        "--split_by_account",
+        action="store_true",
+        help="Split the reports of account batches back into one file per account"
+    )
+
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="Only request the days that are not loaded yet or may still be restated"
+    )
+
+    parser.add_argument(
+        "--restatement_days",
+        type=int,
+        required=False,
+        default=7,
+        help="Number of recent days that are requested again because conversions can still change"
+    )
+
+    parser.add_argument(
+        "--ads_dictionary_cache",
+        action="store_true",
+        help="Keep a local ads dictionary and only request recent days for accounts already in it"
+    )
+
+    parser.add_argument(
+        "--account_cache_ttl",
+        type=float,
+        required=False,
+        default=0,
+        help="Hours the account list is cached on disk, 0 disables the cache"
+    )
+
+    parser.add_argument(
+        "--account_page_wave_size",
+        type=int,
+        required=False,
+        default=1,
+        help="Number of account list pages requested in parallel"
+    )
+
+    parser.add_argument(
+        "--background_account_refresh",
+        action="store_true",
+        help="Start from an expired cached account list and refresh it in the background"
+    )
+
+    parser.add_argument(
+        "--result_cache",
+        action="store_true",
+        help="Reuse report results downloaded by earlier runs for identical requests"
+    )
+
+    parser.add_argument(
+        "--result_cache_size",
+        type=int,
+        required=False,
+        default=2048,
+        help="Maximum size of the report result cache in MB"
+    )
+
+    parser.add_argument(
+        "--vectorized_csv",
+        action="store_true",
+        help="With Parquet loads, parse report files with the vectorized pyarrow csv reader"
+    )
+
+    parser.add_argument(
+        "--normalize_dimensions",
+        action="store_true",
+        help="Load the wide reports as fact tables next to account, campaign, ad group, ad and keyword tables"
+    )
+
+    parser.add_argument(
+        "--column_profile",
+        action="append",
+        default=[],
+        help="REPORT=PROFILE: request only the columns of a profile (core_metrics, quality, full) or a "
+             "comma-separated list of columns for a report; can be repeated"
+    )
+
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Journal the state of every report, and resume the previous run if it was interrupted"
+    )
+
+    parser.add_argument(
+        "--shard_days",
+        action="append",
+        default=[],
+        help="REPORT=DAYS: request a report in date shards of at most DAYS days, which run in parallel; "
+             "with --pipeline the shards are loaded as separate load jobs; can be repeated"
+    )
+
+    parser.add_argument(
+        "--adaptive_sharding",
+        action="store_true",
+        help="Size the date shards of the --shard_days reports from the row counts of previous runs"
+    )
+
+    parser.add_argument(
+        "--pipeline",
+        action="store_true",
+        help="Stream reports straight into Big Query without writing intermediate files"
+    )
+
+    parser.add_argument(
+        "-f",
+        "--load_format",
+        choices=["csv", "parquet"],
+        required=False,
+        default="csv",
+        help="File format used for the Big Query load jobs"
+    )
+
     args = parser.parse_args()
+    try:
+        column_profiles = ms_ads_reports.parse_column_profiles(args.column_profile)
+        shard_days = ms_ads_reports.parse_shard_days(args.shard_days)
+    except ValueError as ex:
+        parser.error(str(ex))
 
     # Account Credentials
     CLIENT_ID = 'my_client_id'
@@ -49,6 +226,10 @@ if __name__ == '__main__':
 
     # Initializing an Extractor Instance
     extractor = ms_ads.MicrosoftAdsAPI(CLIENT_ID, DEVELOPER_TOKEN, ENVIRONMENT, REFRESH_TOKEN, CLIENT_STATE)
+    extractor.retry_policy = ms_ads_retry.RetryPolicy(max_attempts=args.max_attempts)
+    extractor.RETRY_BUDGET = args.retry_budget
+    extractor.COLUMN_PROFILES = column_profiles
+    extractor.SHARD_DAYS = shard_days
 
     # Input Dates
     custom_dates = extractor.get_custom_dates(args.days_back, args.days_skip)
@@ -56,6 +237,13 @@ if __name__ == '__main__':
     date_from = custom_dates[0]
     date_to = custom_dates[1]
 
+    run_journal = None
+    if args.resume:
+        run_journal = ms_ads_state.RunJournal(extractor.RUN_JOURNAL_FILE)
+        if run_journal.is_resuming():
+            print("Resuming the interrupted run of {0} to {1}".format(*run_journal.window))
+        date_from, date_to = run_journal.start(date_from, date_to)
+
     print("Loading the web service client proxies...")
     authorization_data = ms_ads.AuthorizationData(
         account_id=None,
@@ -64,63 +252,128 @@ if __name__ == '__main__':
         authentication=None,
     )
 
-    customer_service = ms_ads.ServiceClient(
-        service='CustomerManagementService',
-        version=13,
-        authorization_data=authorization_data,
-        environment=extractor.ENVIRONMENT,
-    )
+    # Service clients are built on first use and their WSDLs are cached on disk across runs.
+    service_client_factory = extractor.get_service_client_factory(authorization_data)
+    reporting_service = service_client_factory.get_service_client('ReportingService')
+    reporting_service_manager_factory = service_client_factory.create_reporting_service_manager
 
-    reporting_service_manager = ms_ads.ReportingServiceManager(
-        authorization_data=authorization_data,
-        poll_interval_in_milliseconds=5000,
-        environment=extractor.ENVIRONMENT,
-    )
+    watermark_store = None
+    if args.incremental:
+        watermark_store = ms_ads_state.WatermarkStore(extractor.WATERMARK_FILE, args.restatement_days)
 
-    reporting_service = ms_ads.ServiceClient(
-        service='ReportingService',
-        version=13,
-        authorization_data=authorization_data,
-        environment=extractor.ENVIRONMENT,
-    )
+    ads_dictionary_cache = None
+    if args.ads_dictionary_cache:
+        ads_dictionary_cache = ms_ads_state.AdDictionaryCache(extractor.get_ads_dictionary_cache_file())
+
+    row_count_stats = None
+    if args.adaptive_sharding:
+        row_count_stats = ms_ads_state.RowCountStats(extractor.ROW_COUNT_STATS_FILE)
+
+    result_cache = None
+    if args.result_cache:
+        result_cache = ms_ads_state.ReportResultCache(extractor.RESULT_CACHE_DIRECTORY,
+                                                      args.result_cache_size * 1024 ** 2,
+                                                      args.restatement_days)
 
-    account_ids = extractor.authenticate(authorization_data)
+    account_cache = None
+    if args.account_cache_ttl > 0:
+        account_cache = ms_ads_state.AccountListCache(extractor.ACCOUNTS_CACHE_FILE, args.account_cache_ttl * 3600)
+
+    account_ids = extractor.authenticate(authorization_data, account_cache, args.background_account_refresh,
+                                         args.account_page_wave_size)
     print(account_ids)
-    for account in account_ids:
-        print(account)
-        report_request = extractor.get_requested_reports_download_report(account,
-                                                                         reporting_service,
-                                                                         reporting_service_manager,
-                                                                         date_from,
-                                                                         date_to
-                                                                         )
-
-    _insert_time = dt.datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
-    directory = extractor.FILE_DIRECTORY
-    for file_name in os.listdir(directory):
-        if file_name.endswith(".csv"):
-            output_data = list()
-            headers = list()
-            with open(r'{0}/{1}'.format(directory, file_name), 'r', encoding='utf-8-sig')as read_file:
-                data = csv.reader(read_file, delimiter=',')
-                for enum, row in enumerate(data):
-                    if enum == 0:
-                        row.insert(0, '_insert_time')
-                        headers.extend(row)
-                        output_data.append(row)
-                    if enum > 0:
-                        row.insert(0, _insert_time)
-                        output_data.append(row)
-
-            with open(r'{0}/{1}'.format(directory, file_name.replace("input", "output")), 'w', newline='',
-                      encoding='utf-8-sig') as resultFile:
-                wr = csv.writer(resultFile)
-                for item in output_data:
-                    wr.writerow(item)
-    if WRITE_TO_BQ:
-        data_uploader = ms_ads_uploads.DataUploader()
-        data_uploader.execute_uploader(directory)
-
-    for file_name in os.listdir(directory):
-         os.remove(r'{0}/{1}'.format(directory, file_name))
+    normalizer = None
+    if args.normalize_dimensions:
+        normalizer = ms_ads_dimensions.DimensionNormalizer()
+
+    # Reports that fail are collected and reported once the others are loaded.
+    failures = []
+    upload_failures = []
+    if args.pipeline and WRITE_TO_BQ:
+        pipeline = ms_ads_pipeline.ReportPipeline(extractor,
+                                                  ms_ads_uploads.DataUploader(source_format=args.load_format,
+                                                                              column_profiles=column_profiles),
+                                                  ms_ads_transform.get_insert_time(),
+                                                  account_batch_size=args.account_batch_size,
+                                                  watermark_store=watermark_store,
+                                                  ads_dictionary_cache=ads_dictionary_cache,
+                                                  row_count_stats=row_count_stats,
+                                                  result_cache=result_cache,
+                                                  run_journal=run_journal,
+                                                  normalizer=normalizer)
+        try:
+            pipeline.run(account_ids, reporting_service, service_client_factory.get_reporting_service_manager(),
+                         date_from, date_to)
+        except ms_ads_retry.ReportRunError as ex:
+            failures.extend(ex.failures)
+    else:
+        download_engine = None
+        if args.download_connections > 0:
+            download_engine = ms_ads_download.AsyncDownloadEngine(args.download_connections,
+                                                                  extractor.TIMEOUT_IN_MILLISECONDS / 1000.0)
+        try:
+            extractor.get_requested_reports_download_concurrently(account_ids,
+                                                                  reporting_service,
+                                                                  reporting_service_manager_factory,
+                                                                  date_from,
+                                                                  date_to,
+                                                                  max_workers=args.max_workers,
+                                                                  max_per_account=args.max_per_account,
+                                                                  account_batch_size=args.account_batch_size,
+                                                                  split_by_account=args.split_by_account,
+                                                                  watermark_store=watermark_store,
+                                                                  ads_dictionary_cache=ads_dictionary_cache,
+                                                                  row_count_stats=row_count_stats,
+                                                                  download_engine=download_engine,
+                                                                  result_cache=result_cache,
+                                                                  run_journal=run_journal
+                                                                  )
+        except ms_ads_retry.ReportRunError as ex:
+            failures.extend(ex.failures)
+        finally:
+            if download_engine is not None:
+                download_engine.close()
+
+        _insert_time = ms_ads_transform.get_insert_time()
+        directory = extractor.FILE_DIRECTORY
+        if normalizer is not None:
+            ms_ads_dimensions.normalize_report_files(directory, normalizer, run_journal=run_journal)
+        ms_ads_transform.stamp_report_files(directory, _insert_time)
+        if run_journal is not None:
+            run_journal.record_all(ms_ads_state.TRANSFORMED)
+
+        if WRITE_TO_BQ:
+            data_uploader = ms_ads_uploads.DataUploader(source_format=args.load_format,
+                                                        vectorized=args.vectorized_csv,
+                                                        column_profiles=column_profiles)
+            upload_failures = data_uploader.execute_uploader(directory, run_journal)
+            failures.extend(upload_failures)
+            if run_journal is not None and not upload_failures:
+                run_journal.record_all(ms_ads_state.UPLOADED)
+
+        # A resumed run loads the files of the tables that failed again.
+        if run_journal is None or not upload_failures:
+            for file_name in os.listdir(directory):
+                os.remove(r'{0}/{1}'.format(directory, file_name))
 
+    # Watermarks and the ads dictionary are only saved once the data is loaded, so a failed run
+    # is requested again. Failed reports are not marked in the watermarks, but a failed table
+    # load comes after its reports were marked.
+    if watermark_store is not None and not upload_failures:
+        watermark_store.save()
+    if ads_dictionary_cache is not None and not upload_failures:
+        ads_dictionary_cache.save()
+    if row_count_stats is not None:
+        row_count_stats.save()
+    if result_cache is not None:
+        result_cache.save()
+    # The run is complete: the next one starts from scratch. A run with failed reports is kept
+    # so that --resume requests only those again.
+    if run_journal is not None and not failures:
+        run_journal.finish()
+    if extractor.account_refresh_thread is not None:
+        extractor.account_refresh_thread.join()
+    if extractor.token_manager is not None:
+        extractor.token_manager.stop()
+    if failures:
+        raise ms_ads_retry.ReportRunError(failures)
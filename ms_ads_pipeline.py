@@ -0,0 +1,295 @@
+import os
+from ms_ads_download import HttpConnectionPool, iter_url_chunks, iter_zip_csv_rows
+from ms_ads_reports import NORMALIZED_REPORTS, get_request_fingerprint
+from ms_ads_retry import ReportRunError, RetryBudget
+from ms_ads_scheduler import ReportJob
+from ms_ads_state import READY, SUBMITTED, UPLOADED
+from ms_ads_transform import add_insert_time, chunked, read_csv_rows, tee_csv_rows
+
+
+def fetch_report_rows(report_download_url, timeout_in_seconds=3600, connection_pool=None):
+    """
+    Yields the csv rows, header included, of a zipped report result while it is downloaded and
+    decompressed. Nothing is written to disk or held in memory beyond the current chunk. The
+    download reuses the keep-alive connections of connection_pool and resumes where it stopped
+    if the connection drops.
+    """
+    if connection_pool is None:
+        connection_pool = HttpConnectionPool(timeout_in_seconds=timeout_in_seconds)
+    return iter_zip_csv_rows(iter_url_chunks(connection_pool, report_download_url))
+
+
+class ReportPipeline(object):
+    """
+    End-to-end mode: every report is submitted once, and as soon as it is ready its result
+    is parsed in memory, stamped with _insert_time and handed to the uploader in batches.
+    No intermediate files are written to FILE_DIRECTORY.
+
+    With a run_journal, download, transform and upload are one step per report, recorded as
+    uploaded; a resumed run skips the uploaded reports and polls the submitted ones again by
+    request id.
+
+    With a normalizer (see ms_ads_dimensions), the wide reports are loaded as fact rows and the
+    dimension tables are loaded once all the reports are in. Reports skipped by a resumed run
+    do not contribute to the dimension tables.
+
+    A report that fails is left out and the others are still loaded; run raises a
+    ReportRunError listing the failed reports at the end.
+
+    The date shards of the reports in extractor.SHARD_DAYS are loaded as they arrive, each in
+    its own load job. With row_count_stats, shards are sized from previous runs and the rows
+    per day of a sharded report are recorded once all of its shards are loaded.
+    """
+    def __init__(self, extractor, data_uploader, insert_time, batch_size=10000, account_batch_size=1,
+                 watermark_store=None, ads_dictionary_cache=None, result_cache=None, run_journal=None,
+                 normalizer=None, row_count_stats=None):
+        self.extractor = extractor
+        self.data_uploader = data_uploader
+        self.insert_time = insert_time
+        self.batch_size = batch_size
+        self.account_batch_size = account_batch_size
+        self.watermark_store = watermark_store
+        self.ads_dictionary_cache = ads_dictionary_cache
+        self.result_cache = result_cache
+        self.run_journal = run_journal
+        self.normalizer = normalizer
+        self.row_count_stats = row_count_stats
+        self.row_counts = {}
+        self.retry_budget = RetryBudget(extractor.RETRY_BUDGET)
+        self.connection_pool = HttpConnectionPool(timeout_in_seconds=extractor.TIMEOUT_IN_MILLISECONDS / 1000.0)
+
+    def get_report_batches(self, rows, job):
+        if job.report_name == 'ads_dictionary_report' and self.ads_dictionary_cache is not None:
+            self.ads_dictionary_cache.merge_rows(rows)
+            rows = self.ads_dictionary_cache.get_rows(job.account_ids)
+        if self.is_normalized(job):
+            rows = self.normalizer.normalize_rows(job.report_name, rows)
+        return chunked(add_insert_time(rows, self.insert_time), self.batch_size)
+
+    def run(self, account_ids, _reporting_service, _reporting_service_manager, date_from, date_to):
+        scheduler = self.extractor.get_report_polling_scheduler(_reporting_service_manager)
+        jobs = {}
+        shards_by_report = {}
+        for job in self.extractor.get_report_jobs(account_ids, _reporting_service, date_from, date_to,
+                                                  self.account_batch_size, self.watermark_store,
+                                                  self.ads_dictionary_cache, self.row_count_stats):
+            jobs[job.result_file_name] = job
+            if job.shard_index is not None:
+                shards_by_report.setdefault((job.account_id, job.report_name), []).append(job)
+        attached = set()
+        for job in jobs.values():
+            try:
+                if self.load_journaled_result(job, shards_by_report) or \
+                        self.load_cached_result(job, shards_by_report):
+                    continue
+            except Exception as ex:
+                self.fail(job, ex)
+                continue
+            if self.attach(scheduler, job, _reporting_service_manager):
+                attached.add(job.result_file_name)
+            else:
+                self.submit(scheduler, job)
+
+        shard_attempts = {}
+        for pending in scheduler.run():
+            self.extractor.output_status_message("-----\n{0}: {1}".format(
+                pending.key, pending.status.status if pending.status else None))
+            job = jobs[pending.key]
+            if pending.error is not None:
+                self.extractor.output_status_message(pending.error)
+                # A request of an interrupted run that cannot be tracked any more is submitted again.
+                if pending.key in attached:
+                    attached.remove(pending.key)
+                    self.submit(scheduler, job)
+                    continue
+                # A failed shard is submitted again on its own, the other shards are kept.
+                if job.shard_count > 1 and shard_attempts.get(pending.key, 0) < self.extractor.SHARD_RETRIES:
+                    shard_attempts[pending.key] = shard_attempts.get(pending.key, 0) + 1
+                    self.submit(scheduler, job)
+                else:
+                    job.error = pending.error
+                continue
+            if self.run_journal is not None:
+                self.run_journal.record(job.result_file_name, READY)
+            try:
+                self.load_report(job, pending.status.report_download_url, shards_by_report)
+            except Exception as ex:
+                self.fail(job, ex)
+        failures = [(job.result_file_name, job.error) for job in jobs.values() if job.error is not None]
+        if self.normalizer is not None:
+            failures.extend(self.load_dimensions())
+        if failures:
+            raise ReportRunError(failures)
+
+    def load_report(self, job, report_download_url, shards_by_report):
+        """
+        Streams the result of a ready report into its table.
+        """
+        rows = None
+        if report_download_url is not None:
+            rows = fetch_report_rows(report_download_url, connection_pool=self.connection_pool)
+            if self.result_cache is not None:
+                rows = tee_csv_rows(rows, self.get_download_path(job))
+        if not self.load_rows(job, rows, shards_by_report):
+            return
+        if self.result_cache is not None:
+            self.cache_result(job, rows is not None)
+        if self.run_journal is not None:
+            self.run_journal.record(job.result_file_name, UPLOADED)
+
+    def fail(self, job, ex):
+        job.error = ex
+        self.extractor.output_status_message("Could not load {0}: {1}".format(job.result_file_name, ex))
+
+    def is_normalized(self, job):
+        return self.normalizer is not None and job.report_name in NORMALIZED_REPORTS
+
+    def load_dimensions(self):
+        """
+        Loads every dimension table and returns the (table name, exception) tuples of those that failed.
+        """
+        failures = []
+        for name in self.normalizer.get_dimension_names():
+            table_name = self.data_uploader.get_table_name(name + '_dimension')
+            try:
+                self.data_uploader.upload_rows(table_name, add_insert_time(self.normalizer.get_dimension_rows(name),
+                                                                           self.insert_time))
+            except Exception as ex:
+                self.extractor.output_status_message("Could not load {0}: {1}".format(table_name, ex))
+                failures.append((table_name, ex))
+        return failures
+
+    def load_rows(self, job, rows, shards_by_report):
+        """
+        Uploads the rows of a report (None for a report without data) and marks it as loaded.
+        Returns False for reports that have no destination table.
+        """
+        if rows is not None:
+            table_name = self.data_uploader.get_table_name(job.report_name + '_facts' if self.is_normalized(job)
+                                                           else job.report_name)
+            if table_name is None:
+                return False
+            if self.row_count_stats is not None and job.shard_index is not None:
+                rows = self.count_rows(job, rows)
+            self.data_uploader.upload_batches(table_name, self.get_report_batches(rows, job))
+        else:
+            self.extractor.output_status_message("There is no report data for {0}.".format(job.result_file_name))
+            self.row_counts[job.result_file_name] = 0
+        job.result = job.result_file_name
+        if self.watermark_store is not None:
+            self.mark_loaded(job, shards_by_report)
+        if self.row_count_stats is not None and job.shard_index is not None:
+            self.record_row_count(job, shards_by_report)
+        return True
+
+    def count_rows(self, job, rows):
+        """
+        Passes rows through, counting the data rows of job in row_counts.
+        """
+        self.row_counts[job.result_file_name] = 0
+        for position, row in enumerate(rows):
+            if position:
+                self.row_counts[job.result_file_name] += 1
+            yield row
+
+    def record_row_count(self, job, shards_by_report):
+        """
+        Records the rows per day of a sharded report in row_count_stats, once all of its shards
+        are loaded; shards skipped by a resumed run leave it unrecorded.
+        """
+        shards = shards_by_report[(job.account_id, job.report_name)]
+        if any(shard.result_file_name not in self.row_counts for shard in shards):
+            return
+        row_count = sum(self.row_counts[shard.result_file_name] for shard in shards)
+        days = (max(shard.date_to for shard in shards) - min(shard.date_from for shard in shards)).days + 1
+        for account_id in job.account_ids:
+            self.row_count_stats.record(account_id, self.extractor.get_report_state_key(job.report_name),
+                                        float(row_count) / len(job.account_ids), days)
+
+    def load_journaled_result(self, job, shards_by_report):
+        """
+        Skips a report that an interrupted run already uploaded; it is still marked as loaded.
+        """
+        if self.run_journal is None or not self.run_journal.has_reached(
+                job.result_file_name, get_request_fingerprint(job.report_request), UPLOADED):
+            return False
+        self.extractor.output_status_message("-----\n{0}: already uploaded".format(job.result_file_name))
+        job.result = job.result_file_name
+        if self.watermark_store is not None:
+            self.mark_loaded(job, shards_by_report)
+        return True
+
+    def load_cached_result(self, job, shards_by_report):
+        if self.result_cache is None:
+            return False
+        hit, cached_path = self.result_cache.get(get_request_fingerprint(job.report_request))
+        if not hit:
+            return False
+        self.extractor.output_status_message("-----\n{0}: served from the result cache".format(job.result_file_name))
+        if self.load_rows(job, read_csv_rows(cached_path) if cached_path is not None else None, shards_by_report) \
+                and self.run_journal is not None:
+            self.run_journal.record(job.result_file_name, UPLOADED,
+                                    fingerprint=get_request_fingerprint(job.report_request),
+                                    report_name=job.report_name)
+        return True
+
+    def get_download_path(self, job):
+        if not os.path.exists(self.result_cache.directory):
+            os.makedirs(self.result_cache.directory)
+        return os.path.join(self.result_cache.directory, get_request_fingerprint(job.report_request) + '.download')
+
+    def cache_result(self, job, has_data):
+        download_path = self.get_download_path(job)
+        self.result_cache.put(get_request_fingerprint(job.report_request), download_path if has_data else None,
+                              job.date_to)
+        if has_data:
+            os.remove(download_path)
+
+    def attach(self, scheduler, job, _reporting_service_manager):
+        """
+        Polls the request an interrupted run submitted for job again, instead of submitting it.
+        """
+        if self.run_journal is None:
+            return False
+        task = self.run_journal.get_task(job.result_file_name, get_request_fingerprint(job.report_request))
+        if task is None or not task.get('request_id'):
+            return False
+        scheduler.attach(job.result_file_name, job.report_name,
+                         self.extractor.attach_download_operation(task['request_id'], _reporting_service_manager))
+        self.extractor.output_status_message("Re-attached {0} to request {1}".format(job.result_file_name,
+                                                                                    task['request_id']))
+        return True
+
+    def submit(self, scheduler, job):
+        """
+        Submits a report with retries; a report that cannot be submitted is left out of the run.
+        """
+        try:
+            operation = self.extractor.call_with_retry(
+                lambda: scheduler.submit(job.result_file_name, job.report_request),
+                job.result_file_name, self.retry_budget)
+        except Exception as ex:
+            job.error = ex
+            self.extractor.output_status_message("Could not submit {0}: {1}".format(job.result_file_name, ex))
+            return
+        if self.run_journal is not None:
+            self.run_journal.record(job.result_file_name, SUBMITTED, request_id=operation.request_id,
+                                    fingerprint=get_request_fingerprint(job.report_request),
+                                    report_name=job.report_name)
+
+    def mark_loaded(self, job, shards_by_report):
+        """
+        Marks a report as loaded; a sharded report only once all of its shards are uploaded,
+        over the whole window of the shards.
+        """
+        if job.shard_index is None:
+            self.extractor.mark_job_loaded(job, self.watermark_store)
+            return
+        shards = shards_by_report[(job.account_id, job.report_name)]
+        if any(shard.result is None for shard in shards):
+            return
+        self.extractor.mark_job_loaded(ReportJob(job.account_id, job.report_request, job.result_file_name,
+                                                 account_ids=job.account_ids,
+                                                 date_from=min(shard.date_from for shard in shards),
+                                                 date_to=max(shard.date_to for shard in shards)),
+                                       self.watermark_store)
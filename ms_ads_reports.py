@@ -0,0 +1,842 @@
+import copy
+import datetime as dt
+import hashlib
+import json
+from collections import OrderedDict
+from ms_ads_transform import INSERT_TIME_COLUMN
+
+REFERENCE = """
+    Report Types
+    https://docs.microsoft.com/en-us/advertising/guides/report-types?view=bingads-13
+"""
+
+# Microsoft Advertising writes '--' for values that do not apply to a row.
+NULL_VALUES = ('', '--')
+
+
+def to_int(value):
+    return None if value in NULL_VALUES else int(value.replace(',', ''))
+
+
+def to_float(value):
+    return None if value in NULL_VALUES else float(value.replace(',', '').rstrip('%'))
+
+
+def to_date(value):
+    return None if value in NULL_VALUES else dt.datetime.strptime(value, "%Y-%m-%d").date()
+
+
+def to_timestamp(value):
+    return None if value in NULL_VALUES else dt.datetime.strptime(value, "%Y-%m-%d %H:%M:%S")
+
+
+def to_string(value):
+    return None if value in NULL_VALUES else value
+
+
+BQ_TYPE_CONVERTERS = {
+    'INT64': to_int,
+    'INTEGER': to_int,
+    'FLOAT64': to_float,
+    'FLOAT': to_float,
+    'DATE': to_date,
+    'TIMESTAMP': to_timestamp,
+    'STRING': to_string,
+}
+
+
+class ReportDefinition(object):
+    """
+    Declarative description of a report: the request and scope types to build, the columns to
+    request together with their Big Query types, and the table the report is loaded into.
+    Request builders and table schemas are both derived from it.
+    """
+    def __init__(self, report_name, request_type, column_type, scope_type, columns, table_name=None,
+                 supports_aggregation=True):
+        self.report_name = report_name
+        self.request_type = request_type
+        self.column_type = column_type
+        self.column_array_type = 'ArrayOf' + column_type
+        self.scope_type = scope_type
+        self.columns = tuple(columns)
+        self.column_names = tuple(name for name, _ in self.columns)
+        self.table_name = table_name
+        self.supports_aggregation = supports_aggregation
+        self.column_types = dict(self.columns)
+        self.column_types[INSERT_TIME_COLUMN] = 'TIMESTAMP'
+
+    def get_table_columns(self):
+        """
+        Columns of the destination table: _insert_time followed by the report columns.
+        """
+        return ((INSERT_TIME_COLUMN, 'TIMESTAMP'),) + self.columns
+
+
+def build_report_request(_reporting_service, definition, account_id, aggregation, exclude_column_headers,
+                         exclude_report_footer, exclude_report_header, report_file_format,
+                         return_only_complete_data, report_time, columns=None):
+    """
+    Builds the request of a report definition; columns (see get_profile_column_names) requests
+    only some of its columns.
+    """
+    report_request = _reporting_service.factory.create(definition.request_type)
+    if definition.supports_aggregation:
+        report_request.Aggregation = aggregation
+    report_request.ExcludeColumnHeaders = exclude_column_headers
+    report_request.ExcludeReportFooter = exclude_report_footer
+    report_request.ExcludeReportHeader = exclude_report_header
+    report_request.Format = report_file_format
+    report_request.ReturnOnlyCompleteData = return_only_complete_data
+    report_request.Time = report_time
+    report_request.ReportName = definition.report_name
+    scope = _reporting_service.factory.create(definition.scope_type)
+    scope.AccountIds = {'long': [account_id]}
+    scope.Campaigns = None
+    if definition.scope_type == 'AccountThroughAdGroupReportScope':
+        scope.AdGroups = None
+    report_request.Scope = scope
+
+    report_columns = _reporting_service.factory.create(definition.column_array_type)
+    getattr(report_columns, definition.column_type).append(list(columns or definition.column_names))
+    report_request.Columns = report_columns
+    return report_request
+
+
+def shard_date_range(date_from, date_to, shard_days):
+    """
+    Splits [date_from, date_to] into consecutive, ordered sub-ranges of at most shard_days days.
+    """
+    shards = []
+    shard_from = date_from
+    while shard_from <= date_to:
+        shard_to = min(shard_from + dt.timedelta(shard_days - 1), date_to)
+        shards.append((shard_from, shard_to))
+        shard_from = shard_to + dt.timedelta(1)
+    return shards
+
+
+def clone_suds_object(suds_object):
+    """
+    Shallow copy of a suds object: nested objects are shared with the original, but the
+    copy's own fields can be reassigned without touching it.
+    """
+    clone = copy.copy(suds_object)
+    clone.__keylist__ = list(suds_object.__keylist__)
+    return clone
+
+
+def set_report_request_account_ids(report_request, account_ids):
+    report_request = clone_suds_object(report_request)
+    scope = clone_suds_object(report_request.Scope)
+    scope.AccountIds = {'long': list(account_ids)}
+    report_request.Scope = scope
+    return report_request
+
+
+def suds_to_plain(value):
+    """
+    Converts a suds object tree into dicts, lists and scalars, keeping the type of every object.
+    """
+    if hasattr(value, '__keylist__'):
+        plain = dict((key, suds_to_plain(item)) for key, item in value)
+        plain['__type__'] = value.__class__.__name__
+        return plain
+    if isinstance(value, dict):
+        return dict((str(key), suds_to_plain(item)) for key, item in value.items())
+    if isinstance(value, (list, tuple)):
+        return [suds_to_plain(item) for item in value]
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    return str(value)
+
+
+def get_request_fingerprint(report_request):
+    """
+    Hash of everything a report request asks for: report type, columns, scope, time window,
+    aggregation, ReturnOnlyCompleteData and format. Equal requests return equal results.
+    """
+    serialized = json.dumps(suds_to_plain(report_request), sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(serialized.encode('utf-8')).hexdigest()
+
+
+class ReportRequestCache(object):
+    """
+    Keeps built report requests per key (e.g. date window) so that the suds objects (time,
+    dates, scope and column arrays) are created once per run instead of once per account.
+    get() hands out copies where only Scope.AccountIds differs; the column arrays and the
+    time objects are shared and must not be modified.
+    """
+    def __init__(self):
+        self._templates = {}
+
+    def get(self, key, account_ids, build):
+        templates = self._templates.get(key)
+        if templates is None:
+            templates = self._templates[key] = tuple(build())
+        return tuple(set_report_request_account_ids(template, account_ids) for template in templates)
+
+    def clear(self):
+        self._templates.clear()
+
+
+REPORT_DEFINITIONS = OrderedDict((definition.report_name, definition) for definition in [
+    ReportDefinition(
+        report_name='budget_summary_report',
+        request_type='BudgetSummaryReportRequest',
+        column_type='BudgetSummaryReportColumn',
+        scope_type='AccountThroughCampaignReportScope',
+        table_name=None,
+        supports_aggregation=False,
+        columns=[
+            ('AccountName', 'STRING'),
+            ('AccountNumber', 'STRING'),
+            ('AccountId', 'INT64'),
+            ('CampaignName', 'STRING'),
+            ('CampaignId', 'INT64'),
+            ('Date', 'DATE'),
+            ('CurrencyCode', 'STRING'),
+            ('MonthlyBudget', 'FLOAT64'),
+            ('DailySpend', 'FLOAT64'),
+            ('MonthToDateSpend', 'FLOAT64')
+        ]
+    ),
+    ReportDefinition(
+        report_name='campaign_performance_report',
+        request_type='CampaignPerformanceReportRequest',
+        column_type='CampaignPerformanceReportColumn',
+        scope_type='AccountThroughCampaignReportScope',
+        table_name=None,
+        supports_aggregation=True,
+        columns=[
+            ('TimePeriod', 'DATE'),
+            ('CampaignId', 'INT64'),
+            ('CampaignName', 'STRING'),
+            ('DeviceType', 'STRING'),
+            ('Network', 'STRING'),
+            ('Impressions', 'INT64'),
+            ('Clicks', 'INT64'),
+            ('Spend', 'FLOAT64')
+        ]
+    ),
+    ReportDefinition(
+        report_name='search_query_performance_report',
+        request_type='SearchQueryPerformanceReportRequest',
+        column_type='SearchQueryPerformanceReportColumn',
+        scope_type='AccountThroughAdGroupReportScope',
+        table_name='microsoft_ads_search_query_performance_table',
+        supports_aggregation=True,
+        columns=[
+            ('AccountName', 'STRING'),
+            ('AccountNumber', 'STRING'),
+            ('AccountId', 'INT64'),
+            ('TimePeriod', 'DATE'),
+            ('CampaignName', 'STRING'),
+            ('CampaignId', 'INT64'),
+            ('AdGroupName', 'STRING'),
+            ('AdGroupId', 'INT64'),
+            ('AdId', 'INT64'),
+            ('AdType', 'STRING'),
+            ('DestinationUrl', 'STRING'),
+            ('BidMatchType', 'STRING'),
+            ('DeliveredMatchType', 'STRING'),
+            ('CampaignStatus', 'STRING'),
+            ('AdStatus', 'STRING'),
+            ('Impressions', 'INT64'),
+            ('Clicks', 'INT64'),
+            ('AverageCpc', 'FLOAT64'),
+            ('Spend', 'FLOAT64'),
+            ('AveragePosition', 'FLOAT64'),
+            ('SearchQuery', 'STRING'),
+            ('Keyword', 'STRING'),
+            ('AdGroupCriterionId', 'INT64'),
+            ('Conversions', 'FLOAT64'),
+            ('CostPerConversion', 'FLOAT64'),
+            ('Language', 'STRING'),
+            ('KeywordId', 'INT64'),
+            ('Network', 'STRING'),
+            ('TopVsOther', 'STRING'),
+            ('DeviceType', 'STRING'),
+            ('DeviceOS', 'STRING'),
+            ('Assists', 'FLOAT64'),
+            ('Revenue', 'FLOAT64'),
+            ('ReturnOnAdSpend', 'FLOAT64'),
+            ('CostPerAssist', 'FLOAT64'),
+            ('RevenuePerConversion', 'FLOAT64'),
+            ('RevenuePerAssist', 'FLOAT64'),
+            ('AccountStatus', 'STRING'),
+            ('AdGroupStatus', 'STRING'),
+            ('KeywordStatus', 'STRING'),
+            ('CampaignType', 'STRING'),
+            ('CustomerId', 'INT64'),
+            ('CustomerName', 'STRING'),
+            ('AllConversions', 'FLOAT64'),
+            ('AllRevenue', 'FLOAT64'),
+            ('AllCostPerConversion', 'FLOAT64'),
+            ('AllReturnOnAdSpend', 'FLOAT64'),
+            ('AllRevenuePerConversion', 'FLOAT64')
+        ]
+    ),
+    ReportDefinition(
+        report_name='keyword_performance_report',
+        request_type='KeywordPerformanceReportRequest',
+        column_type='KeywordPerformanceReportColumn',
+        scope_type='AccountThroughAdGroupReportScope',
+        table_name='microsoft_ads_keyword_performance_table',
+        supports_aggregation=True,
+        columns=[
+            ('AccountName', 'STRING'),
+            ('AccountNumber', 'STRING'),
+            ('AccountId', 'INT64'),
+            ('TimePeriod', 'DATE'),
+            ('CampaignName', 'STRING'),
+            ('CampaignId', 'INT64'),
+            ('AdGroupName', 'STRING'),
+            ('AdGroupId', 'INT64'),
+            ('Keyword', 'STRING'),
+            ('KeywordId', 'INT64'),
+            ('AdId', 'INT64'),
+            ('AdType', 'STRING'),
+            ('DestinationUrl', 'STRING'),
+            ('CurrentMaxCpc', 'FLOAT64'),
+            ('CurrencyCode', 'STRING'),
+            ('DeliveredMatchType', 'STRING'),
+            ('AdDistribution', 'STRING'),
+            ('Impressions', 'INT64'),
+            ('Clicks', 'INT64'),
+            ('AverageCpc', 'FLOAT64'),
+            ('Spend', 'FLOAT64'),
+            ('AveragePosition', 'FLOAT64'),
+            ('Conversions', 'FLOAT64'),
+            ('CostPerConversion', 'FLOAT64'),
+            ('BidMatchType', 'STRING'),
+            ('DeviceType', 'STRING'),
+            ('QualityScore', 'STRING'),
+            ('ExpectedCtr', 'STRING'),
+            ('AdRelevance', 'STRING'),
+            ('LandingPageExperience', 'STRING'),
+            ('Language', 'STRING'),
+            ('HistoricalQualityScore', 'STRING'),
+            ('HistoricalExpectedCtr', 'STRING'),
+            ('HistoricalAdRelevance', 'STRING'),
+            ('HistoricalLandingPageExperience', 'STRING'),
+            ('QualityImpact', 'INT64'),
+            ('CampaignStatus', 'STRING'),
+            ('AccountStatus', 'STRING'),
+            ('AdGroupStatus', 'STRING'),
+            ('KeywordStatus', 'STRING'),
+            ('Network', 'STRING'),
+            ('TopVsOther', 'STRING'),
+            ('DeviceOS', 'STRING'),
+            ('Assists', 'FLOAT64'),
+            ('Revenue', 'FLOAT64'),
+            ('ReturnOnAdSpend', 'FLOAT64'),
+            ('CostPerAssist', 'FLOAT64'),
+            ('RevenuePerConversion', 'FLOAT64'),
+            ('RevenuePerAssist', 'FLOAT64'),
+            ('TrackingTemplate', 'STRING'),
+            ('CustomParameters', 'STRING'),
+            ('FinalUrl', 'STRING'),
+            ('FinalMobileUrl', 'STRING'),
+            ('FinalAppUrl', 'STRING'),
+            ('BidStrategyType', 'STRING'),
+            ('KeywordLabels', 'STRING'),
+            ('Mainline1Bid', 'FLOAT64'),
+            ('MainlineBid', 'FLOAT64'),
+            ('FirstPageBid', 'FLOAT64'),
+            ('FinalUrlSuffix', 'STRING'),
+            ('BaseCampaignId', 'INT64'),
+            ('AllConversions', 'FLOAT64'),
+            ('AllRevenue', 'FLOAT64'),
+            ('AllCostPerConversion', 'FLOAT64'),
+            ('AllReturnOnAdSpend', 'FLOAT64'),
+            ('AllRevenuePerConversion', 'FLOAT64')
+        ]
+    ),
+    ReportDefinition(
+        report_name='user_location_performance_report',
+        request_type='UserLocationPerformanceReportRequest',
+        column_type='UserLocationPerformanceReportColumn',
+        scope_type='AccountThroughAdGroupReportScope',
+        table_name='microsoft_ads_user_location_performance_table',
+        supports_aggregation=True,
+        columns=[
+            ('AccountName', 'STRING'),
+            ('AccountNumber', 'STRING'),
+            ('AccountId', 'INT64'),
+            ('TimePeriod', 'DATE'),
+            ('CampaignName', 'STRING'),
+            ('CampaignId', 'INT64'),
+            ('AdGroupName', 'STRING'),
+            ('AdGroupId', 'INT64'),
+            ('Country', 'STRING'),
+            ('State', 'STRING'),
+            ('MetroArea', 'STRING'),
+            ('AdDistribution', 'STRING'),
+            ('Impressions', 'INT64'),
+            ('Clicks', 'INT64'),
+            ('AverageCpc', 'FLOAT64'),
+            ('Spend', 'FLOAT64'),
+            ('AveragePosition', 'FLOAT64'),
+            ('ProximityTargetLocation', 'STRING'),
+            ('Radius', 'STRING'),
+            ('Language', 'STRING'),
+            ('City', 'STRING'),
+            ('QueryIntentCountry', 'STRING'),
+            ('QueryIntentState', 'STRING'),
+            ('QueryIntentCity', 'STRING'),
+            ('QueryIntentDMA', 'STRING'),
+            ('BidMatchType', 'STRING'),
+            ('DeliveredMatchType', 'STRING'),
+            ('Network', 'STRING'),
+            ('TopVsOther', 'STRING'),
+            ('DeviceType', 'STRING'),
+            ('DeviceOS', 'STRING'),
+            ('Assists', 'FLOAT64'),
+            ('Conversions', 'FLOAT64'),
+            ('Revenue', 'FLOAT64'),
+            ('ReturnOnAdSpend', 'FLOAT64'),
+            ('CostPerConversion', 'FLOAT64'),
+            ('CostPerAssist', 'FLOAT64'),
+            ('RevenuePerConversion', 'FLOAT64'),
+            ('RevenuePerAssist', 'FLOAT64'),
+            ('County', 'STRING'),
+            ('PostalCode', 'STRING'),
+            ('QueryIntentCounty', 'STRING'),
+            ('QueryIntentPostalCode', 'STRING'),
+            ('LocationId', 'INT64'),
+            ('QueryIntentLocationId', 'INT64'),
+            ('AllConversions', 'FLOAT64'),
+            ('AllRevenue', 'FLOAT64'),
+            ('AllCostPerConversion', 'FLOAT64'),
+            ('AllReturnOnAdSpend', 'FLOAT64'),
+            ('AllRevenuePerConversion', 'FLOAT64')
+        ]
+    ),
+    ReportDefinition(
+        report_name='goals_funnels_report',
+        request_type='GoalsAndFunnelsReportRequest',
+        column_type='GoalsAndFunnelsReportColumn',
+        scope_type='AccountThroughAdGroupReportScope',
+        table_name='microsoft_ads_goals_funnels_table',
+        supports_aggregation=True,
+        columns=[
+            ('AccountName', 'STRING'),
+            ('AccountNumber', 'STRING'),
+            ('AccountId', 'INT64'),
+            ('TimePeriod', 'DATE'),
+            ('CampaignName', 'STRING'),
+            ('CampaignId', 'INT64'),
+            ('AdGroupName', 'STRING'),
+            ('AdGroupId', 'INT64'),
+            ('Keyword', 'STRING'),
+            ('KeywordId', 'INT64'),
+            ('Goal', 'STRING'),
+            ('AllConversions', 'FLOAT64'),
+            ('Assists', 'FLOAT64'),
+            ('AllRevenue', 'FLOAT64'),
+            ('GoalId', 'INT64'),
+            ('DeviceType', 'STRING'),
+            ('DeviceOS', 'STRING'),
+            ('AccountStatus', 'STRING'),
+            ('CampaignStatus', 'STRING'),
+            ('AdGroupStatus', 'STRING'),
+            ('KeywordStatus', 'STRING'),
+            ('GoalType', 'STRING')
+        ]
+    ),
+    ReportDefinition(
+        report_name='ads_performance_report',
+        request_type='AdPerformanceReportRequest',
+        column_type='AdPerformanceReportColumn',
+        scope_type='AccountThroughAdGroupReportScope',
+        table_name='microsoft_ads_ads_performance_table',
+        supports_aggregation=True,
+        columns=[
+            ('AccountName', 'STRING'),
+            ('AccountNumber', 'STRING'),
+            ('AccountId', 'INT64'),
+            ('TimePeriod', 'DATE'),
+            ('CampaignName', 'STRING'),
+            ('CampaignId', 'INT64'),
+            ('AdGroupName', 'STRING'),
+            ('AdId', 'INT64'),
+            ('AdGroupId', 'INT64'),
+            ('AdTitle', 'STRING'),
+            ('AdDescription', 'STRING'),
+            ('AdDescription2', 'STRING'),
+            ('AdType', 'STRING'),
+            ('AdDistribution', 'STRING'),
+            ('Impressions', 'INT64'),
+            ('Clicks', 'INT64'),
+            ('AverageCpc', 'FLOAT64'),
+            ('Spend', 'FLOAT64'),
+            ('AveragePosition', 'FLOAT64'),
+            ('Conversions', 'FLOAT64'),
+            ('CostPerConversion', 'FLOAT64'),
+            ('DestinationUrl', 'STRING'),
+            ('DeviceType', 'STRING'),
+            ('Language', 'STRING'),
+            ('DisplayUrl', 'STRING'),
+            ('AdStatus', 'STRING'),
+            ('Network', 'STRING'),
+            ('TopVsOther', 'STRING'),
+            ('BidMatchType', 'STRING'),
+            ('DeliveredMatchType', 'STRING'),
+            ('DeviceOS', 'STRING'),
+            ('Assists', 'FLOAT64'),
+            ('Revenue', 'FLOAT64'),
+            ('ReturnOnAdSpend', 'FLOAT64'),
+            ('CostPerAssist', 'FLOAT64'),
+            ('RevenuePerConversion', 'FLOAT64'),
+            ('RevenuePerAssist', 'FLOAT64'),
+            ('TrackingTemplate', 'STRING'),
+            ('CustomParameters', 'STRING'),
+            ('FinalUrl', 'STRING'),
+            ('FinalMobileUrl', 'STRING'),
+            ('FinalAppUrl', 'STRING'),
+            ('AccountStatus', 'STRING'),
+            ('CampaignStatus', 'STRING'),
+            ('AdGroupStatus', 'STRING'),
+            ('TitlePart1', 'STRING'),
+            ('TitlePart2', 'STRING'),
+            ('TitlePart3', 'STRING'),
+            ('Headline', 'STRING'),
+            ('LongHeadline', 'STRING'),
+            ('BusinessName', 'STRING'),
+            ('Path1', 'STRING'),
+            ('Path2', 'STRING'),
+            ('AdLabels', 'STRING'),
+            ('CustomerId', 'INT64'),
+            ('CustomerName', 'STRING'),
+            ('CampaignType', 'STRING'),
+            ('BaseCampaignId', 'INT64'),
+            ('AllConversions', 'FLOAT64'),
+            ('AllRevenue', 'FLOAT64'),
+            ('AllCostPerConversion', 'FLOAT64'),
+            ('AllReturnOnAdSpend', 'FLOAT64'),
+            ('AllRevenuePerConversion', 'FLOAT64'),
+            ('FinalUrlSuffix', 'STRING')
+        ]
+    ),
+    ReportDefinition(
+        report_name='ads_dictionary_report',
+        request_type='AdPerformanceReportRequest',
+        column_type='AdPerformanceReportColumn',
+        scope_type='AccountThroughAdGroupReportScope',
+        table_name='microsoft_ads_ads_dictionary_table',
+        supports_aggregation=True,
+        columns=[
+            ('AccountName', 'STRING'),
+            ('AccountNumber', 'STRING'),
+            ('AccountId', 'INT64'),
+            ('CampaignName', 'STRING'),
+            ('CampaignId', 'INT64'),
+            ('AdGroupName', 'STRING'),
+            ('AdId', 'INT64'),
+            ('AdGroupId', 'INT64'),
+            ('AdTitle', 'STRING'),
+            ('AdDescription', 'STRING'),
+            ('AdDescription2', 'STRING'),
+            ('AdType', 'STRING'),
+            ('AdDistribution', 'STRING'),
+            ('Impressions', 'INT64'),
+            ('DestinationUrl', 'STRING'),
+            ('DisplayUrl', 'STRING'),
+            ('AdStatus', 'STRING'),
+            ('TrackingTemplate', 'STRING'),
+            ('CustomParameters', 'STRING'),
+            ('FinalUrl', 'STRING'),
+            ('FinalMobileUrl', 'STRING'),
+            ('FinalAppUrl', 'STRING'),
+            ('AccountStatus', 'STRING'),
+            ('CampaignStatus', 'STRING'),
+            ('AdGroupStatus', 'STRING'),
+            ('TitlePart1', 'STRING'),
+            ('TitlePart2', 'STRING'),
+            ('TitlePart3', 'STRING'),
+            ('Headline', 'STRING'),
+            ('LongHeadline', 'STRING'),
+            ('BusinessName', 'STRING'),
+            ('Path1', 'STRING'),
+            ('Path2', 'STRING'),
+            ('CustomerId', 'INT64'),
+            ('CustomerName', 'STRING'),
+            ('CampaignType', 'STRING'),
+            ('BaseCampaignId', 'INT64'),
+            ('FinalUrlSuffix', 'STRING')
+        ]
+    )
+])
+
+REPORT_TABLES = OrderedDict(
+    (report_name, definition.table_name)
+    for report_name, definition in REPORT_DEFINITIONS.items()
+    if definition.table_name is not None
+)
+
+
+class DimensionDefinition(object):
+    """
+    Dimension table of the normalised reports: the attribute columns that the reports repeat on
+    every row, keyed by an id column that they all include. report_names limits the dimension to
+    the reports whose attribute columns describe that entity.
+    """
+    def __init__(self, name, key_column, columns, table_name, report_names):
+        self.name = name
+        self.key_column = key_column
+        self.columns = tuple(columns)
+        self.column_names = tuple(column_name for column_name, _ in self.columns)
+        self.attribute_names = tuple(column_name for column_name in self.column_names if column_name != key_column)
+        self.table_name = table_name
+        self.report_names = tuple(report_names)
+
+    def get_table_columns(self):
+        return ((INSERT_TIME_COLUMN, 'TIMESTAMP'),) + self.columns
+
+
+# Wide reports that --normalize_dimensions splits into fact rows and dimension tables.
+NORMALIZED_REPORTS = (
+    'search_query_performance_report',
+    'keyword_performance_report',
+    'user_location_performance_report',
+    'ads_performance_report',
+)
+
+URL_COLUMNS = [
+    ('DestinationUrl', 'STRING'),
+    ('FinalUrl', 'STRING'),
+    ('FinalMobileUrl', 'STRING'),
+    ('FinalUrlSuffix', 'STRING'),
+    ('TrackingTemplate', 'STRING'),
+    ('CustomParameters', 'STRING'),
+]
+
+# A column is moved to the first dimension of a report that lists it.
+DIMENSION_DEFINITIONS = OrderedDict([
+    ('account', DimensionDefinition(
+        name='account',
+        key_column='AccountId',
+        columns=[('AccountId', 'INT64'), ('AccountName', 'STRING'), ('AccountNumber', 'STRING')],
+        table_name='microsoft_ads_account_dimension_table',
+        report_names=NORMALIZED_REPORTS,
+    )),
+    ('campaign', DimensionDefinition(
+        name='campaign',
+        key_column='CampaignId',
+        columns=[('CampaignId', 'INT64'), ('CampaignName', 'STRING')],
+        table_name='microsoft_ads_campaign_dimension_table',
+        report_names=NORMALIZED_REPORTS,
+    )),
+    ('ad_group', DimensionDefinition(
+        name='ad_group',
+        key_column='AdGroupId',
+        columns=[('AdGroupId', 'INT64'), ('AdGroupName', 'STRING')],
+        table_name='microsoft_ads_ad_group_dimension_table',
+        report_names=NORMALIZED_REPORTS,
+    )),
+    # The url columns of the keyword report are those of the keyword, not of the ad.
+    ('ad', DimensionDefinition(
+        name='ad',
+        key_column='AdId',
+        columns=[('AdId', 'INT64')] + URL_COLUMNS,
+        table_name='microsoft_ads_ad_dimension_table',
+        report_names=('ads_performance_report',),
+    )),
+    ('keyword', DimensionDefinition(
+        name='keyword',
+        key_column='KeywordId',
+        columns=[('KeywordId', 'INT64'), ('Keyword', 'STRING')] + URL_COLUMNS,
+        table_name='microsoft_ads_keyword_dimension_table',
+        report_names=('keyword_performance_report',),
+    )),
+])
+
+
+def get_report_dimensions(report_name, column_names):
+    """
+    Returns (dimension, attribute names) for every dimension of a report whose key is among
+    column_names, with the attribute columns it takes out of the report.
+    """
+    dimensions = []
+    taken = set()
+    for dimension in DIMENSION_DEFINITIONS.values():
+        if report_name not in dimension.report_names or dimension.key_column not in column_names:
+            continue
+        attribute_names = [name for name in dimension.attribute_names if name in column_names and name not in taken]
+        if attribute_names:
+            taken.update(attribute_names)
+            dimensions.append((dimension, attribute_names))
+    return dimensions
+
+
+def get_fact_definition(definition):
+    """
+    Definition of the slim fact rows of a normalised report: its columns without the dimension
+    attributes, loaded into <table>_fact instead of <table>.
+    """
+    attribute_names = set(name for _, attribute_names in get_report_dimensions(definition.report_name,
+                                                                                definition.column_names)
+                          for name in attribute_names)
+    return ReportDefinition(
+        report_name=definition.report_name + '_facts',
+        request_type=definition.request_type,
+        column_type=definition.column_type,
+        scope_type=definition.scope_type,
+        columns=[column for column in definition.columns if column[0] not in attribute_names],
+        table_name=definition.table_name.replace('_table', '_fact_table'),
+        supports_aggregation=definition.supports_aggregation,
+    )
+
+
+FACT_DEFINITIONS = OrderedDict(
+    (report_name + '_facts', get_fact_definition(REPORT_DEFINITIONS[report_name]))
+    for report_name in NORMALIZED_REPORTS
+)
+
+# Destination tables of the fact files (<report>_facts) and dimension files (<name>_dimension).
+NORMALIZED_TABLES = OrderedDict(
+    [(name, definition.table_name) for name, definition in FACT_DEFINITIONS.items()] +
+    [(name + '_dimension', definition.table_name) for name, definition in DIMENSION_DEFINITIONS.items()]
+)
+
+# The dimension tables hold one row per id: each run merges its rows into them on the key column
+# instead of appending, so that joining facts to dimensions does not multiply the fact rows.
+MERGE_KEY_COLUMNS = OrderedDict(
+    (definition.table_name, definition.key_column) for definition in DIMENSION_DEFINITIONS.values()
+)
+
+
+# Columns kept by every profile, when the report has them: the ids and names that identify a row
+# (some of them are required by the reporting service) and the time period.
+KEY_COLUMNS = ('AccountName', 'AccountId', 'TimePeriod', 'CampaignName', 'CampaignId', 'AdGroupName', 'AdGroupId',
+               'AdId', 'Keyword', 'KeywordId')
+REPORT_KEY_COLUMNS = {
+    'search_query_performance_report': ('SearchQuery',),
+    'user_location_performance_report': ('Country', 'LocationId', 'QueryIntentLocationId'),
+    'goals_funnels_report': ('Goal', 'GoalId'),
+}
+
+# Named column profiles: the columns requested besides the key columns. None requests every column.
+COLUMN_PROFILES = OrderedDict([
+    ('core_metrics', ('Impressions', 'Clicks', 'Spend', 'Conversions', 'Revenue', 'AllConversions', 'AllRevenue')),
+    ('quality', ('Impressions', 'Clicks', 'Spend', 'AveragePosition', 'TopVsOther', 'QualityScore', 'ExpectedCtr',
+                 'AdRelevance', 'LandingPageExperience', 'QualityImpact', 'HistoricalQualityScore',
+                 'HistoricalExpectedCtr', 'HistoricalAdRelevance', 'HistoricalLandingPageExperience')),
+    ('full', None),
+])
+
+
+def get_profile_column_names(definition, profile):
+    """
+    Returns the columns of a report to request for a profile: a COLUMN_PROFILES name or a list
+    of column names (a custom profile), plus the key columns. The columns keep the order of the
+    definition.
+    """
+    if profile is None:
+        return definition.column_names
+    if not isinstance(profile, (list, tuple)):
+        if profile not in COLUMN_PROFILES:
+            raise ValueError("Unknown column profile {0!r}, expected one of {1} or a list of columns".format(
+                profile, ', '.join(COLUMN_PROFILES)))
+        profile = COLUMN_PROFILES[profile]
+        if profile is None:
+            return definition.column_names
+    else:
+        unknown = [name for name in profile if name not in definition.column_types]
+        if unknown:
+            raise ValueError("{0} has no column {1}".format(definition.report_name, ', '.join(unknown)))
+    selected = set(KEY_COLUMNS + REPORT_KEY_COLUMNS.get(definition.report_name, ()) + tuple(profile))
+    return tuple(name for name in definition.column_names if name in selected)
+
+
+def get_profiled_definition(definition, profile):
+    """
+    Definition of a report requested with a column profile, for its parsers and table schema.
+    """
+    column_names = get_profile_column_names(definition, profile)
+    if column_names == definition.column_names:
+        return definition
+    return ReportDefinition(
+        report_name=definition.report_name,
+        request_type=definition.request_type,
+        column_type=definition.column_type,
+        scope_type=definition.scope_type,
+        columns=[column for column in definition.columns if column[0] in column_names],
+        table_name=definition.table_name,
+        supports_aggregation=definition.supports_aggregation,
+    )
+
+
+def get_profile_suffix(definition, profile):
+    """
+    Suffix of the tables and caches of a report requested with a column profile: '_<profile name>',
+    or '_custom_<hash>' for a list of columns, or '' when every column is requested. Profiled
+    reports have their own tables, since they have fewer columns and are aggregated by fewer
+    dimensions than the full reports.
+    """
+    column_names = get_profile_column_names(definition, profile)
+    if column_names == definition.column_names:
+        return ''
+    if not isinstance(profile, (list, tuple)):
+        return '_' + profile
+    return '_custom_' + hashlib.sha256(','.join(column_names).encode('utf-8')).hexdigest()[:8]
+
+
+def get_profiled_table_name(report_name, table_name, column_profiles=None):
+    """
+    Table of a report, or of its facts, following the column profile of the report.
+    """
+    if table_name is None or not column_profiles or report_name not in column_profiles:
+        return table_name
+    return table_name + get_profile_suffix(REPORT_DEFINITIONS[report_name], column_profiles[report_name])
+
+
+def parse_column_profiles(values):
+    """
+    Parses REPORT=PROFILE values, PROFILE being a COLUMN_PROFILES name or a comma-separated list
+    of columns, into {report name: profile}.
+    """
+    column_profiles = {}
+    for value in values:
+        report_name, _, profile = value.partition('=')
+        if report_name not in REPORT_DEFINITIONS or not profile:
+            raise ValueError("Expected REPORT=PROFILE with one of the reports {0}, got {1!r}".format(
+                ', '.join(REPORT_DEFINITIONS), value))
+        if profile not in COLUMN_PROFILES:
+            profile = [name.strip() for name in profile.split(',') if name.strip()]
+        get_profile_column_names(REPORT_DEFINITIONS[report_name], profile)
+        column_profiles[report_name] = profile
+    return column_profiles
+
+
+def parse_shard_days(values):
+    """
+    Parses REPORT=DAYS values into {report name: days}.
+    """
+    shard_days = {}
+    for value in values:
+        report_name, _, days = value.partition('=')
+        if report_name not in REPORT_DEFINITIONS or not days.isdigit() or int(days) < 1:
+            raise ValueError("Expected REPORT=DAYS with one of the reports {0} and a number of days, got {1!r}".format(
+                ', '.join(REPORT_DEFINITIONS), value))
+        shard_days[report_name] = int(days)
+    return shard_days
+
+
+def get_table_definition(table_name, column_profiles=None):
+    """
+    Definition of a report, fact or dimension table, following the column profiles of the reports:
+    the table of a profiled report is that of get_profiled_table_name.
+    """
+    column_profiles = column_profiles or {}
+    for report_name, definition in REPORT_DEFINITIONS.items():
+        if get_profiled_table_name(report_name, definition.table_name, column_profiles) == table_name:
+            return get_profiled_definition(definition, column_profiles.get(report_name))
+        fact_definition = FACT_DEFINITIONS.get(report_name + '_facts')
+        if fact_definition is not None and \
+                get_profiled_table_name(report_name, fact_definition.table_name, column_profiles) == table_name:
+            return get_fact_definition(get_profiled_definition(definition, column_profiles.get(report_name)))
+    for definition in DIMENSION_DEFINITIONS.values():
+        if definition.table_name == table_name:
+            return definition
+    return None
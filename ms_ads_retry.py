@@ -0,0 +1,173 @@
+import http.client
+import random
+import socket
+import threading
+import time
+
+THROTTLING = 'throttling'
+TRANSIENT = 'transient'
+AUTH = 'auth'
+PERMANENT = 'permanent'
+
+# Where the Bing Ads API puts its error codes in a WebFault detail.
+WEBFAULT_ERROR_ATTRIBUTE_SETS = (
+    ["ApiFault", "OperationErrors", "OperationError"],
+    ["AdApiFaultDetail", "Errors", "AdApiError"],
+    ["ApiFaultDetail", "BatchErrors", "BatchError"],
+    ["ApiFaultDetail", "OperationErrors", "OperationError"],
+    ["EditorialApiFaultDetail", "BatchErrors", "BatchError"],
+    ["EditorialApiFaultDetail", "EditorialErrors", "EditorialError"],
+    ["EditorialApiFaultDetail", "OperationErrors", "OperationError"],
+)
+
+# Bing Ads API error codes, by numeric Code or by ErrorCode name. Codes that are not listed
+# are permanent: the same request would fail again.
+FAULT_CATEGORIES = {
+    '117': THROTTLING,
+    'CallRateExceeded': THROTTLING,
+    'ConcurrentRequestOverLimit': THROTTLING,
+    '0': TRANSIENT,
+    'InternalError': TRANSIENT,
+    'ServiceUnavailable': TRANSIENT,
+    '105': AUTH,
+    'InvalidCredentials': AUTH,
+    '109': AUTH,
+    'AuthenticationTokenExpired': AUTH,
+}
+
+# A fault with several errors is classified by the most retryable of them.
+CATEGORY_ORDER = (THROTTLING, TRANSIENT, AUTH, PERMANENT)
+
+RETRY_STATUSES = {408: TRANSIENT, 429: THROTTLING, 500: TRANSIENT, 502: TRANSIENT, 503: TRANSIENT, 504: TRANSIENT}
+
+
+def iter_fault_errors(fault_detail):
+    """
+    Yields the AdApiError / OperationError / BatchError objects of a WebFault detail.
+    """
+    for error_attribute_set in WEBFAULT_ERROR_ATTRIBUTE_SETS:
+        api_errors = fault_detail
+        for field in error_attribute_set:
+            api_errors = getattr(api_errors, field, None)
+        if api_errors is None:
+            continue
+        if not isinstance(api_errors, list):
+            api_errors = [api_errors]
+        for api_error in api_errors:
+            yield api_error
+
+
+def get_fault_codes(ex):
+    """
+    Returns the Code and ErrorCode values of every error in a WebFault, as strings.
+    """
+    fault_detail = getattr(getattr(ex, 'fault', None), 'detail', None)
+    if fault_detail is None:
+        return []
+    codes = []
+    for api_error in iter_fault_errors(fault_detail):
+        for attribute in ('Code', 'ErrorCode'):
+            if getattr(api_error, attribute, None) is not None:
+                codes.append(str(getattr(api_error, attribute)))
+    return codes
+
+
+def classify_error(ex):
+    """
+    Returns THROTTLING, TRANSIENT, AUTH or PERMANENT for an exception raised by a service call
+    or a download.
+    """
+    if hasattr(ex, 'fault'):
+        categories = set(FAULT_CATEGORIES.get(code, PERMANENT) for code in get_fault_codes(ex))
+        for category in CATEGORY_ORDER:
+            if category in categories:
+                return category
+        return PERMANENT
+    status = getattr(ex, 'status', None)
+    if isinstance(status, int):
+        return RETRY_STATUSES.get(status, PERMANENT)
+    # Only network failures are retried: other OSErrors (a full disk, a missing file, a denied
+    # permission) would fail again.
+    if isinstance(ex, (ConnectionError, socket.timeout, socket.gaierror, http.client.HTTPException)):
+        return TRANSIENT
+    # bingads raises FileDownloadException from its downloads, and requests its ConnectionError and
+    # Timeout. Its TimeoutException means that a report was not ready within the tracking timeout,
+    # which a retry would only wait for again.
+    if type(ex).__name__ in ('FileDownloadException', 'ConnectionError', 'Timeout', 'ReadTimeout',
+                             'ConnectTimeout'):
+        return TRANSIENT
+    return PERMANENT
+
+
+class RetryBudget(object):
+    """
+    Number of retries left for a whole run, shared by all threads, so that an outage does not
+    turn into every report retrying up to its own limit.
+    """
+    def __init__(self, max_retries=100):
+        self.remaining = max_retries
+        self._lock = threading.Lock()
+
+    def spend(self):
+        with self._lock:
+            if self.remaining <= 0:
+                return False
+            self.remaining -= 1
+            return True
+
+
+class RetryPolicy(object):
+    """
+    Exponential backoff with jitter; throttling faults start from a longer delay.
+    """
+    def __init__(self, max_attempts=4, base_delay=2.0, throttling_delay=30.0, max_delay=300.0, jitter=0.2):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.throttling_delay = throttling_delay
+        self.max_delay = max_delay
+        self.jitter = jitter
+
+    def get_delay(self, category, attempt):
+        delay = self.throttling_delay if category == THROTTLING else self.base_delay
+        delay = min(delay * 2 ** (attempt - 1), self.max_delay)
+        return delay * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+
+def call_with_retry(func, policy=None, budget=None, on_retry=None, on_auth_error=None, sleep=time.sleep):
+    """
+    Calls func() until it succeeds. Throttling and transient errors are retried with backoff, up
+    to policy.max_attempts and while budget has retries left. Auth errors are only retried after
+    on_auth_error() (e.g. a token refresh) is called; permanent errors are raised right away.
+    on_retry(ex, category, attempt, delay) is called before each retry.
+    """
+    policy = policy if policy is not None else RetryPolicy()
+    attempt = 0
+    while True:
+        try:
+            return func()
+        except Exception as ex:
+            category = classify_error(ex)
+            attempt += 1
+            if category == PERMANENT or attempt >= policy.max_attempts:
+                raise
+            if category == AUTH and on_auth_error is None:
+                raise
+            if budget is not None and not budget.spend():
+                raise
+            if category == AUTH:
+                on_auth_error()
+            delay = policy.get_delay(category, attempt)
+            if on_retry is not None:
+                on_retry(ex, category, attempt, delay)
+            sleep(delay)
+
+
+class ReportRunError(Exception):
+    """
+    Raised at the end of a run in which some reports failed; the other reports were still
+    loaded. failures is a list of (report file name or table name, exception) tuples.
+    """
+    def __init__(self, failures):
+        self.failures = failures
+        super(ReportRunError, self).__init__("{0} reports failed: {1}".format(
+            len(failures), '; '.join('{0}: {1}'.format(name, error) for name, error in failures)))
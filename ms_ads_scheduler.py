@@ -0,0 +1,300 @@
+import json
+import os
+import random
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from ms_ads_retry import PERMANENT, classify_error
+
+
+class ReportJob(object):
+    """
+    A single (account, report) unit of work together with its outcome.
+    """
+    def __init__(self, account_id, report_request, result_file_name, account_ids=None, date_from=None,
+                 date_to=None, shard_index=None, shard_count=1):
+        self.account_id = account_id
+        self.account_ids = list(account_ids) if account_ids is not None else [account_id]
+        self.date_from = date_from
+        self.date_to = date_to
+        # Jobs of a report that is split into date shards share account_id and report_name.
+        self.shard_index = shard_index
+        self.shard_count = shard_count
+        self.report_request = report_request
+        self.report_name = report_request.ReportName
+        self.result_file_name = result_file_name
+        self.result = None
+        self.error = None
+
+
+def interleave_by_account(jobs):
+    """
+    Orders jobs round-robin across accounts, so that the pool is not filled with
+    jobs that are all waiting on the same per-account limit.
+    """
+    queues = {}
+    for job in jobs:
+        queues.setdefault(job.account_id, []).append(job)
+    ordered = []
+    while queues:
+        for account_id in list(queues):
+            ordered.append(queues[account_id].pop(0))
+            if not queues[account_id]:
+                del queues[account_id]
+    return ordered
+
+
+class ConcurrentReportRunner(object):
+    """
+    Runs report jobs on a bounded thread pool. All jobs are submitted up front and
+    yielded back as they finish, so wall-clock time is set by the slowest report
+    rather than the sum of all of them.
+
+    suds clients are not thread-safe, so every worker thread gets its own
+    ReportingServiceManager from manager_factory.
+    """
+    def __init__(self, manager_factory, max_workers=8, max_per_account=2):
+        self.manager_factory = manager_factory
+        self.max_workers = max_workers
+        self.max_per_account = max_per_account
+        self._local = threading.local()
+        self._account_semaphores = {}
+        self._account_semaphores_lock = threading.Lock()
+
+    def get_manager(self):
+        manager = getattr(self._local, 'manager', None)
+        if manager is None:
+            manager = self.manager_factory()
+            self._local.manager = manager
+        return manager
+
+    def get_account_semaphore(self, account_id):
+        with self._account_semaphores_lock:
+            if account_id not in self._account_semaphores:
+                self._account_semaphores[account_id] = threading.BoundedSemaphore(self.max_per_account)
+            return self._account_semaphores[account_id]
+
+    def _run_job(self, job, run_job):
+        with self.get_account_semaphore(job.account_id):
+            return run_job(job, self.get_manager())
+
+    def run(self, jobs, run_job):
+        """
+        Submits every job and yields each one as soon as it completes. run_job is
+        called as run_job(job, reporting_service_manager); its return value is stored
+        on job.result and any exception on job.error. run_job may return a Future for
+        the work it leaves to the background, such as a download: its worker moves on
+        to the next job and the job is yielded once that Future is done.
+        """
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = {
+                executor.submit(self._run_job, job, run_job): job
+                for job in interleave_by_account(jobs)
+            }
+            while futures:
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    job = futures.pop(future)
+                    try:
+                        result = future.result()
+                    except Exception as ex:
+                        job.error = ex
+                        yield job
+                        continue
+                    if isinstance(result, Future):
+                        futures[result] = job
+                        continue
+                    job.result = result
+                    yield job
+
+
+def chain_future(future, func):
+    """
+    Returns a Future of func(future.result()); func is called on the thread that completes
+    future.
+    """
+    chained = Future()
+
+    def on_done(completed):
+        try:
+            chained.set_result(func(completed.result()))
+        except Exception as ex:
+            chained.set_exception(ex)
+
+    future.add_done_callback(on_done)
+    return chained
+
+
+def fetch_pages(fetch_page, page_size, wave_size=1):
+    """
+    Collects the items of a paged service call. fetch_page(page_index) returns the items of
+    one page and the last page is the first one shorter than page_size. The first page is
+    requested on the calling thread; once it is full, the next wave_size pages are requested
+    in parallel, wave after wave, and the pages after the last one are discarded. Items are
+    returned in page order.
+    """
+    items = []
+
+    def add_page(page):
+        page = list(page) if page is not None else []
+        items.extend(page)
+        return len(page) >= page_size
+
+    if not add_page(fetch_page(0)):
+        return items
+    page_index = 1
+    if wave_size <= 1:
+        while add_page(fetch_page(page_index)):
+            page_index += 1
+        return items
+    with ThreadPoolExecutor(max_workers=wave_size) as executor:
+        while True:
+            for page in executor.map(fetch_page, range(page_index, page_index + wave_size)):
+                if not add_page(page):
+                    return items
+            page_index += wave_size
+
+
+class ReadyTimeStats(object):
+    """
+    Keeps the last few time-to-ready samples per report type in a JSON file so that
+    later runs can start polling close to when a report is expected to be ready.
+    """
+    def __init__(self, path=None, max_samples=20):
+        self.path = path
+        self.max_samples = max_samples
+        self.samples = {}
+        self._lock = threading.Lock()
+        if path and os.path.exists(path):
+            with open(path, 'r') as file:
+                self.samples = json.load(file)
+
+    def record(self, report_type, seconds):
+        with self._lock:
+            samples = self.samples.setdefault(report_type, [])
+            samples.append(round(seconds, 3))
+            del samples[:-self.max_samples]
+
+    def expected_ready_time(self, report_type):
+        samples = sorted(self.samples.get(report_type, []))
+        if not samples:
+            return None
+        return samples[len(samples) // 2]
+
+    def save(self):
+        if not self.path:
+            return
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        with self._lock:
+            with open(self.path, 'w') as file:
+                json.dump(self.samples, file, indent=2, sort_keys=True)
+
+
+class PendingReport(object):
+    """
+    Row of the scheduler's pending table: one submitted ReportingDownloadOperation.
+    """
+    def __init__(self, key, report_type, operation, submitted_at, delay):
+        self.key = key
+        self.report_type = report_type
+        self.operation = operation
+        self.submitted_at = submitted_at
+        self.delay = delay
+        self.next_poll_at = submitted_at + delay
+        self.polls = 0
+        self.status = None
+        self.error = None
+        self.ready_after = None
+
+
+class ReportPollingScheduler(object):
+    """
+    Submits every report request exactly once and polls the pending operations with
+    get_status() in rounds. Each operation backs off exponentially with jitter, starting
+    from the time-to-ready previously recorded for its report type. run() yields each
+    report as soon as its status is Success (or Error / timed out), so it can be
+    downloaded while the others are still being generated.
+    """
+    def __init__(self, reporting_service_manager, stats=None, initial_delay=2.0, max_delay=60.0,
+                 backoff_factor=2.0, jitter=0.2, timeout_in_seconds=3600, clock=time.time, sleep=time.sleep):
+        self.reporting_service_manager = reporting_service_manager
+        self.stats = stats if stats is not None else ReadyTimeStats()
+        self.initial_delay = initial_delay
+        self.max_delay = max_delay
+        self.backoff_factor = backoff_factor
+        self.jitter = jitter
+        self.timeout_in_seconds = timeout_in_seconds
+        self.clock = clock
+        self.sleep = sleep
+        self.pending = {}
+
+    def _jittered(self, delay):
+        return delay * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    def first_delay(self, report_type):
+        expected = self.stats.expected_ready_time(report_type)
+        if expected is None:
+            return self.initial_delay
+        return min(max(expected, self.initial_delay), self.max_delay)
+
+    def submit(self, key, report_request):
+        operation = self.reporting_service_manager.submit_download(report_request)
+        self.attach(key, report_request.ReportName, operation)
+        return operation
+
+    def attach(self, key, report_type, operation):
+        """
+        Adds an operation that was already submitted, e.g. by an interrupted run, to the polls.
+        """
+        pending = PendingReport(key, report_type, operation, self.clock(), self.first_delay(report_type))
+        pending.next_poll_at = pending.submitted_at + self._jittered(pending.delay)
+        self.pending[key] = pending
+        return operation
+
+    def poll_due(self):
+        """
+        Polls every pending operation whose next poll time has passed and returns the
+        ones that are finished.
+        """
+        now = self.clock()
+        finished = []
+        for pending in [p for p in self.pending.values() if p.next_poll_at <= now]:
+            pending.polls += 1
+            try:
+                status = pending.operation.get_status()
+            except Exception as ex:
+                # Throttled or failed polls are tried again later; the timeout still applies.
+                if classify_error(ex) == PERMANENT:
+                    pending.error = ex
+                    finished.append(pending)
+                    continue
+                status = None
+            pending.status = status
+            now = self.clock()
+            if status is not None and status.status == 'Success':
+                pending.ready_after = now - pending.submitted_at
+                self.stats.record(pending.report_type, pending.ready_after)
+                finished.append(pending)
+            elif status is not None and status.status == 'Error':
+                pending.error = Exception("Report {0} failed to generate".format(pending.key))
+                finished.append(pending)
+            elif now - pending.submitted_at > self.timeout_in_seconds:
+                pending.error = Exception("Timed out waiting for report {0}".format(pending.key))
+                finished.append(pending)
+            else:
+                pending.delay = min(pending.delay * self.backoff_factor, self.max_delay)
+                pending.next_poll_at = now + self._jittered(pending.delay)
+        for pending in finished:
+            del self.pending[pending.key]
+        return finished
+
+    def run(self):
+        while self.pending:
+            for pending in self.poll_due():
+                yield pending
+            if self.pending:
+                next_poll_at = min(p.next_poll_at for p in self.pending.values())
+                self.sleep(max(next_poll_at - self.clock(), 0))
+        self.stats.save()
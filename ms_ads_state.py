@@ -0,0 +1,516 @@
+import datetime as dt
+import json
+import os
+import shutil
+import threading
+import time
+from collections import OrderedDict
+from ms_ads_transform import get_output_file_name, read_csv_rows, write_csv_rows
+
+
+def to_date(value):
+    if isinstance(value, dt.datetime):
+        return value.date()
+    if isinstance(value, dt.date):
+        return value
+    return dt.datetime.strptime(value, "%Y-%m-%d").date()
+
+
+def save_json(path, data):
+    """
+    Writes data to path through a temporary file, so an interrupted run never leaves a
+    truncated state file behind.
+    """
+    directory = os.path.dirname(path)
+    if directory and not os.path.exists(directory):
+        os.makedirs(directory)
+    temp_path = path + '.tmp'
+    with open(temp_path, 'w') as file:
+        json.dump(data, file, indent=2, sort_keys=True)
+    os.replace(temp_path, path)
+
+
+def load_json(path, default):
+    if path and os.path.exists(path):
+        with open(path, 'r') as file:
+            return json.load(file)
+    return default
+
+
+class WatermarkStore(object):
+    """
+    Persisted watermarks per (account, report type). For each pair it keeps the last date that
+    was loaded and the contiguous range of final days that were loaded, from first_loaded_date
+    to last_final_date; a day is final once it is older than the conversion-lag restatement
+    window. Later runs only request the days after the last final date: the missing days plus
+    the ones that may still be restated. A window that starts before the first loaded date is
+    requested whole, so a wider window backfills the older days.
+    """
+    def __init__(self, path, restatement_days=7, today=None):
+        self.path = path
+        self.restatement_days = restatement_days
+        self.today = today if today is not None else dt.datetime.utcnow().date()
+        self.watermarks = load_json(path, {})
+
+    @staticmethod
+    def get_key(account_id, report_name):
+        return '{0}|{1}'.format(account_id, report_name)
+
+    def get_final_date(self):
+        """
+        Last day whose data can no longer be restated.
+        """
+        return self.today - dt.timedelta(1 + self.restatement_days)
+
+    def get_watermark(self, account_id, report_name):
+        return self.watermarks.get(self.get_key(account_id, report_name))
+
+    def get_missing_window(self, account_id, report_name, date_from, date_to):
+        """
+        Narrows [date_from, date_to] down to the days that are not loaded yet or may still change.
+        Returns a (date_from, date_to) tuple of dates, or None when there is nothing to request.
+        """
+        date_from = to_date(date_from)
+        date_to = to_date(date_to)
+        watermark = self.get_watermark(account_id, report_name)
+        if watermark is not None and watermark.get('last_final_date') \
+                and date_from >= to_date(watermark['first_loaded_date']):
+            date_from = max(date_from, to_date(watermark['last_final_date']) + dt.timedelta(1))
+        if date_from > date_to:
+            return None
+        return date_from, date_to
+
+    def mark_loaded(self, account_id, report_name, date_from, date_to):
+        """
+        Records that [date_from, date_to] was loaded. Its final days only extend the loaded range
+        when they overlap or adjoin it, so that the days in between are requested again.
+        """
+        date_from = to_date(date_from)
+        date_to = to_date(date_to)
+        watermark = self.get_watermark(account_id, report_name) or {}
+        first_loaded_date = last_final_date = None
+        if watermark.get('last_final_date'):
+            first_loaded_date = to_date(watermark['first_loaded_date'])
+            last_final_date = to_date(watermark['last_final_date'])
+        final_date = min(date_to, self.get_final_date())
+        if date_from <= final_date:
+            if last_final_date is None:
+                first_loaded_date, last_final_date = date_from, final_date
+            elif date_from <= last_final_date + dt.timedelta(1) and final_date >= first_loaded_date - dt.timedelta(1):
+                first_loaded_date = min(first_loaded_date, date_from)
+                last_final_date = max(last_final_date, final_date)
+        self.watermarks[self.get_key(account_id, report_name)] = {
+            'last_loaded_date': date_to.strftime('%Y-%m-%d'),
+            'last_final_date': last_final_date.strftime('%Y-%m-%d') if last_final_date else None,
+            'in_restatement_window': date_to > self.get_final_date(),
+            'first_loaded_date': first_loaded_date.strftime('%Y-%m-%d') if first_loaded_date else None,
+        }
+
+    def save(self):
+        save_json(self.path, self.watermarks)
+
+
+class RowCountStats(object):
+    """
+    Smoothed rows per day of past reports per (account, report type), used to size the date
+    shards of large accounts.
+    """
+    def __init__(self, path, smoothing=0.5):
+        self.path = path
+        self.smoothing = smoothing
+        self.rows_per_day = load_json(path, {})
+
+    def record(self, account_id, report_name, row_count, days):
+        key = WatermarkStore.get_key(account_id, report_name)
+        rows_per_day = float(row_count) / max(days, 1)
+        previous = self.rows_per_day.get(key)
+        if previous is not None:
+            rows_per_day = self.smoothing * rows_per_day + (1 - self.smoothing) * previous
+        self.rows_per_day[key] = round(rows_per_day, 1)
+
+    def get_rows_per_day(self, account_id, report_name):
+        return self.rows_per_day.get(WatermarkStore.get_key(account_id, report_name))
+
+    def save(self):
+        save_json(self.path, self.rows_per_day)
+
+
+class AccountListCache(object):
+    """
+    The advertiser accounts of the signed in user, kept on disk for ttl_seconds so that runs
+    do not have to page through SearchAccounts before requesting any report.
+    """
+    def __init__(self, path, ttl_seconds=86400, clock=time.time):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.clock = clock
+        data = load_json(path, {})
+        self.accounts = data.get('accounts')
+        self.fetched_at = data.get('fetched_at')
+
+    def is_fresh(self):
+        return self.accounts is not None and self.clock() - self.fetched_at < self.ttl_seconds
+
+    def get_account_ids(self):
+        return [account['Id'] for account in self.accounts]
+
+    def update(self, accounts):
+        self.accounts = list(accounts)
+        self.fetched_at = self.clock()
+
+    def save(self):
+        save_json(self.path, {'accounts': self.accounts, 'fetched_at': self.fetched_at})
+
+
+class AdDictionaryCache(object):
+    """
+    Persistent ads dictionary keyed by AdId, kept as a csv file. After a first full pull,
+    runs only request a short recent window and upsert it here, so the dictionary stays
+    complete without requesting 1000 days for every account. Note that Impressions is taken
+    from the latest report that contained the ad.
+    """
+    KEY_COLUMN = 'AdId'
+    ACCOUNT_COLUMN = 'AccountId'
+
+    def __init__(self, path):
+        self.path = path
+        self.header = None
+        self.ads = OrderedDict()
+        self.account_ids = set()
+        if path and os.path.exists(path):
+            self.merge_rows(read_csv_rows(path))
+
+    def has_account(self, account_id):
+        return str(account_id) in self.account_ids
+
+    def merge_rows(self, rows):
+        """
+        Upserts csv rows (header first) by AdId and returns the number of rows merged. Columns are
+        matched by name, so a report with a different column order can be merged.
+        """
+        rows = iter(rows)
+        header = next(rows, None)
+        if header is None:
+            return 0
+        if self.header is None:
+            self.header = header
+        positions = [header.index(column) if column in header else None for column in self.header]
+        key_position = self.header.index(self.KEY_COLUMN)
+        account_position = self.header.index(self.ACCOUNT_COLUMN)
+        row_count = 0
+        for row in rows:
+            if header != self.header:
+                row = [row[position] if position is not None else '' for position in positions]
+            self.ads[row[key_position]] = row
+            self.account_ids.add(row[account_position])
+            row_count += 1
+        return row_count
+
+    def get_rows(self, account_ids=None):
+        """
+        Yields the header followed by the cached ads, optionally only those of account_ids.
+        """
+        if self.header is None:
+            return
+        yield list(self.header)
+        if account_ids is not None:
+            account_ids = set(str(account_id) for account_id in account_ids)
+        account_position = self.header.index(self.ACCOUNT_COLUMN)
+        for row in self.ads.values():
+            if account_ids is None or row[account_position] in account_ids:
+                yield list(row)
+
+    def save(self):
+        if self.header is None:
+            return
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        temp_path = self.path + '.tmp'
+        write_csv_rows(temp_path, self.get_rows())
+        os.replace(temp_path, self.path)
+
+
+class ReportResultCache(object):
+    """
+    Content-addressed cache of downloaded report results: <directory>/<fingerprint>.csv, where
+    the fingerprint is the hash of the full report request (see get_request_fingerprint).
+    Reports without data are cached too, without a file.
+
+    How long a result stays valid depends on how recent its data is: windows that end in the
+    last day are still being filled in, windows within the restatement window may still change,
+    older windows are final. Above max_bytes, the least recently used results are evicted.
+
+    The index is written with every new result, so the results of a run that fails half way
+    are reused by the next one. Files that are not in the index (e.g. copied before a crash)
+    are removed when the cache is opened.
+    """
+    INDEX_FILE_NAME = 'index.json'
+
+    def __init__(self, directory, max_bytes=2 * 1024 ** 3, restatement_days=7, recent_ttl_seconds=3600,
+                 restatement_ttl_seconds=6 * 3600, final_ttl_seconds=30 * 86400, clock=time.time, today=None):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.restatement_days = restatement_days
+        self.recent_ttl_seconds = recent_ttl_seconds
+        self.restatement_ttl_seconds = restatement_ttl_seconds
+        self.final_ttl_seconds = final_ttl_seconds
+        self.clock = clock
+        self.today = today if today is not None else dt.datetime.utcnow().date()
+        self.entries = load_json(os.path.join(directory, self.INDEX_FILE_NAME), {})
+        self._lock = threading.Lock()
+        self._reconcile()
+
+    def _reconcile(self):
+        """
+        Drops index entries whose file is gone and removes files that have no index entry.
+        """
+        for fingerprint in [key for key, entry in self.entries.items()
+                            if entry['has_data'] and not os.path.exists(self.get_path(key))]:
+            del self.entries[fingerprint]
+        if not os.path.exists(self.directory):
+            return
+        for file_name in os.listdir(self.directory):
+            fingerprint = file_name.split('.')[0]
+            if file_name == self.INDEX_FILE_NAME or (file_name.endswith('.csv') and fingerprint in self.entries):
+                continue
+            os.remove(os.path.join(self.directory, file_name))
+
+    def get_path(self, fingerprint):
+        return os.path.join(self.directory, fingerprint + '.csv')
+
+    def get_ttl_seconds(self, date_to):
+        age_in_days = (self.today - to_date(date_to)).days
+        if age_in_days <= 1:
+            return self.recent_ttl_seconds
+        if age_in_days <= 1 + self.restatement_days:
+            return self.restatement_ttl_seconds
+        return self.final_ttl_seconds
+
+    def get(self, fingerprint):
+        """
+        Returns (True, path) for a cached result, path being None for a report without data,
+        or (False, None) when the result is not cached or has expired.
+        """
+        with self._lock:
+            entry = self.entries.get(fingerprint)
+            if entry is None:
+                return False, None
+            if entry['expires_at'] <= self.clock() or (entry['has_data'] and
+                                                        not os.path.exists(self.get_path(fingerprint))):
+                self._remove(fingerprint)
+                return False, None
+            entry['last_used_at'] = self.clock()
+            return True, self.get_path(fingerprint) if entry['has_data'] else None
+
+    def put(self, fingerprint, result_file_path, date_to):
+        """
+        Copies a downloaded result into the cache; result_file_path None records a report
+        without data.
+        """
+        if not os.path.exists(self.directory):
+            os.makedirs(self.directory)
+        size = 0
+        if result_file_path is not None:
+            temp_path = self.get_path(fingerprint) + '.tmp'
+            shutil.copyfile(result_file_path, temp_path)
+            os.replace(temp_path, self.get_path(fingerprint))
+            size = os.path.getsize(self.get_path(fingerprint))
+        now = self.clock()
+        with self._lock:
+            self.entries[fingerprint] = {
+                'has_data': result_file_path is not None,
+                'size': size,
+                'date_to': to_date(date_to).strftime('%Y-%m-%d'),
+                'created_at': now,
+                'last_used_at': now,
+                'expires_at': now + self.get_ttl_seconds(date_to),
+            }
+            self._evict()
+            self._save_index()
+
+    def _remove(self, fingerprint):
+        entry = self.entries.pop(fingerprint)
+        if entry['has_data'] and os.path.exists(self.get_path(fingerprint)):
+            os.remove(self.get_path(fingerprint))
+
+    def _evict(self):
+        now = self.clock()
+        for fingerprint in [key for key, entry in self.entries.items() if entry['expires_at'] <= now]:
+            self._remove(fingerprint)
+        total_size = sum(entry['size'] for entry in self.entries.values())
+        for fingerprint in sorted(self.entries, key=lambda key: self.entries[key]['last_used_at']):
+            if total_size <= self.max_bytes:
+                break
+            total_size -= self.entries[fingerprint]['size']
+            self._remove(fingerprint)
+
+    def _save_index(self):
+        save_json(os.path.join(self.directory, self.INDEX_FILE_NAME), self.entries)
+
+    def save(self):
+        with self._lock:
+            self._evict()
+            self._save_index()
+
+
+SUBMITTED = 'submitted'
+READY = 'ready'
+DOWNLOADED = 'downloaded'
+TRANSFORMED = 'transformed'
+UPLOADED = 'uploaded'
+TASK_STATES = (SUBMITTED, READY, DOWNLOADED, TRANSFORMED, UPLOADED)
+
+
+class RunJournal(object):
+    """
+    Durable log of one run: the state of every (account, report, date shard) task, keyed by its
+    result file name, from submitted (with the request id) to ready, downloaded, transformed and
+    uploaded. Every transition is appended to a JSON lines file and flushed to disk before the
+    run moves on, so after a crash the next run picks up where this one stopped: it requests the
+    same window, re-attaches to the reports that were already submitted and skips the steps that
+    were done. The journal is removed once the run completes.
+
+    The upload step records the files it loaded, file by file, so that a resumed run loads the
+    files of the reports it downloads again even into a table that already got the others. The
+    transform steps that replace downloaded files (normalisation, the ads dictionary merge)
+    record what replaced them, so that a resumed run finds the downloads it already transformed.
+
+    A task is only resumed when its request fingerprint is unchanged.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.window = None
+        self.tasks = {}
+        self.uploaded_files = set()
+        self.replaced_files = {}
+        self._lock = threading.Lock()
+        self._file = None
+        if os.path.exists(path):
+            self._replay()
+
+    def _replay(self):
+        with open(self.path, 'r') as file:
+            for line in file:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # The last line of a journal whose run was killed may be cut short.
+                    break
+                if 'window' in record:
+                    self.window = tuple(record['window'])
+                elif 'uploaded_files' in record:
+                    self.uploaded_files.update(record['uploaded_files'])
+                elif 'replaced_files' in record:
+                    self._apply_replaced(record['replaced_files'], record['by'])
+                else:
+                    self._apply(record.pop('key'), record)
+
+    def _apply(self, key, fields):
+        task = self.tasks.get(key)
+        if task is None or fields.get('fingerprint', task.get('fingerprint')) != task.get('fingerprint'):
+            task = self.tasks[key] = {}
+        task.update(fields)
+
+    def _append(self, record):
+        if self._file is None:
+            directory = os.path.dirname(self.path)
+            if directory and not os.path.exists(directory):
+                os.makedirs(directory)
+            self._file = open(self.path, 'a')
+        self._file.write(json.dumps(record, sort_keys=True) + '\n')
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def is_resuming(self):
+        return self.window is not None
+
+    def start(self, date_from, date_to):
+        """
+        Starts a new run over [date_from, date_to], or returns the window of the interrupted
+        run being resumed. Returns a (date_from, date_to) tuple of datetimes.
+        """
+        with self._lock:
+            if self.window is None:
+                self.window = (date_from.strftime('%Y-%m-%d'), date_to.strftime('%Y-%m-%d'))
+                self._append({'window': list(self.window)})
+        return tuple(dt.datetime.strptime(value, '%Y-%m-%d') for value in self.window)
+
+    def get_task(self, key, fingerprint):
+        task = self.tasks.get(key)
+        if task is None or task.get('fingerprint') != fingerprint:
+            return None
+        return task
+
+    def has_reached(self, key, fingerprint, state):
+        task = self.get_task(key, fingerprint)
+        return task is not None and TASK_STATES.index(task['state']) >= TASK_STATES.index(state)
+
+    def record(self, key, state, **fields):
+        """
+        Records that task key has reached state; fields (request_id, fingerprint, files...) are
+        kept with it. A new fingerprint starts the task over.
+        """
+        fields['state'] = state
+        with self._lock:
+            self._apply(key, fields)
+            fields['key'] = key
+            self._append(fields)
+
+    def record_all(self, state):
+        """
+        Moves every downloaded task that is not past state yet to state, for steps that handle
+        all the files of the run at once. Tasks that failed before their download are left as
+        they are, so that a resumed run requests them again.
+        """
+        for key in list(self.tasks):
+            task_state = TASK_STATES.index(self.tasks[key]['state'])
+            if TASK_STATES.index(DOWNLOADED) <= task_state < TASK_STATES.index(state):
+                self.record(key, state)
+
+    def record_files_uploaded(self, file_names):
+        with self._lock:
+            self.uploaded_files.update(file_names)
+            self._append({'uploaded_files': list(file_names)})
+
+    def is_file_uploaded(self, file_name):
+        return file_name in self.uploaded_files
+
+    def _apply_replaced(self, file_names, replacement_file_name):
+        for file_name in file_names:
+            self.replaced_files[file_name] = replacement_file_name
+        # A replacement written again holds new rows and is loaded again.
+        self.uploaded_files.discard(get_output_file_name(replacement_file_name))
+
+    def record_replaced(self, file_names, replacement_file_name):
+        """
+        Records that the transform step replaced the downloaded file_names with
+        replacement_file_name.
+        """
+        with self._lock:
+            self._apply_replaced(file_names, replacement_file_name)
+            self._append({'replaced_files': list(file_names), 'by': replacement_file_name})
+
+    def is_file_present(self, directory, file_name):
+        """
+        True if file_name, or the file that replaced it, is in directory or was already uploaded.
+        """
+        while file_name in self.replaced_files:
+            file_name = self.replaced_files[file_name]
+        return (os.path.exists(os.path.join(directory, file_name))
+                or self.is_file_uploaded(get_output_file_name(file_name)))
+
+    def finish(self):
+        """
+        Closes and removes the journal: the next run starts from scratch.
+        """
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            if os.path.exists(self.path):
+                os.remove(self.path)
+            self.window = None
+            self.tasks = {}
+            self.uploaded_files = set()
+            self.replaced_files = {}
@@ -0,0 +1,184 @@
+import csv
+import datetime as dt
+import io
+import os
+from itertools import islice
+
+INSERT_TIME_COLUMN = '_insert_time'
+CSV_ENCODING = 'utf-8-sig'
+
+
+def get_insert_time():
+    return dt.datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
+
+
+def read_csv_rows(file_path, encoding=CSV_ENCODING):
+    """
+    Yields the rows of a report file one at a time, header included.
+    """
+    with open(file_path, 'r', newline='', encoding=encoding) as read_file:
+        for row in csv.reader(read_file, delimiter=','):
+            yield row
+
+
+def concat_csv_rows(file_paths, encoding=CSV_ENCODING):
+    """
+    Yields the header of the first file followed by the data rows of every file, so several
+    files of the same report can be consumed as a single one.
+    """
+    first_header = None
+    for file_path in file_paths:
+        rows = read_csv_rows(file_path, encoding)
+        header = next(rows, None)
+        if header is None:
+            continue
+        if first_header is None:
+            first_header = header
+            yield header
+        elif header != first_header:
+            raise ValueError("{0} does not have the same columns as the previous files".format(file_path))
+        for row in rows:
+            yield row
+
+
+def tee_csv_rows(rows, file_path, encoding=CSV_ENCODING):
+    """
+    Yields rows unchanged while also writing them to file_path, so a stream that is consumed
+    once can be kept as well.
+    """
+    with open(file_path, 'w', newline='', encoding=encoding) as tee_file:
+        writer = csv.writer(tee_file)
+        for row in rows:
+            writer.writerow(row)
+            yield row
+
+
+def add_insert_time(rows, insert_time):
+    """
+    Prepends the _insert_time column to the header and the insert time to every data row.
+    """
+    rows = iter(rows)
+    for header in rows:
+        yield [INSERT_TIME_COLUMN] + header
+        break
+    for row in rows:
+        row.insert(0, insert_time)
+        yield row
+
+
+def chunked(rows, chunk_size):
+    """
+    Groups an iterable of rows into lists of at most chunk_size rows.
+    """
+    rows = iter(rows)
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def write_csv_rows(file_path, rows, chunk_size=10000, encoding=CSV_ENCODING):
+    """
+    Writes rows to a csv file chunk by chunk and returns the number of rows written.
+    """
+    row_count = 0
+    with open(file_path, 'w', newline='', encoding=encoding) as result_file:
+        wr = csv.writer(result_file)
+        for chunk in chunked(rows, chunk_size):
+            wr.writerows(chunk)
+            row_count += len(chunk)
+    return row_count
+
+
+def split_csv_by_column(file_path, column, get_output_path, encoding=CSV_ENCODING):
+    """
+    Streams a csv file into one file per distinct value of column, each with the original
+    header. get_output_path(value) returns the path to write; returns {value: output path}.
+    """
+    rows = read_csv_rows(file_path, encoding)
+    header = next(rows, None)
+    if header is None:
+        return {}
+    position = header.index(column)
+    output_files = {}
+    writers = {}
+    try:
+        for row in rows:
+            value = row[position]
+            writer = writers.get(value)
+            if writer is None:
+                output_files[value] = open(get_output_path(value), 'w', newline='', encoding=encoding)
+                writer = writers[value] = csv.writer(output_files[value])
+                writer.writerow(header)
+            writer.writerow(row)
+    finally:
+        for output_file in output_files.values():
+            output_file.close()
+    return dict((value, output_file.name) for value, output_file in output_files.items())
+
+
+class CsvBatchStream(io.RawIOBase):
+    """
+    Read-only binary file object that encodes batches of rows as csv only when they are read,
+    so a loader can consume a report stream without it being written to disk.
+    """
+    def __init__(self, batches, encoding='utf-8'):
+        self._batches = iter(batches)
+        self._buffer = bytearray()
+        self._position = 0
+        self.encoding = encoding
+
+    def readable(self):
+        return True
+
+    def tell(self):
+        return self._position
+
+    def _fill(self, size):
+        while size < 0 or len(self._buffer) < size:
+            batch = next(self._batches, None)
+            if batch is None:
+                return
+            text = io.StringIO()
+            csv.writer(text).writerows(batch)
+            self._buffer.extend(text.getvalue().encode(self.encoding))
+
+    def read(self, size=-1):
+        if size is None:
+            size = -1
+        self._fill(size)
+        if size < 0:
+            size = len(self._buffer)
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        self._position += len(data)
+        return data
+
+    def readinto(self, buffer):
+        data = self.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+
+def get_output_file_name(file_name):
+    return file_name.replace("_input.csv", "_output.csv")
+
+
+def stamp_report_file(input_path, output_path, insert_time, chunk_size=10000):
+    return write_csv_rows(output_path, add_insert_time(read_csv_rows(input_path), insert_time), chunk_size)
+
+
+def stamp_report_files(directory, insert_time, chunk_size=10000):
+    """
+    Writes an *_output.csv copy of every *_input.csv report in directory with the
+    _insert_time column prepended, using constant memory per file.
+    """
+    for file_name in os.listdir(directory):
+        if file_name.endswith("_input.csv"):
+            stamp_report_file(
+                os.path.join(directory, file_name),
+                os.path.join(directory, get_output_file_name(file_name)),
+                insert_time,
+                chunk_size
+            )
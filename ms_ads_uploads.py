@@ -1,298 +1,272 @@
+import importlib
 import os
-from google.cloud import bigquery
+import ms_ads_arrow
+import ms_ads_reports
+from ms_ads_transform import CsvBatchStream, chunked, concat_csv_rows
+
+DATASET_ID = 'microsoft_ads'
+
+REPORT_TABLES = ms_ads_reports.REPORT_TABLES
+NORMALIZED_TABLES = ms_ads_reports.NORMALIZED_TABLES
+
+
+def get_table_name(file_name, column_profiles=None):
+    """
+    Returns the destination table of a report, given either its ReportName or an *_output.csv file name.
+    Fact and dimension files of normalised reports (see ms_ads_dimensions) are named the same way.
+    With column_profiles ({report name: profile}), profiled reports go to their own tables.
+    """
+    for report_name, table_name in list(NORMALIZED_TABLES.items()) + list(REPORT_TABLES.items()):
+        if file_name == report_name or file_name.endswith(report_name + "_output.csv"):
+            if report_name.endswith('_facts'):
+                report_name = report_name[:-len('_facts')]
+            return ms_ads_reports.get_profiled_table_name(report_name, table_name, column_profiles)
+    return None
+
 
 def execute_uploader(_directory):
-    directory = _directory
-    for file_name in os.listdir(directory):
-        print(directory + "/" + file_name)
-        if file_name.endswith("goals_funnels_report_output.csv"):
-            upload_goals_funnels_stats_table(directory, file_name)
-        elif file_name.endswith("ads_performance_report_output.csv"):
-            upload_ads_performance_table(directory, file_name)
-        elif file_name.endswith("keyword_performance_report_output.csv"):
-            upload_keyword_performance_table(directory, file_name)
-        elif file_name.endswith("search_query_performance_report_output.csv"):
-            upload_search_query_performance_table(directory, file_name)
-        elif file_name.endswith("user_location_performance_report_output.csv"):
-            upload_user_location_performance_table(directory, file_name)
-        elif file_name.endswith("ads_dictionary_report_output.csv"):
-            upload_ads_dictionary_table(directory, file_name)
-
-
-ms_ads_tables_schema = {'microsoft_ads_keyword_performance_table':
-bq_table_schema = [
-    bigquery.SchemaField('_insert_time', 'TIMESTAMP'),
-    bigquery.SchemaField('AccountName', 'STRING'),
-    bigquery.SchemaField('AccountNumber', 'STRING'),
-    bigquery.SchemaField('AccountId', 'INT64'),
-    bigquery.SchemaField('TimePeriod', 'DATE'),
-    bigquery.SchemaField('CampaignName', 'STRING'),
-    bigquery.SchemaField('CampaignId', 'INT64'),
-    bigquery.SchemaField('AdGroupName', 'STRING'),
-    bigquery.SchemaField('AdGroupId', 'INT64'),
-    bigquery.SchemaField('Keyword', 'STRING'),
-    bigquery.SchemaField('KeywordId', 'INT64'),
-    bigquery.SchemaField('AdId', 'INT64'),
-    bigquery.SchemaField('AdType', 'STRING'),
-    bigquery.SchemaField('DestinationUrl', 'STRING'),
-    bigquery.SchemaField('CurrentMaxCpc', 'FLOAT64'),
-    bigquery.SchemaField('CurrencyCode', 'STRING'),
-    bigquery.SchemaField('DeliveredMatchType', 'STRING'),
-    bigquery.SchemaField('AdDistribution', 'STRING'),
-    bigquery.SchemaField('Impressions', 'INT64'),
-    bigquery.SchemaField('Clicks', 'INT64'),
-    bigquery.SchemaField('AverageCpc', 'FLOAT64'),
-    bigquery.SchemaField('Spend', 'FLOAT64'),
-    bigquery.SchemaField('AveragePosition', 'FLOAT64'),
-    bigquery.SchemaField('Conversions', 'FLOAT64'),
-    bigquery.SchemaField('CostPerConversion', 'FLOAT64'),
-    bigquery.SchemaField('BidMatchType', 'STRING'),
-    bigquery.SchemaField('DeviceType', 'STRING'),
-    bigquery.SchemaField('QualityScore', 'STRING'),
-    bigquery.SchemaField('ExpectedCtr', 'STRING'),
-    bigquery.SchemaField('AdRelevance', 'STRING'),
-    bigquery.SchemaField('LandingPageExperience', 'STRING'),
-    bigquery.SchemaField('Language', 'STRING'),
-    bigquery.SchemaField('HistoricalQualityScore', 'STRING'),
-    bigquery.SchemaField('HistoricalExpectedCtr', 'STRING'),
-    bigquery.SchemaField('HistoricalAdRelevance', 'STRING'),
-    bigquery.SchemaField('HistoricalLandingPageExperience', 'STRING'),
-    bigquery.SchemaField('QualityImpact', 'INT64'),
-    bigquery.SchemaField('CampaignStatus', 'STRING'),
-    bigquery.SchemaField('AccountStatus', 'STRING'),
-    bigquery.SchemaField('AdGroupStatus', 'STRING'),
-    bigquery.SchemaField('KeywordStatus', 'STRING'),
-    bigquery.SchemaField('Network', 'STRING'),
-    bigquery.SchemaField('TopVsOther', 'STRING'),
-    bigquery.SchemaField('DeviceOS', 'STRING'),
-    bigquery.SchemaField('Assists', 'FLOAT64'),
-    bigquery.SchemaField('Revenue', 'FLOAT64'),
-    bigquery.SchemaField('ReturnOnAdSpend', 'FLOAT64'),
-    bigquery.SchemaField('CostPerAssist', 'FLOAT64'),
-    bigquery.SchemaField('RevenuePerConversion', 'FLOAT64'),
-    bigquery.SchemaField('RevenuePerAssist', 'FLOAT64'),
-    bigquery.SchemaField('TrackingTemplate', 'STRING'),
-    bigquery.SchemaField('CustomParameters', 'STRING'),
-    bigquery.SchemaField('FinalUrl', 'STRING'),
-    bigquery.SchemaField('FinalMobileUrl', 'STRING'),
-    bigquery.SchemaField('FinalAppUrl', 'STRING'),
-    bigquery.SchemaField('BidStrategyType', 'STRING'),
-    bigquery.SchemaField('KeywordLabels', 'STRING'),
-    bigquery.SchemaField('Mainline1Bid', 'FLOAT64'),
-    bigquery.SchemaField('MainlineBid', 'FLOAT64'),
-    bigquery.SchemaField('FirstPageBid', 'FLOAT64'),
-    bigquery.SchemaField('FinalUrlSuffix', 'STRING'),
-    bigquery.SchemaField('BaseCampaignId', 'INT64'),
-    bigquery.SchemaField('AllConversions', 'FLOAT64'),
-    bigquery.SchemaField('AllRevenue', 'FLOAT64'),
-    bigquery.SchemaField('AllCostPerConversion', 'FLOAT64'),
-    bigquery.SchemaField('AllReturnOnAdSpend', 'FLOAT64'),
-    bigquery.SchemaField('AllRevenuePerConversion', 'FLOAT64')
-  ],
-
-  'microsoft_ads_search_query_performance_table':
-  bq_table_schema = [
-    bigquery.SchemaField('_insert_time', 'TIMESTAMP'),
-    bigquery.SchemaField('AccountName', 'STRING'),
-    bigquery.SchemaField('AccountNumber', 'STRING'),
-    bigquery.SchemaField('AccountId', 'INT64'),
-    bigquery.SchemaField('TimePeriod', 'DATE'),
-    bigquery.SchemaField('CampaignName', 'STRING'),
-    bigquery.SchemaField('CampaignId', 'INT64'),
-    bigquery.SchemaField('AdGroupName', 'STRING'),
-    bigquery.SchemaField('AdGroupId', 'INT64'),
-    bigquery.SchemaField('AdId', 'INT64'),
-    bigquery.SchemaField('AdType', 'STRING'),
-    bigquery.SchemaField('DestinationUrl', 'STRING'),
-    bigquery.SchemaField('BidMatchType', 'STRING'),
-    bigquery.SchemaField('DeliveredMatchType', 'STRING'),
-    bigquery.SchemaField('CampaignStatus', 'STRING'),
-    bigquery.SchemaField('AdStatus', 'STRING'),
-    bigquery.SchemaField('Impressions', 'INT64'),
-    bigquery.SchemaField('Clicks', 'INT64'),
-    bigquery.SchemaField('AverageCpc', 'FLOAT64'),
-    bigquery.SchemaField('Spend', 'FLOAT64'),
-    bigquery.SchemaField('AveragePosition', 'FLOAT64'),
-    bigquery.SchemaField('SearchQuery', 'STRING'),
-    bigquery.SchemaField('Keyword', 'STRING'),
-    bigquery.SchemaField('AdGroupCriterionId', 'INT64'),
-    bigquery.SchemaField('Conversions', 'FLOAT64'),
-    bigquery.SchemaField('CostPerConversion', 'FLOAT64'),
-    bigquery.SchemaField('Language', 'STRING'),
-    bigquery.SchemaField('KeywordId', 'INT64'),
-    bigquery.SchemaField('Network', 'STRING'),
-    bigquery.SchemaField('TopVsOther', 'STRING'),
-    bigquery.SchemaField('DeviceType', 'STRING'),
-    bigquery.SchemaField('DeviceOS', 'STRING'),
-    bigquery.SchemaField('Assists', 'FLOAT64'),
-    bigquery.SchemaField('Revenue', 'FLOAT64'),
-    bigquery.SchemaField('ReturnOnAdSpend', 'FLOAT64'),
-    bigquery.SchemaField('CostPerAssist', 'FLOAT64'),
-    bigquery.SchemaField('RevenuePerConversion', 'FLOAT64'),
-    bigquery.SchemaField('RevenuePerAssist', 'FLOAT64'),
-    bigquery.SchemaField('AccountStatus', 'STRING'),
-    bigquery.SchemaField('AdGroupStatus', 'STRING'),
-    bigquery.SchemaField('KeywordStatus', 'STRING'),
-    bigquery.SchemaField('CampaignType', 'STRING'),
-    bigquery.SchemaField('CustomerId', 'INT64'),
-    bigquery.SchemaField('CustomerName', 'STRING'),
-    bigquery.SchemaField('AllConversions', 'FLOAT64'),
-    bigquery.SchemaField('AllRevenue', 'FLOAT64'),
-    bigquery.SchemaField('AllCostPerConversion', 'FLOAT64'),
-    bigquery.SchemaField('AllReturnOnAdSpend', 'FLOAT64'),
-    bigquery.SchemaField('AllRevenuePerConversion', 'FLOAT64')
-  ],
-
-  'microsoft_ads_user_location_performance_table':
-  bq_table_schema = [
-    bigquery.SchemaField('_insert_time', 'TIMESTAMP'),
-    bigquery.SchemaField('AccountName', 'STRING'),
-    bigquery.SchemaField('AccountNumber', 'STRING'),
-    bigquery.SchemaField('AccountId', 'INT64'),
-    bigquery.SchemaField('TimePeriod', 'DATE'),
-    bigquery.SchemaField('CampaignName', 'STRING'),
-    bigquery.SchemaField('CampaignId', 'INT64'),
-    bigquery.SchemaField('AdGroupName', 'STRING'),
-    bigquery.SchemaField('AdGroupId', 'INT64'),
-    bigquery.SchemaField('Country', 'STRING'),
-    bigquery.SchemaField('State', 'STRING'),
-    bigquery.SchemaField('MetroArea', 'STRING'),
-    bigquery.SchemaField('AdDistribution', 'STRING'),
-    bigquery.SchemaField('Impressions', 'INT64'),
-    bigquery.SchemaField('Clicks', 'INT64'),
-    bigquery.SchemaField('AverageCpc', 'FLOAT64'),
-    bigquery.SchemaField('Spend', 'FLOAT64'),
-    bigquery.SchemaField('AveragePosition', 'FLOAT64'),
-    bigquery.SchemaField('ProximityTargetLocation', 'STRING'),
-    bigquery.SchemaField('Radius', 'STRING'),
-    bigquery.SchemaField('Language', 'STRING'),
-    bigquery.SchemaField('City', 'STRING'),
-    bigquery.SchemaField('QueryIntentCountry', 'STRING'),
-    bigquery.SchemaField('QueryIntentState', 'STRING'),
-    bigquery.SchemaField('QueryIntentCity', 'STRING'),
-    bigquery.SchemaField('QueryIntentDMA', 'STRING'),
-    bigquery.SchemaField('BidMatchType', 'STRING'),
-    bigquery.SchemaField('DeliveredMatchType', 'STRING'),
-    bigquery.SchemaField('Network', 'STRING'),
-    bigquery.SchemaField('TopVsOther', 'STRING'),
-    bigquery.SchemaField('DeviceType', 'STRING'),
-    bigquery.SchemaField('DeviceOS', 'STRING'),
-    bigquery.SchemaField('Assists', 'FLOAT64'),
-    bigquery.SchemaField('Conversions', 'FLOAT64'),
-    bigquery.SchemaField('Revenue', 'FLOAT64'),
-    bigquery.SchemaField('ReturnOnAdSpend', 'FLOAT64'),
-    bigquery.SchemaField('CostPerConversion', 'FLOAT64'),
-    bigquery.SchemaField('CostPerAssist', 'FLOAT64'),
-    bigquery.SchemaField('RevenuePerConversion', 'FLOAT64'),
-    bigquery.SchemaField('RevenuePerAssist', 'FLOAT64'),
-    bigquery.SchemaField('County', 'STRING'),
-    bigquery.SchemaField('PostalCode', 'STRING'),
-    bigquery.SchemaField('QueryIntentCounty', 'STRING'),
-    bigquery.SchemaField('QueryIntentPostalCode', 'STRING'),
-    bigquery.SchemaField('LocationId', 'INT64'),
-    bigquery.SchemaField('QueryIntentLocationId', 'INT64'),
-    bigquery.SchemaField('AllConversions', 'FLOAT64'),
-    bigquery.SchemaField('AllRevenue', 'FLOAT64'),
-    bigquery.SchemaField('AllCostPerConversion', 'FLOAT64'),
-    bigquery.SchemaField('AllReturnOnAdSpend', 'FLOAT64'),
-    bigquery.SchemaField('AllRevenuePerConversion', 'FLOAT64')
-  ],
-
-  'microsoft_ads_user_location_performance_table':
-  bq_table_schema = [
-    bigquery.SchemaField('_insert_time', 'TIMESTAMP'),
-    bigquery.SchemaField('AccountName', 'STRING'),
-    bigquery.SchemaField('AccountNumber', 'STRING'),
-    bigquery.SchemaField('AccountId', 'INT64'),
-    bigquery.SchemaField('TimePeriod', 'DATE'),
-    bigquery.SchemaField('CampaignName', 'STRING'),
-    bigquery.SchemaField('CampaignId', 'INT64'),
-    bigquery.SchemaField('AdGroupName', 'STRING'),
-    bigquery.SchemaField('AdGroupId', 'INT64'),
-    bigquery.SchemaField('Country', 'STRING'),
-    bigquery.SchemaField('State', 'STRING'),
-    bigquery.SchemaField('MetroArea', 'STRING'),
-    bigquery.SchemaField('AdDistribution', 'STRING'),
-    bigquery.SchemaField('Impressions', 'INT64'),
-    bigquery.SchemaField('Clicks', 'INT64'),
-    bigquery.SchemaField('AverageCpc', 'FLOAT64'),
-    bigquery.SchemaField('Spend', 'FLOAT64'),
-    bigquery.SchemaField('AveragePosition', 'FLOAT64'),
-    bigquery.SchemaField('ProximityTargetLocation', 'STRING'),
-    bigquery.SchemaField('Radius', 'STRING'),
-    bigquery.SchemaField('Language', 'STRING'),
-    bigquery.SchemaField('City', 'STRING'),
-    bigquery.SchemaField('QueryIntentCountry', 'STRING'),
-    bigquery.SchemaField('QueryIntentState', 'STRING'),
-    bigquery.SchemaField('QueryIntentCity', 'STRING'),
-    bigquery.SchemaField('QueryIntentDMA', 'STRING'),
-    bigquery.SchemaField('BidMatchType', 'STRING'),
-    bigquery.SchemaField('DeliveredMatchType', 'STRING'),
-    bigquery.SchemaField('Network', 'STRING'),
-    bigquery.SchemaField('TopVsOther', 'STRING'),
-    bigquery.SchemaField('DeviceType', 'STRING'),
-    bigquery.SchemaField('DeviceOS', 'STRING'),
-    bigquery.SchemaField('Assists', 'FLOAT64'),
-    bigquery.SchemaField('Conversions', 'FLOAT64'),
-    bigquery.SchemaField('Revenue', 'FLOAT64'),
-    bigquery.SchemaField('ReturnOnAdSpend', 'FLOAT64'),
-    bigquery.SchemaField('CostPerConversion', 'FLOAT64'),
-    bigquery.SchemaField('CostPerAssist', 'FLOAT64'),
-    bigquery.SchemaField('RevenuePerConversion', 'FLOAT64'),
-    bigquery.SchemaField('RevenuePerAssist', 'FLOAT64'),
-    bigquery.SchemaField('County', 'STRING'),
-    bigquery.SchemaField('PostalCode', 'STRING'),
-    bigquery.SchemaField('QueryIntentCounty', 'STRING'),
-    bigquery.SchemaField('QueryIntentPostalCode', 'STRING'),
-    bigquery.SchemaField('LocationId', 'INT64'),
-    bigquery.SchemaField('QueryIntentLocationId', 'INT64'),
-    bigquery.SchemaField('AllConversions', 'FLOAT64'),
-    bigquery.SchemaField('AllRevenue', 'FLOAT64'),
-    bigquery.SchemaField('AllCostPerConversion', 'FLOAT64'),
-    bigquery.SchemaField('AllReturnOnAdSpend', 'FLOAT64'),
-    bigquery.SchemaField('AllRevenuePerConversion', 'FLOAT64')
-  ],
-
-  'microsoft_ads_ads_dictionary_table':
-  bq_ads_dictionary_table_table_schema = [
-    bigquery.SchemaField('_insert_time', 'TIMESTAMP'),
-    bigquery.SchemaField('AccountName', 'STRING'),
-    bigquery.SchemaField('AccountNumber', 'STRING'),
-    bigquery.SchemaField('AccountId', 'INT64'),
-    bigquery.SchemaField('CampaignName', 'STRING'),
-    bigquery.SchemaField('CampaignId', 'INT64'),
-    bigquery.SchemaField('AdGroupName', 'STRING'),
-    bigquery.SchemaField('AdId', 'INT64'),
-    bigquery.SchemaField('AdGroupId', 'INT64'),
-    bigquery.SchemaField('AdTitle', 'STRING'),
-    bigquery.SchemaField('AdDescription', 'STRING'),
-    bigquery.SchemaField('AdDescription2', 'STRING'),
-    bigquery.SchemaField('AdType', 'STRING'),
-    bigquery.SchemaField('AdDistribution', 'STRING'),
-    bigquery.SchemaField('Impressions', 'INT64'),
-    bigquery.SchemaField('DestinationUrl', 'STRING'),
-    bigquery.SchemaField('DisplayUrl', 'STRING'),
-    bigquery.SchemaField('AdStatus', 'STRING'),
-    bigquery.SchemaField('TrackingTemplate', 'STRING'),
-    bigquery.SchemaField('CustomParameters', 'STRING'),
-    bigquery.SchemaField('FinalUrl', 'STRING'),
-    bigquery.SchemaField('FinalMobileUrl', 'STRING'),
-    bigquery.SchemaField('FinalAppUrl', 'STRING'),
-    bigquery.SchemaField('AccountStatus', 'STRING'),
-    bigquery.SchemaField('CampaignStatus', 'STRING'),
-    bigquery.SchemaField('AdGroupStatus', 'STRING'),
-    bigquery.SchemaField('TitlePart1', 'STRING'),
-    bigquery.SchemaField('TitlePart2', 'STRING'),
-    bigquery.SchemaField('TitlePart3', 'STRING'),
-    bigquery.SchemaField('Headline', 'STRING'),
-    bigquery.SchemaField('LongHeadline', 'STRING'),
-    bigquery.SchemaField('BusinessName', 'STRING'),
-    bigquery.SchemaField('Path1', 'STRING'),
-    bigquery.SchemaField('Path2', 'STRING'),
-    bigquery.SchemaField('CustomerId', 'INT64'),
-    bigquery.SchemaField('CustomerName', 'STRING'),
-    bigquery.SchemaField('CampaignType', 'STRING'),
-    bigquery.SchemaField('BaseCampaignId', 'INT64'),
-    bigquery.SchemaField('FinalUrlSuffix', 'STRING')
-  ]
-}
+    DataUploader().execute_uploader(_directory)
+
+
+def get_bigquery():
+    """
+    Imports google.cloud.bigquery on first use, so that extraction-only runs and --help do
+    not pay for it.
+    """
+    return importlib.import_module('google.cloud.bigquery')
+
+
+def get_bq_table_schema(definition):
+    bigquery = get_bigquery()
+    return [bigquery.SchemaField(name, bq_type) for name, bq_type in definition.get_table_columns()]
+
+
+_tables_schema = None
+
+
+def get_tables_schema():
+    global _tables_schema
+    if _tables_schema is None:
+        _tables_schema = dict(
+            (definition.table_name, get_bq_table_schema(definition))
+            for definition in list(ms_ads_reports.REPORT_DEFINITIONS.values()) +
+            list(ms_ads_reports.FACT_DEFINITIONS.values()) + list(ms_ads_reports.DIMENSION_DEFINITIONS.values())
+            if definition.table_name is not None
+        )
+    return _tables_schema
+
+
+def get_table_schema(table_name, column_profiles=None):
+    """
+    Schema of a table; with column_profiles ({report name: profile}), that of the profiled reports.
+    """
+    if not column_profiles:
+        return get_tables_schema().get(table_name)
+    definition = ms_ads_reports.get_table_definition(table_name, column_profiles)
+    return get_bq_table_schema(definition) if definition is not None else None
+
+
+def __getattr__(name):
+    # ms_ads_tables_schema needs bigquery.SchemaField, so it is only built when it is used.
+    if name == 'ms_ads_tables_schema':
+        return get_tables_schema()
+    raise AttributeError("module {0!r} has no attribute {1!r}".format(__name__, name))
+
+
+class BigQueryLoadClient(object):
+    """
+    Load client backed by google.cloud.bigquery. DataUploader only calls load_file, so any
+    object with the same method (e.g. LocalLoadClient) can be used in its place.
+
+    With a merge_key, the file is loaded into a <table>_staging table, replacing its content,
+    then merged into the table on that column: existing rows are updated, new ones inserted.
+    """
+    def __init__(self, dataset_id=DATASET_ID, client=None):
+        self.dataset_id = dataset_id
+        self.client = client if client is not None else get_bigquery().Client()
+
+    def get_table_id(self, table_name):
+        return '{0}.{1}.{2}'.format(self.client.project, self.dataset_id, table_name)
+
+    @staticmethod
+    def get_load_job_config(source_format, schema, write_disposition='WRITE_APPEND'):
+        bigquery = get_bigquery()
+        if source_format == 'PARQUET':
+            return bigquery.LoadJobConfig(
+                source_format=bigquery.SourceFormat.PARQUET,
+                write_disposition=write_disposition,
+            )
+        return bigquery.LoadJobConfig(
+            source_format=bigquery.SourceFormat.CSV,
+            skip_leading_rows=1,
+            schema=schema,
+            autodetect=schema is None,
+            write_disposition=write_disposition,
+        )
+
+    def load_file(self, table_name, file_object, source_format, schema=None, merge_key=None):
+        if merge_key is not None:
+            return self.merge_file(table_name, file_object, source_format, schema, merge_key)
+        table_id = self.get_table_id(table_name)
+        load_job = self.client.load_table_from_file(
+            file_object,
+            table_id,
+            job_config=self.get_load_job_config(source_format, schema)
+        )
+        load_job.result()
+        print("Loaded {0} rows into {1}".format(load_job.output_rows, table_id))
+        return load_job
+
+    @staticmethod
+    def get_merge_query(table_id, staging_table_id, column_names, merge_key):
+        return (
+            "CREATE TABLE IF NOT EXISTS `{0}` LIKE `{1}`;\n"
+            "MERGE `{0}` AS target USING `{1}` AS source ON target.{2} = source.{2}\n"
+            "WHEN MATCHED THEN UPDATE SET {3}\n"
+            "WHEN NOT MATCHED THEN INSERT ROW"
+        ).format(table_id, staging_table_id, merge_key,
+                 ', '.join('{0} = source.{0}'.format(name) for name in column_names if name != merge_key))
+
+    def merge_file(self, table_name, file_object, source_format, schema, merge_key):
+        table_id = self.get_table_id(table_name)
+        staging_table_id = self.get_table_id(table_name + '_staging')
+        load_job = self.client.load_table_from_file(
+            file_object,
+            staging_table_id,
+            job_config=self.get_load_job_config(source_format, schema, 'WRITE_TRUNCATE')
+        )
+        load_job.result()
+        column_names = [field.name for field in self.client.get_table(staging_table_id).schema]
+        self.client.query(self.get_merge_query(table_id, staging_table_id, column_names, merge_key)).result()
+        print("Merged {0} rows into {1} on {2}".format(load_job.output_rows, table_id, merge_key))
+        return load_job
+
+
+class LocalLoadClient(object):
+    """
+    Stand-in load client that writes every load job to <directory>/<table_name>_<n>.<format>
+    and keeps a list of the loads it received, and the merge key of the merged tables, for dry
+    runs and for testing the uploader.
+    """
+    def __init__(self, directory):
+        self.directory = directory
+        self.loads = []
+        self.merge_keys = {}
+
+    def load_file(self, table_name, file_object, source_format, schema=None, merge_key=None):
+        if not os.path.exists(self.directory):
+            os.makedirs(self.directory)
+        file_path = os.path.join(self.directory, '{0}_{1}.{2}'.format(table_name, len(self.loads),
+                                                                      source_format.lower()))
+        with open(file_path, 'wb') as load_file:
+            load_file.write(file_object.read())
+        self.loads.append((table_name, source_format, file_path))
+        if merge_key is not None:
+            self.merge_keys[table_name] = merge_key
+        print("Wrote load for {0} to {1}".format(table_name, file_path))
+        return file_path
+
+
+class DataUploader(object):
+    """
+    Loads reports into Big Query with one load job per destination table: all the files of a
+    table are streamed into the same job. With source_format 'PARQUET', reports that have a
+    declared schema are converted into typed, compressed Parquet first; reports without a
+    schema are always loaded as csv. With vectorized, report files are converted to Parquet by
+    pyarrow's csv reader instead of row by row. The dimension tables are merged into on their
+    key column (MERGE_KEY_COLUMNS) rather than appended to. column_profiles ({report name: profile})
+    must be those the reports were requested with; profiled reports are loaded into their own
+    tables (see get_table_name), whose schemas follow the profiles.
+    """
+    def __init__(self, dataset_id=DATASET_ID, client=None, source_format='CSV', load_client=None, batch_size=10000,
+                 vectorized=False, column_profiles=None):
+        self.load_client = load_client if load_client is not None else BigQueryLoadClient(dataset_id, client)
+        self.source_format = source_format.upper()
+        self.batch_size = batch_size
+        self.vectorized = vectorized
+        self.column_profiles = column_profiles
+
+    def get_schema(self, table_name):
+        return get_table_schema(table_name, self.column_profiles)
+
+    @staticmethod
+    def get_merge_key(table_name):
+        return ms_ads_reports.MERGE_KEY_COLUMNS.get(table_name)
+
+    def use_parquet(self, table_name):
+        return self.source_format == 'PARQUET' and self.get_schema(table_name) is not None
+
+    def upload_rows(self, table_name, rows):
+        """
+        Loads rows (header first) as a single load job.
+        """
+        schema = self.get_schema(table_name)
+        if self.use_parquet(table_name):
+            return self.load_client.load_file(
+                table_name,
+                ms_ads_arrow.rows_to_parquet_buffer(rows, schema),
+                'PARQUET',
+                schema,
+                merge_key=self.get_merge_key(table_name)
+            )
+        return self.load_client.load_file(table_name, CsvBatchStream(chunked(rows, self.batch_size)), 'CSV', schema,
+                                          merge_key=self.get_merge_key(table_name))
+
+    def upload_batches(self, table_name, batches):
+        """
+        Loads in-memory batches of rows (the first row of the first batch being the header)
+        as a single load job, without writing them to disk first.
+        """
+        return self.upload_rows(table_name, (row for batch in batches for row in batch))
+
+    def upload_files(self, table_name, file_paths):
+        if self.vectorized and self.use_parquet(table_name):
+            schema = self.get_schema(table_name)
+            return self.load_client.load_file(
+                table_name,
+                ms_ads_arrow.csv_files_to_parquet_buffer(file_paths, schema),
+                'PARQUET',
+                schema,
+                merge_key=self.get_merge_key(table_name)
+            )
+        return self.upload_rows(table_name, concat_csv_rows(file_paths))
+
+    def upload_file(self, table_name, file_path):
+        return self.upload_files(table_name, [file_path])
+
+    def get_table_name(self, file_name):
+        return get_table_name(file_name, self.column_profiles)
+
+    def group_files_by_table(self, _directory):
+        files_by_table = {}
+        for file_name in sorted(os.listdir(_directory)):
+            table_name = self.get_table_name(file_name)
+            if table_name is not None:
+                files_by_table.setdefault(table_name, []).append(os.path.join(_directory, file_name))
+        return files_by_table
+
+    def execute_uploader(self, _directory, run_journal=None):
+        """
+        With a run_journal, the files that an interrupted run already loaded are not loaded again,
+        except into the merged tables, where loading them again changes nothing. A table that
+        fails to load does not stop the others; returns the (table name, exception) tuples of the
+        failed tables.
+        """
+        failures = []
+        for table_name, file_paths in self.group_files_by_table(_directory).items():
+            if run_journal is not None and self.get_merge_key(table_name) is None:
+                file_paths = [file_path for file_path in file_paths
+                              if not run_journal.is_file_uploaded(os.path.basename(file_path))]
+                if not file_paths:
+                    print("{0}: already uploaded".format(table_name))
+                    continue
+            print("{0}: {1} files".format(table_name, len(file_paths)))
+            try:
+                self.upload_files(table_name, file_paths)
+            except Exception as ex:
+                print("Could not load {0}: {1}".format(table_name, ex))
+                failures.append((table_name, ex))
+                continue
+            if run_journal is not None:
+                run_journal.record_files_uploaded([os.path.basename(file_path) for file_path in file_paths])
+        return failures
@@ -0,0 +1,199 @@
+import http.server
+import io
+import os
+import threading
+import zipfile
+from concurrent.futures import Future
+
+import pytest
+
+from ms_ads_download import AsyncDownloadEngine, HttpConnectionPool, HttpStatusError, extract_zip_chunks, \
+    iter_unzipped_chunks, iter_url_chunks, iter_zip_csv_rows
+from ms_ads_scheduler import ConcurrentReportRunner, ReportJob, chain_future
+
+BODY = bytes(range(256)) * 1024
+
+
+class RangeHandler(http.server.BaseHTTPRequestHandler):
+    """
+    Serves BODY, dropping the connection half way through the first response. With
+    supports_range False, Range headers are ignored and the whole body is sent again.
+    """
+    protocol_version = 'HTTP/1.1'
+    supports_range = True
+    requests = []
+
+    def do_GET(self):
+        range_header = self.headers.get('Range')
+        self.requests.append(range_header)
+        if range_header and self.supports_range:
+            start = int(range_header[len('bytes='):-1])
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes {0}-{1}/{2}'.format(start, len(BODY) - 1, len(BODY)))
+        else:
+            start = 0
+            self.send_response(200)
+        self.send_header('Content-Length', str(len(BODY) - start))
+        self.end_headers()
+        if len(self.requests) == 1:
+            self.wfile.write(BODY[:len(BODY) // 2])
+            self.close_connection = True
+            return
+        self.wfile.write(BODY[start:])
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture(params=[True, False], ids=['range', 'no-range'])
+def server(request):
+    handler = type('Handler', (RangeHandler,), {'supports_range': request.param, 'requests': []})
+    httpd = http.server.ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd, handler
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def test_iter_url_chunks_resumes_a_dropped_download(server):
+    httpd, handler = server
+    pool = HttpConnectionPool(timeout_in_seconds=5)
+    url = 'http://127.0.0.1:{0}/result.zip'.format(httpd.server_address[1])
+    body = b''.join(iter_url_chunks(pool, url, chunk_size=4096, sleep=lambda delay: None))
+    pool.close()
+    assert body == BODY
+    assert handler.requests == [None, 'bytes={0}-'.format(len(BODY) // 2)]
+
+
+def test_iter_url_chunks_raises_permanent_statuses():
+    class NotFoundHandler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            self.send_error(404)
+
+        def log_message(self, *args):
+            pass
+
+    httpd = http.server.ThreadingHTTPServer(('127.0.0.1', 0), NotFoundHandler)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    try:
+        with pytest.raises(HttpStatusError) as error:
+            list(iter_url_chunks(HttpConnectionPool(), 'http://127.0.0.1:{0}/'.format(httpd.server_address[1]),
+                                 sleep=lambda delay: None))
+        assert error.value.status == 404
+    finally:
+        httpd.shutdown()
+        httpd.server_close()
+
+
+def make_zip(data, compression=zipfile.ZIP_DEFLATED):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', compression) as archive:
+        archive.writestr('report.csv', data)
+    return buffer.getvalue()
+
+
+def iter_pieces(data, size=1000):
+    for position in range(0, len(data), size):
+        yield data[position:position + size]
+
+
+@pytest.mark.parametrize('compression', [zipfile.ZIP_DEFLATED, zipfile.ZIP_STORED])
+def test_iter_unzipped_chunks(compression):
+    data = b'AccountId,Clicks\r\n' + b'123,4\r\n' * 10000
+    assert b''.join(iter_unzipped_chunks(iter_pieces(make_zip(data, compression)))) == data
+
+
+@pytest.mark.parametrize('compression', [zipfile.ZIP_DEFLATED, zipfile.ZIP_STORED])
+def test_iter_unzipped_chunks_detects_truncation(compression):
+    archive = make_zip(b'123,4\r\n' * 10000, compression)
+    with pytest.raises(zipfile.BadZipFile, match='Unexpected end'):
+        list(iter_unzipped_chunks(iter_pieces(archive[:len(archive) // 2])))
+
+
+def test_iter_unzipped_chunks_detects_a_bad_crc():
+    archive = bytearray(make_zip(b'123,4\r\n' * 100, zipfile.ZIP_STORED))
+    # Corrupt a byte of the stored data, right after the local file header and name.
+    archive[30 + len('report.csv')] ^= 0xff
+    with pytest.raises(zipfile.BadZipFile, match='CRC-32'):
+        list(iter_unzipped_chunks(iter_pieces(bytes(archive))))
+
+
+def test_iter_unzipped_chunks_rejects_other_files():
+    with pytest.raises(zipfile.BadZipFile, match='Not a zip archive'):
+        list(iter_unzipped_chunks([b'<html>' + b' ' * 100]))
+
+
+def test_extract_zip_chunks_leaves_no_partial_file(tmp_path):
+    archive = make_zip(b'123,4\r\n' * 10000)
+    with pytest.raises(zipfile.BadZipFile):
+        extract_zip_chunks(iter_pieces(archive[:len(archive) // 2]), str(tmp_path), 'report.csv')
+    assert list(tmp_path.iterdir()) == []
+    extract_zip_chunks(iter_pieces(archive), str(tmp_path), 'report.csv')
+    assert (tmp_path / 'report.csv').read_bytes() == b'123,4\r\n' * 10000
+
+
+class ZippedReportHandler(http.server.BaseHTTPRequestHandler):
+    """
+    Serves /<account id>.zip as a zipped csv report of that account.
+    """
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        account_id = self.path.strip('/').split('.')[0]
+        body = make_zip(b'AccountId,Clicks\r\n' + '{0},4\r\n'.format(account_id).encode('utf-8') * 1000)
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def report_server():
+    httpd = http.server.ThreadingHTTPServer(('127.0.0.1', 0), ZippedReportHandler)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    yield 'http://127.0.0.1:{0}'.format(httpd.server_address[1])
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def test_download_engine_extracts_reports_in_the_background(tmp_path, report_server):
+    with AsyncDownloadEngine(max_connections=2, timeout_in_seconds=5) as engine:
+        futures = dict(
+            (account_id, engine.submit('{0}/{1}.zip'.format(report_server, account_id),
+                                       lambda chunks, account_id=account_id: extract_zip_chunks(
+                                           chunks, str(tmp_path), '{0}_report_input.csv'.format(account_id))))
+            for account_id in range(1, 6))
+        rows = engine.submit(report_server + '/9.zip', lambda chunks: list(iter_zip_csv_rows(chunks))).result()
+        for account_id, future in futures.items():
+            with open(future.result(), 'rb') as result_file:
+                assert result_file.read() == b'AccountId,Clicks\r\n' + '{0},4\r\n'.format(account_id).encode() * 1000
+    assert rows == [['AccountId', 'Clicks']] + [['9', '4']] * 1000
+    assert sorted(os.listdir(str(tmp_path))) == ['{0}_report_input.csv'.format(account_id)
+                                                 for account_id in range(1, 6)]
+
+
+class Request(object):
+    ReportName = 'keyword_performance_report'
+
+
+def test_concurrent_report_runner_does_not_wait_for_background_work():
+    downloads = dict((account_id, Future()) for account_id in ('1', '2'))
+    jobs = [ReportJob(account_id, Request(), account_id + '.csv') for account_id in ('1', '2', '3')]
+    runner = ConcurrentReportRunner(lambda: None, max_workers=1)
+
+    def run_job(job, _reporting_service_manager):
+        if job.account_id in downloads:
+            return chain_future(downloads[job.account_id], lambda path: [path])
+        return [job.result_file_name]
+
+    finished = runner.run(jobs, run_job)
+    # A single worker gets to the third job while the first two are still downloading.
+    assert next(finished).account_id == '3'
+    downloads['2'].set_result('2.csv')
+    downloads['1'].set_exception(IOError('download failed'))
+    assert sorted((job.account_id, job.result, str(job.error) if job.error else None) for job in finished) == [
+        ('1', None, 'download failed'), ('2', ['2.csv'], None)]
@@ -0,0 +1,97 @@
+import threading
+
+import pytest
+
+from ms_ads import MicrosoftAdsAPI
+from ms_ads_scheduler import fetch_pages
+
+
+class Paging(object):
+    def __init__(self):
+        self.Index = 0
+        self.Size = 0
+
+    def __iter__(self):
+        return iter([('Index', self.Index), ('Size', self.Size)])
+
+    def __setitem__(self, name, value):
+        setattr(self, name, value)
+
+
+class Factory(object):
+    def create(self, type_name):
+        assert type_name == 'ns5:Paging'
+        return Paging()
+
+
+class Response(object):
+    def __init__(self, accounts):
+        self.AdvertiserAccount = accounts
+
+    def __getitem__(self, name):
+        return getattr(self, name)
+
+
+class CustomerService(object):
+    """
+    Stand-in for the suds CustomerManagementService client: SearchAccounts serves item_count
+    accounts, page by page. Every call is recorded with the client and the thread it ran on.
+    """
+    def __init__(self, item_count, calls):
+        self.factory = Factory()
+        self.item_count = item_count
+        self.calls = calls
+
+    def SearchAccounts(self, PageInfo, Predicates=None):
+        self.calls.append((self, PageInfo.Index, threading.current_thread()))
+        start = PageInfo.Index * PageInfo.Size
+        accounts = list(range(start, min(start + PageInfo.Size, self.item_count)))
+        # The service returns no AdvertiserAccount element for an empty page.
+        return Response(accounts) if accounts else None
+
+
+def get_api():
+    return MicrosoftAdsAPI('client_id', 'developer_token', 'production', 'refresh_token', 'client_state')
+
+
+@pytest.mark.parametrize('item_count', [0, 3, 10, 23, 30])
+@pytest.mark.parametrize('wave_size', [1, 3])
+def test_get_paged_results(item_count, wave_size):
+    calls = []
+    customer_service = CustomerService(item_count, calls)
+    accounts = get_api().get_paged_results(customer_service, 'SearchAccounts', 'AdvertiserAccount', page_size=10,
+                                           customer_service_factory=lambda: CustomerService(item_count, calls),
+                                           wave_size=wave_size)
+    assert accounts == list(range(item_count))
+    # The first page is requested with the client that was passed in, on the calling thread.
+    assert calls[0] == (customer_service, 0, threading.current_thread())
+    assert sorted(page_index for _, page_index, _ in calls)[:item_count // 10 + 1] == \
+        list(range(item_count // 10 + 1))
+    if wave_size == 1:
+        assert all(client is customer_service for client, _, _ in calls)
+
+
+def test_get_paged_results_gives_each_worker_its_own_client():
+    calls = []
+    customer_service = CustomerService(100, calls)
+    get_api().get_paged_results(customer_service, 'SearchAccounts', 'AdvertiserAccount', page_size=10,
+                                customer_service_factory=lambda: CustomerService(100, calls), wave_size=4)
+    clients_by_thread = {}
+    for client, _, thread in calls:
+        clients_by_thread.setdefault(thread, set()).add(client)
+    assert all(len(clients) == 1 for clients in clients_by_thread.values())
+    assert clients_by_thread[threading.current_thread()] == {customer_service}
+    assert all(customer_service not in clients for thread, clients in clients_by_thread.items()
+               if thread is not threading.current_thread())
+
+
+def test_fetch_pages_stops_at_the_first_short_page():
+    requested = []
+
+    def fetch_page(page_index):
+        requested.append(page_index)
+        return [page_index] * (2 if page_index < 5 else 1)
+
+    assert fetch_pages(fetch_page, 2, wave_size=4) == [0, 0, 1, 1, 2, 2, 3, 3, 4, 4, 5]
+    # Page 0 alone, then waves of 4: no page after the wave of the short page 5 is requested.
+    assert set(range(6)) <= set(requested) <= set(range(9))
@@ -0,0 +1,81 @@
+import pytest
+
+from ms_ads import MicrosoftAdsAPI
+from ms_ads_scheduler import ReadyTimeStats, ReportJob, ReportPollingScheduler
+
+
+class Clock(object):
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class Status(object):
+    def __init__(self, status, report_download_url=None):
+        self.status = status
+        self.report_download_url = report_download_url
+
+
+class Operation(object):
+    request_id = 'request'
+
+    def __init__(self, statuses):
+        self.statuses = list(statuses)
+        self.polls = 0
+
+    def get_status(self):
+        self.polls += 1
+        return self.statuses.pop(0)
+
+    def track(self, timeout_in_milliseconds=None):
+        raise AssertionError('fixed-interval tracking')
+
+
+class Manager(object):
+    def __init__(self, operation):
+        self.operation = operation
+
+    def submit_download(self, report_request):
+        return self.operation
+
+
+class Request(object):
+    ReportName = 'keyword_performance_report'
+
+
+@pytest.fixture
+def extractor(monkeypatch):
+    extractor = MicrosoftAdsAPI('client_id', 'developer_token', 'production', 'refresh_token', 'client_state')
+    clock = Clock()
+    monkeypatch.setattr(extractor, 'get_report_polling_scheduler', lambda manager, ready_time_stats=None:
+                        ReportPollingScheduler(manager, stats=ready_time_stats, jitter=0, clock=clock.time,
+                                               sleep=clock.sleep))
+    extractor.clock = clock
+    return extractor
+
+
+def test_track_job_polls_from_the_recorded_ready_time(extractor):
+    ready_time_stats = ReadyTimeStats()
+    ready_time_stats.record('keyword_performance_report', 10.0)
+    operation = Operation([Status('InProgress'), Status('Success', 'https://example.com/report.zip')])
+    job = ReportJob('1', Request(), '1_keyword_performance_report_input.csv')
+    tracked, status = extractor.track_job(job, Manager(operation), ready_time_stats=ready_time_stats)
+    assert tracked is operation
+    assert status.report_download_url == 'https://example.com/report.zip'
+    # The first poll waits for the recorded time-to-ready, then backs off.
+    assert extractor.clock.sleeps == [10.0, 20.0]
+    assert ready_time_stats.samples['keyword_performance_report'] == [10.0, 30.0]
+
+
+def test_track_job_raises_when_the_report_fails(extractor):
+    operation = Operation([Status('Error')])
+    job = ReportJob('1', Request(), '1_keyword_performance_report_input.csv')
+    with pytest.raises(Exception, match='failed to generate'):
+        extractor.track_job(job, Manager(operation), ready_time_stats=ReadyTimeStats())
@@ -0,0 +1,120 @@
+import errno
+import http.client
+import socket
+from types import SimpleNamespace
+
+import pytest
+
+from ms_ads_download import HttpStatusError
+from ms_ads_retry import AUTH, PERMANENT, THROTTLING, TRANSIENT, RetryBudget, RetryPolicy, call_with_retry, \
+    classify_error
+
+
+class FakeWebFault(Exception):
+    def __init__(self, *codes):
+        super(FakeWebFault, self).__init__("fault {0}".format(', '.join(codes)))
+        errors = [SimpleNamespace(Code=code, ErrorCode=None) for code in codes]
+        self.fault = SimpleNamespace(detail=SimpleNamespace(
+            AdApiFaultDetail=SimpleNamespace(Errors=SimpleNamespace(AdApiError=errors))))
+
+
+@pytest.mark.parametrize('ex, category', [
+    (FakeWebFault('117'), THROTTLING),
+    (FakeWebFault('0'), TRANSIENT),
+    (FakeWebFault('105'), AUTH),
+    (FakeWebFault('1001'), PERMANENT),
+    (FakeWebFault('1001', '117'), THROTTLING),
+    (HttpStatusError('http://host/file', 503, 'Service Unavailable'), TRANSIENT),
+    (HttpStatusError('http://host/file', 429, 'Too Many Requests'), THROTTLING),
+    (HttpStatusError('http://host/file', 404, 'Not Found'), PERMANENT),
+    (ConnectionResetError(), TRANSIENT),
+    (ConnectionRefusedError(), TRANSIENT),
+    (socket.timeout('timed out'), TRANSIENT),
+    (http.client.IncompleteRead(b''), TRANSIENT),
+    (ValueError('bad request'), PERMANENT),
+    (PermissionError(errno.EACCES, 'Permission denied'), PERMANENT),
+    (FileNotFoundError(errno.ENOENT, 'No such file or directory'), PERMANENT),
+    (OSError(errno.ENOSPC, 'No space left on device'), PERMANENT),
+])
+def test_classify_error(ex, category):
+    assert classify_error(ex) == category
+
+
+def test_classify_error_bingads_exceptions():
+    # bingads and requests exceptions are matched by name, without importing them.
+    def make(name, base=Exception):
+        return type(name, (base,), {})('error')
+
+    assert classify_error(make('FileDownloadException')) == TRANSIENT
+    assert classify_error(make('ConnectionError', OSError)) == TRANSIENT
+    assert classify_error(make('ReadTimeout', OSError)) == TRANSIENT
+    # A report that is not ready within the tracking timeout is not tracked again.
+    assert classify_error(make('TimeoutException')) == PERMANENT
+
+
+def test_classify_error_operation_errors():
+    ex = FakeWebFault()
+    ex.fault.detail = SimpleNamespace(ApiFault=SimpleNamespace(OperationErrors=SimpleNamespace(
+        OperationError=SimpleNamespace(Code=None, ErrorCode='CallRateExceeded'))))
+    assert classify_error(ex) == THROTTLING
+
+
+class Flaky(object):
+    def __init__(self, *errors):
+        self.errors = list(errors)
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return 'done'
+
+
+def test_call_with_retry_retries_transient_errors():
+    func = Flaky(FakeWebFault('0'), FakeWebFault('117'))
+    delays = []
+    assert call_with_retry(func, RetryPolicy(jitter=0), sleep=delays.append) == 'done'
+    assert func.calls == 3
+    # Throttling starts from the longer delay.
+    assert delays == [2.0, 60.0]
+
+
+def test_call_with_retry_raises_permanent_errors_right_away():
+    func = Flaky(FakeWebFault('1001'))
+    with pytest.raises(FakeWebFault):
+        call_with_retry(func, sleep=lambda delay: None)
+    assert func.calls == 1
+
+
+def test_call_with_retry_stops_after_max_attempts():
+    func = Flaky(*[FakeWebFault('0')] * 5)
+    with pytest.raises(FakeWebFault):
+        call_with_retry(func, RetryPolicy(max_attempts=3), sleep=lambda delay: None)
+    assert func.calls == 3
+
+
+def test_call_with_retry_spends_the_shared_budget():
+    budget = RetryBudget(1)
+    func = Flaky(*[FakeWebFault('0')] * 3)
+    with pytest.raises(FakeWebFault):
+        call_with_retry(func, budget=budget, sleep=lambda delay: None)
+    assert func.calls == 2
+    assert budget.remaining == 0
+
+
+def test_call_with_retry_refreshes_on_auth_errors():
+    refreshes = []
+    func = Flaky(FakeWebFault('109'))
+    assert call_with_retry(func, on_auth_error=lambda: refreshes.append(True), sleep=lambda delay: None) == 'done'
+    assert refreshes == [True]
+    with pytest.raises(FakeWebFault):
+        call_with_retry(Flaky(FakeWebFault('109')), sleep=lambda delay: None)
+
+
+def test_call_with_retry_reports_retries():
+    retries = []
+    call_with_retry(Flaky(ConnectionResetError()), RetryPolicy(jitter=0),
+                    on_retry=lambda ex, category, attempt, delay: retries.append((category, attempt, delay)),
+                    sleep=lambda delay: None)
+    assert retries == [(TRANSIENT, 1, 2.0)]
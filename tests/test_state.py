@@ -0,0 +1,102 @@
+import datetime as dt
+import os
+
+from ms_ads import MicrosoftAdsAPI
+from ms_ads_dimensions import DimensionNormalizer, normalize_report_files
+from ms_ads_state import DOWNLOADED, AdDictionaryCache, RunJournal, WatermarkStore
+from ms_ads_transform import read_csv_rows, write_csv_rows
+
+WINDOW = (dt.datetime(2026, 10, 1), dt.datetime(2026, 10, 7))
+REPORT_KEY = 'keyword_performance_report'
+
+
+def test_watermark_narrows_the_window_to_the_days_after_the_last_final_date(tmp_path):
+    watermark_store = WatermarkStore(str(tmp_path / 'watermarks.json'), today=dt.date(2026, 10, 18))
+    watermark_store.mark_loaded('1', REPORT_KEY, dt.date(2026, 9, 18), dt.date(2026, 10, 17))
+    assert watermark_store.get_watermark('1', REPORT_KEY)['last_final_date'] == '2026-10-10'
+    assert watermark_store.get_missing_window('1', REPORT_KEY, dt.date(2026, 9, 18), dt.date(2026, 10, 17)) == (
+        dt.date(2026, 10, 11), dt.date(2026, 10, 17))
+
+
+def test_watermark_does_not_skip_the_days_before_a_recent_window(tmp_path):
+    watermark_store = WatermarkStore(str(tmp_path / 'watermarks.json'), today=dt.date(2026, 10, 18))
+    # Only restatable days were loaded: nothing is final yet.
+    watermark_store.mark_loaded('1', REPORT_KEY, dt.date(2026, 10, 14), dt.date(2026, 10, 17))
+    assert watermark_store.get_missing_window('1', REPORT_KEY, dt.date(2026, 9, 18), dt.date(2026, 10, 17)) == (
+        dt.date(2026, 9, 18), dt.date(2026, 10, 17))
+    # A window after a gap does not move the last final date past the gap.
+    watermark_store.mark_loaded('1', REPORT_KEY, dt.date(2026, 9, 1), dt.date(2026, 9, 10))
+    watermark_store.mark_loaded('1', REPORT_KEY, dt.date(2026, 9, 20), dt.date(2026, 10, 17))
+    assert watermark_store.get_missing_window('1', REPORT_KEY, dt.date(2026, 9, 1), dt.date(2026, 10, 17)) == (
+        dt.date(2026, 9, 11), dt.date(2026, 10, 17))
+
+
+def test_watermark_backfills_a_wider_window(tmp_path):
+    watermark_store = WatermarkStore(str(tmp_path / 'watermarks.json'), today=dt.date(2026, 10, 18))
+    watermark_store.mark_loaded('1', REPORT_KEY, dt.date(2026, 10, 1), dt.date(2026, 10, 17))
+    assert watermark_store.get_missing_window('1', REPORT_KEY, dt.date(2026, 9, 18), dt.date(2026, 10, 17)) == (
+        dt.date(2026, 9, 18), dt.date(2026, 10, 17))
+    watermark_store.mark_loaded('1', REPORT_KEY, dt.date(2026, 9, 18), dt.date(2026, 10, 17))
+    watermark = watermark_store.get_watermark('1', REPORT_KEY)
+    assert (watermark['first_loaded_date'], watermark['last_final_date']) == ('2026-09-18', '2026-10-10')
+    assert watermark_store.get_missing_window('1', REPORT_KEY, dt.date(2026, 9, 18), dt.date(2026, 10, 17)) == (
+        dt.date(2026, 10, 11), dt.date(2026, 10, 17))
+
+
+def start_journal(path, file_names):
+    run_journal = RunJournal(path)
+    run_journal.start(*WINDOW)
+    for file_name in file_names:
+        run_journal.record(file_name, DOWNLOADED, fingerprint='fingerprint', files=[file_name])
+    return run_journal
+
+
+def write_keyword_report(directory, account_id, account_name):
+    write_csv_rows(os.path.join(directory, '{0}_keyword_performance_report_input.csv'.format(account_id)),
+                   [['AccountId', 'AccountName', 'Clicks'], [account_id, account_name, '4']])
+
+
+def test_resumed_run_accepts_the_normalized_reports(tmp_path):
+    directory = str(tmp_path / 'files')
+    os.makedirs(directory)
+    journal_path = str(tmp_path / 'run_journal.jsonl')
+    write_keyword_report(directory, '1', 'First')
+    start_journal(journal_path, ['1_keyword_performance_report_input.csv'])
+    normalize_report_files(directory, DimensionNormalizer(), run_journal=RunJournal(journal_path))
+    # The run stopped after the normalisation: its report was replaced by the fact file.
+    run_journal = RunJournal(journal_path)
+    assert not os.path.exists(os.path.join(directory, '1_keyword_performance_report_input.csv'))
+    assert run_journal.is_file_present(directory, '1_keyword_performance_report_input.csv')
+    # The resumed run downloads account 2 again; the dimensions keep account 1.
+    write_keyword_report(directory, '2', 'Second')
+    normalize_report_files(directory, DimensionNormalizer(), run_journal=run_journal)
+    assert list(read_csv_rows(os.path.join(directory, 'account_dimension_input.csv')))[1:] == [
+        ['1', 'First', ''], ['2', 'Second', '']]
+    assert sorted(os.listdir(directory)) == ['1_keyword_performance_report_facts_input.csv',
+                                             '2_keyword_performance_report_facts_input.csv',
+                                             'account_dimension_input.csv']
+
+
+def test_resumed_run_accepts_the_merged_ads_dictionary(tmp_path):
+    extractor = MicrosoftAdsAPI('client_id', 'developer_token', 'production', 'refresh_token', 'client_state')
+    extractor.FILE_DIRECTORY = str(tmp_path / 'files')
+    os.makedirs(extractor.FILE_DIRECTORY)
+    journal_path = str(tmp_path / 'run_journal.jsonl')
+    merged_file_name = 'all_accounts_ads_dictionary_report_input.csv'
+    header = ['AccountId', 'AdId', 'AdTitle']
+    write_csv_rows(os.path.join(extractor.FILE_DIRECTORY, '1_ads_dictionary_report_input.csv'),
+                   [header, ['1', '10', 'First']])
+    run_journal = start_journal(journal_path, ['1_ads_dictionary_report_input.csv'])
+    extractor.merge_ads_dictionary_files(AdDictionaryCache(None), ['1', '2'], run_journal)
+    run_journal.record_files_uploaded(['all_accounts_ads_dictionary_report_output.csv'])
+    # The run stopped before saving the cache; account 2 is downloaded again by the resumed run.
+    run_journal = RunJournal(journal_path)
+    assert run_journal.is_file_present(extractor.FILE_DIRECTORY, '1_ads_dictionary_report_input.csv')
+    write_csv_rows(os.path.join(extractor.FILE_DIRECTORY, '2_ads_dictionary_report_input.csv'),
+                   [header, ['2', '20', 'Second']])
+    extractor.merge_ads_dictionary_files(AdDictionaryCache(None), ['1', '2'], run_journal)
+    assert os.listdir(extractor.FILE_DIRECTORY) == [merged_file_name]
+    assert list(read_csv_rows(os.path.join(extractor.FILE_DIRECTORY, merged_file_name))) == [
+        header, ['1', '10', 'First'], ['2', '20', 'Second']]
+    # The merged file holds new rows, so it is loaded again.
+    assert not run_journal.is_file_uploaded('all_accounts_ads_dictionary_report_output.csv')
@@ -0,0 +1,146 @@
+import datetime as dt
+import os
+
+import pytest
+
+import ms_ads_uploads
+from ms_ads_state import RunJournal
+from ms_ads_transform import write_csv_rows
+from ms_ads_uploads import DataUploader, LocalLoadClient
+
+KEYWORD_TABLE = 'microsoft_ads_keyword_performance_table'
+
+
+@pytest.fixture
+def no_schema(monkeypatch):
+    # Declared schemas are built from google.cloud.bigquery; without them every table is
+    # loaded as csv, like the reports without a schema.
+    monkeypatch.setattr(ms_ads_uploads, 'get_table_schema', lambda table_name, column_profiles=None: None)
+
+
+def read_load(load):
+    with open(load[2], 'rb') as load_file:
+        return load_file.read().decode('utf-8')
+
+
+def write_report(directory, file_name, rows):
+    write_csv_rows(os.path.join(str(directory), file_name), rows)
+
+
+def test_upload_rows_writes_one_csv_load(tmp_path, no_schema):
+    load_client = LocalLoadClient(str(tmp_path / 'loads'))
+    uploader = DataUploader(load_client=load_client, batch_size=2)
+    uploader.upload_batches(KEYWORD_TABLE, [[['AccountId', 'Clicks'], ['1', '4']], [['2', '5'], ['3', '6']]])
+    assert [load[:2] for load in load_client.loads] == [(KEYWORD_TABLE, 'CSV')]
+    assert read_load(load_client.loads[0]).splitlines() == ['AccountId,Clicks', '1,4', '2,5', '3,6']
+
+
+def test_execute_uploader_loads_each_table_once(tmp_path, no_schema):
+    reports = tmp_path / 'reports'
+    reports.mkdir()
+    write_report(reports, '1_keyword_performance_report_output.csv', [['AccountId', 'Clicks'], ['1', '4']])
+    write_report(reports, '2_keyword_performance_report_output.csv', [['AccountId', 'Clicks'], ['2', '5']])
+    write_report(reports, '1_goals_funnels_report_output.csv', [['AccountId', 'Goal'], ['1', 'Sign-up']])
+    write_report(reports, 'notes.txt', [['not a report']])
+    load_client = LocalLoadClient(str(tmp_path / 'loads'))
+    assert DataUploader(load_client=load_client).execute_uploader(str(reports)) == []
+    loads = dict((load[0], read_load(load).splitlines()) for load in load_client.loads)
+    assert loads == {
+        KEYWORD_TABLE: ['AccountId,Clicks', '1,4', '2,5'],
+        'microsoft_ads_goals_funnels_table': ['AccountId,Goal', '1,Sign-up'],
+    }
+
+
+def test_upload_rows_as_parquet(tmp_path):
+    pytest.importorskip('google.cloud.bigquery')
+    pq = pytest.importorskip('pyarrow.parquet')
+    load_client = LocalLoadClient(str(tmp_path / 'loads'))
+    uploader = DataUploader(load_client=load_client, source_format='parquet')
+    schema = uploader.get_schema(KEYWORD_TABLE)
+    header = [field.name for field in schema]
+    row = ['--' if field.field_type != 'STRING' else 'value' for field in schema]
+    uploader.upload_rows(KEYWORD_TABLE, [header, row])
+    assert [load[:2] for load in load_client.loads] == [(KEYWORD_TABLE, 'PARQUET')]
+    table = pq.read_table(load_client.loads[0][2])
+    assert table.column_names == header
+    assert table.num_rows == 1
+
+
+class FailingLoadClient(LocalLoadClient):
+    def __init__(self, directory, failing_table_name):
+        super(FailingLoadClient, self).__init__(directory)
+        self.failing_table_name = failing_table_name
+
+    def load_file(self, table_name, file_object, source_format, schema=None, merge_key=None):
+        if table_name == self.failing_table_name:
+            raise RuntimeError('load failed')
+        return super(FailingLoadClient, self).load_file(table_name, file_object, source_format, schema, merge_key)
+
+
+def test_execute_uploader_keeps_going_after_a_failed_table(tmp_path, no_schema):
+    reports = tmp_path / 'reports'
+    reports.mkdir()
+    write_report(reports, '1_goals_funnels_report_output.csv', [['AccountId', 'Clicks'], ['1', '4']])
+    write_report(reports, '1_search_query_performance_report_output.csv', [['AccountId', 'Clicks'], ['1', '4']])
+    load_client = FailingLoadClient(str(tmp_path / 'loads'), 'microsoft_ads_goals_funnels_table')
+    failures = DataUploader(load_client=load_client).execute_uploader(str(reports))
+    assert [(table_name, str(ex)) for table_name, ex in failures] == [
+        ('microsoft_ads_goals_funnels_table', 'load failed')]
+    assert [load[0] for load in load_client.loads] == ['microsoft_ads_search_query_performance_table']
+
+
+def test_execute_uploader_skips_the_files_of_an_interrupted_run(tmp_path, no_schema):
+    reports = tmp_path / 'reports'
+    reports.mkdir()
+    write_report(reports, '1_keyword_performance_report_output.csv', [['AccountId', 'Clicks'], ['1', '4']])
+    write_report(reports, '1_search_query_performance_report_output.csv', [['AccountId', 'Clicks'], ['1', '4']])
+    run_journal = RunJournal(str(tmp_path / 'run_journal.jsonl'))
+    run_journal.start(dt.datetime(2026, 10, 1), dt.datetime(2026, 10, 7))
+    run_journal.record_files_uploaded(['1_keyword_performance_report_output.csv'])
+    load_client = LocalLoadClient(str(tmp_path / 'loads'))
+    DataUploader(load_client=load_client).execute_uploader(str(reports), run_journal)
+    assert [load[0] for load in load_client.loads] == ['microsoft_ads_search_query_performance_table']
+    assert run_journal.uploaded_files == {'1_keyword_performance_report_output.csv',
+                                          '1_search_query_performance_report_output.csv'}
+
+
+def test_resumed_run_loads_the_reports_it_downloads_again(tmp_path, no_schema):
+    reports = tmp_path / 'reports'
+    reports.mkdir()
+    journal_path = str(tmp_path / 'run_journal.jsonl')
+    # The first run got account 1's report but not account 2's; its upload loaded what it had.
+    write_report(reports, '1_keyword_performance_report_output.csv', [['AccountId', 'Clicks'], ['1', '4']])
+    run_journal = RunJournal(journal_path)
+    run_journal.start(dt.datetime(2026, 10, 1), dt.datetime(2026, 10, 7))
+    load_client = LocalLoadClient(str(tmp_path / 'loads'))
+    assert DataUploader(load_client=load_client).execute_uploader(str(reports), run_journal) == []
+    # The resumed run downloads account 2's report into the same table.
+    write_report(reports, '2_keyword_performance_report_output.csv', [['AccountId', 'Clicks'], ['2', '5']])
+    run_journal = RunJournal(journal_path)
+    assert run_journal.start(dt.datetime(2026, 10, 1), dt.datetime(2026, 10, 7))
+    assert DataUploader(load_client=load_client).execute_uploader(str(reports), run_journal) == []
+    assert [read_load(load).splitlines() for load in load_client.loads] == [
+        ['AccountId,Clicks', '1,4'], ['AccountId,Clicks', '2,5']]
+
+
+def test_execute_uploader_merges_dimension_tables(tmp_path, no_schema):
+    reports = tmp_path / 'reports'
+    reports.mkdir()
+    write_report(reports, '1_keyword_performance_report_output.csv', [['AccountId', 'Clicks'], ['1', '4']])
+    write_report(reports, 'ad_dimension_output.csv', [['AdId', 'FinalUrl'], ['7', 'https://example.com']])
+    load_client = LocalLoadClient(str(tmp_path / 'loads'))
+    DataUploader(load_client=load_client).execute_uploader(str(reports))
+    loads = dict((load[0], read_load(load).splitlines()) for load in load_client.loads)
+    assert loads['microsoft_ads_ad_dimension_table'] == ['AdId,FinalUrl', '7,https://example.com']
+    # Dimension tables are merged on their key instead of appended to.
+    assert load_client.merge_keys == {'microsoft_ads_ad_dimension_table': 'AdId'}
+
+
+def test_execute_uploader_routes_profiled_reports(tmp_path, no_schema):
+    reports = tmp_path / 'reports'
+    reports.mkdir()
+    write_report(reports, '1_keyword_performance_report_output.csv', [['AccountId', 'Clicks'], ['1', '4']])
+    load_client = LocalLoadClient(str(tmp_path / 'loads'))
+    DataUploader(load_client=load_client, column_profiles={'keyword_performance_report': 'core_metrics'}) \
+        .execute_uploader(str(reports))
+    assert [load[0] for load in load_client.loads] == [KEYWORD_TABLE + '_core_metrics']